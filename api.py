@@ -1,28 +1,77 @@
+import time
 import requests
+from urllib.parse import urlsplit
+from http_client import get_client
+from metrics import UPSTREAM_SECONDS
+from upstream import NoUpstreamError, UpstreamPool
 
 class Api:
-    def __init__(self, db):
-        dns_url = db.get_dns_url_random() # Esta función debería obtener una URL aleatoria de la tabla server_dns
-        self.dns_url = dns_url
+    def __init__(self, db, http=None):
+        # Cliente HTTP compartido (keep-alive, timeouts, reintentos y circuit breaker por host)
+        self.http = http or get_client()
+        # Todos los servidores de la tabla server_dns, con chequeo de salud en segundo plano
+        self.upstreams = UpstreamPool(db.get_dns_urls, self.http)
+
+    @property
+    def dns_url(self):
+        return self.upstreams.pick()
+
+    def _get(self, path, params, method):
+        # Si un servidor falla se reintenta una vez con otro distinto
+        tried = []
+        last_error = None
+        while True:
+            dns_url = self.upstreams.pick(exclude=tried)
+            if dns_url is None:
+                # No other server left to try (only after a failure: the first pick always returns one).
+                if last_error is None:
+                    raise NoUpstreamError("no upstream panel to try")
+                raise last_error
+            host = urlsplit(dns_url).netloc
+            start = time.monotonic()
+            try:
+                response = self.http.get(dns_url + path, params=params)
+            except requests.RequestException as e:
+                UPSTREAM_SECONDS.observe(time.monotonic() - start, method, host, "error")
+                self.upstreams.report_failure(dns_url, e)
+                tried.append(dns_url)
+                if len(tried) >= 2:
+                    raise
+                last_error = e
+                continue
+            elapsed = time.monotonic() - start
+            if response.status_code >= 500:
+                UPSTREAM_SECONDS.observe(elapsed, method, host, "5xx")
+                self.upstreams.report_failure(dns_url)
+            else:
+                UPSTREAM_SECONDS.observe(elapsed, method, host, "ok")
+                self.upstreams.report_success(dns_url, elapsed)
+            return response
     
     def get_user_info(self, username, password, app):
-        app.logger.info('DNS URL: {}'.format(self.dns_url))
-
-        # Realizar la solicitud HTTP con los datos de usuario a la URL obtenida
-        response = requests.get(self.dns_url + '/player_api.php', params={'username': username, 'password': password})
+        # Realizar la solicitud HTTP con los datos de usuario a uno de los servidores
+        response = self._get('/player_api.php', {'username': username, 'password': password}, 'get_user_info')
+        app.logger.info('DNS URL: {}'.format(response.url.split('/player_api.php')[0]))
         
         return response
     
     def get_categories(self, username, password):
-        response = requests.get(self.dns_url + '/player_api.php',
-                                params={'username': username, 'password': password, 'action': 'get_live_categories'})
+        response = self._get('/player_api.php', {'username': username, 'password': password, 'action': 'get_live_categories'}, 'get_categories')
         
         return response
     
+    def get_action(self, username, password, action, params=None):
+        # Acciones de player_api (VOD/series) pedidas con la cuenta de sincronización
+        query = {'username': username, 'password': password, 'action': action}
+        query.update(params or {})
+        return self._get('/player_api.php', query, action)
+
     def get_redirect(self, path):
         redirect_url = self.dns_url + '/' + path
         return redirect_url
     
     def get_server_url(self):
         return self.dns_url
-   
+
+    def get_upstream_stats(self):
+        return {"hosts": self.upstreams.stats(), "http": self.http.stats()}
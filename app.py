@@ -1,16 +1,34 @@
-from flask import Flask, request, jsonify, redirect, send_file
+from flask import Flask, request, jsonify, redirect, json
 import os
+import re
 import time
-from threading import Lock
-from urllib.parse import urlencode, urlsplit, urlunsplit, parse_qsl
+import itertools
+import requests
+from urllib.parse import quote, urlencode, urlsplit, urlunsplit, parse_qsl
 from database import Database
 from api import Api
-
-#  TODO EPG action=get_simple_data_table&stream_id=id Perfect player APP
+from catalog import CatalogCache
+from auth import AuthCache
+from ratelimit import RateLimiter
+from responses import negotiated_response, send_precompressed_file
+from epg import EPG_GUIDE_PATH, EpgIndex
+from metrics import REGISTRY, REQUESTS_TOTAL, REQUEST_SECONDS
+from hls import HlsCache, HlsUpstreamError, PLAYLIST_MIMETYPE, SEGMENT_MIMETYPES
+from vod import VOD_PASSWORD, VOD_USERNAME, VOD_CACHE_ENABLED, VodCache, VodUpstreamError
+from relay import RELAY_ENABLED, RELAY_PUBLIC_URL, RELAY_SECRET, relay_url
+from scheduler import SyncScheduler
+from playlist import M3U_BASE_URL, M3U_MIMETYPE, OUTPUT_EXTENSIONS, PlaylistCache, render_m3u, splice
 
 app = Flask(__name__)
 db = Database(app)
 api = Api(db)
+catalog_cache = CatalogCache(db.get_catalog_version)
+auth_cache = AuthCache()
+epg_index = EpgIndex(os.path.join(app.root_path, EPG_GUIDE_PATH))
+hls_cache = HlsCache(api.http)
+playlist_cache = PlaylistCache(catalog_cache.current_version)
+# Category/stream syncs on a background thread (SYNC_SCHEDULER_ENABLED), using the pool and shared HTTP client.
+sync_scheduler = SyncScheduler(db.connection)
 
 # Obtener las variables de entorno
 PORT = os.environ.get('PORT') or 5000
@@ -23,12 +41,78 @@ def _env_bool(name: str, default: bool = False) -> bool:
 
 DEBUG = _env_bool('DEBUG', False)
 
-# Simple in-process rate limiting (best-effort; for real protection use a reverse proxy).
+# Stream large lists (get_live_streams) as chunked JSON when the catalog cache is disabled.
+CATALOG_STREAMING = _env_bool("CATALOG_STREAMING", True)
+_JSON_CHUNK_SIZE = 64 * 1024
+
+# Live MPEG-TS through the fan-out relay (relay.py) instead of a redirect to the panel.
+RELAY_ACTIVE = RELAY_ENABLED and bool(RELAY_PUBLIC_URL and RELAY_SECRET)
+if RELAY_ENABLED and not RELAY_ACTIVE:
+    app.logger.warning("RELAY_ENABLED is set but RELAY_PUBLIC_URL or RELAY_SECRET is missing; redirecting to the panel")
+_LIVE_TS_PATH = re.compile(r"live/([^/]+)/([^/]+)/(\d+)\.ts")
+_LIVE_M3U8_PATH = re.compile(r"live/([^/]+)/([^/]+)/(\d+)\.m3u8")
+
+# Token-bucket rate limiting per client IP (see ratelimit.py; for real protection also use a reverse proxy).
 _RATE_LIMIT_PLAYER_API_PER_MINUTE = int(os.environ.get("RATE_LIMIT_PLAYER_API_PER_MINUTE", "30"))
 _RATE_LIMIT_REDIRECT_PER_MINUTE = int(os.environ.get("RATE_LIMIT_REDIRECT_PER_MINUTE", "120"))
 _TRUST_PROXY_HEADERS = _env_bool("TRUST_PROXY_HEADERS", False)
-_RATE_STATE: dict[tuple[str, str], tuple[float, int]] = {}
-_RATE_LOCK = Lock()
+rate_limiter = RateLimiter()
+
+# /metrics (Prometheus text, summed over every worker). If set, scrapers must send "Authorization: Bearer <token>".
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+# Known player_api actions get their own label; anything else is counted as "other".
+_METRIC_ACTIONS = frozenset({
+    "get_live_categories", "get_live_streams", "get_short_epg", "get_simple_data_table",
+    "get_vod_categories", "get_vod_streams", "get_vod_info",
+    "get_series_categories", "get_series", "get_series_info",
+})
+
+def _component_metrics():
+    """Counters and gauges kept by the pool, caches, rate limiter and upstream client."""
+    for key, value in db.pool.stats().items():
+        if key == "size":
+            yield "xtream_db_pool_size", "gauge", "Maximum database connections per worker.", {}, value
+        elif key in ("open", "idle", "in_use"):
+            yield "xtream_db_pool_connections", "gauge", "Database pool connections by state.", {"state": key}, value
+        else:
+            yield f"xtream_db_pool_{key}_total", "counter", f"Database pool {key.replace('_', ' ')}.", {}, value
+    catalog = catalog_cache.stats()
+    auth = auth_cache.stats()
+    vod = vod_cache.stats()
+    for cache, stats in (("catalog", catalog), ("auth", auth["positive"]), ("auth_negative", auth["negative"]),
+                         ("vod", {"hits": vod["hits"] + vod["stale_hits"], "misses": vod["misses"]}),
+                         ("playlist", playlist_cache.stats())):
+        yield "xtream_cache_hits_total", "counter", "Cache hits.", {"cache": cache}, stats["hits"]
+        yield "xtream_cache_misses_total", "counter", "Cache misses.", {"cache": cache}, stats["misses"]
+    yield "xtream_vod_cache_stale_hits_total", "counter", "VOD responses served past their TTL while refreshing.", {}, vod["stale_hits"]
+    yield "xtream_vod_cache_refresh_errors_total", "counter", "Failed background VOD refreshes.", {}, vod["errors"]
+    yield "xtream_vod_cache_bytes", "gauge", "Compressed bytes held by the VOD cache.", {}, vod["bytes"]
+    yield "xtream_auth_upstream_logins_total", "counter", "Upstream user_info calls (after single-flight).", {}, auth["upstream_logins"]
+    yield "xtream_auth_coalesced_total", "counter", "Logins that waited on another request's upstream call.", {}, auth["coalesced"]
+    yield "xtream_auth_refreshes_total", "counter", "Background user_info refreshes started.", {}, auth["refreshes"]
+    limiter = rate_limiter.stats()
+    for result in ("allowed", "rejected"):
+        for key, value in limiter[result].items():
+            yield "xtream_rate_limit_requests_total", "counter", "Rate-limited requests by bucket and result.", {"key": key, "result": result}, value
+    yield "xtream_rate_limit_errors_total", "counter", "Rate limiter backend failures (requests let through).", {}, limiter["errors"]
+    for host, stats in api.http.stats().items():
+        for key in ("requests", "errors", "retries", "rejected"):
+            yield f"xtream_upstream_http_{key}_total", "counter", f"Upstream HTTP {key} per host.", {"host": host}, stats[key]
+        yield "xtream_upstream_circuit_open", "gauge", "1 while the host's circuit breaker is open.", {"host": host}, int(stats["circuit"] == "open")
+    for url, stats in api.upstreams.stats().items():
+        yield "xtream_upstream_healthy", "gauge", "1 while the panel passes health checks.", {"host": urlsplit(url).netloc}, int(stats["healthy"])
+    if hls_cache.enabled:
+        for stream_id, counts in hls_cache.channel_stats().items():
+            for kind in ("playlist", "segment"):
+                labels = {"channel": stream_id, "kind": kind}
+                yield "xtream_hls_hits_total", "counter", "HLS cache hits per channel.", labels, counts[kind + "_hits"]
+                yield "xtream_hls_misses_total", "counter", "HLS cache misses per channel.", labels, counts[kind + "_misses"]
+        yield "xtream_hls_coalesced_total", "counter", "HLS misses that waited on another request's upstream fetch.", {}, hls_cache.stats()["single_flight"]["shared"]
+        store = hls_cache.segments.stats()
+        for tier in ("memory", "disk"):
+            yield "xtream_hls_segment_bytes", "gauge", "Bytes of HLS segments cached per tier.", {"tier": tier}, store[tier + "_bytes"]
+
+REGISTRY.register_callback(_component_metrics)
 
 def _client_ip() -> str:
     if _TRUST_PROXY_HEADERS:
@@ -40,19 +124,7 @@ def _client_ip() -> str:
 
 def _rate_limit(key: str, per_minute: int) -> bool:
     """Return True if allowed, False if rate-limited."""
-    if per_minute <= 0:
-        return True
-    window_seconds = 60.0
-    now = time.time()
-    ip = _client_ip()
-    state_key = (ip, key)
-    with _RATE_LOCK:
-        window_start, count = _RATE_STATE.get(state_key, (now, 0))
-        if now - window_start >= window_seconds:
-            window_start, count = now, 0
-        count += 1
-        _RATE_STATE[state_key] = (window_start, count)
-        return count <= per_minute
+    return rate_limiter.allow(key, _client_ip(), per_minute)
 
 def _redact_url(url: str) -> str:
     """Redact sensitive query params like username/password."""
@@ -70,6 +142,132 @@ def _redact_url(url: str) -> str:
     except Exception:
         return "<redacted>"
 
+def _json_pretty() -> bool:
+    return bool(app.config["JSONIFY_PRETTYPRINT_REGULAR"] or app.debug)
+
+def _json_bytes(data) -> bytes:
+    """Serialize exactly like ``jsonify`` so cached bodies are byte-identical."""
+    indent = None
+    separators = (",", ":")
+    if _json_pretty():
+        indent = 2
+        separators = (", ", ": ")
+    return f"{json.dumps(data, indent=indent, separators=separators)}\n".encode("utf-8")
+
+def _json_chunks(rows):
+    """Encode dicts one by one as a JSON list; same bytes as ``_json_bytes(list(rows))`` (compact mode)."""
+    chunk = [b"["]
+    size = 1
+    for i, row in enumerate(rows):
+        piece = json.dumps(row, separators=(",", ":")).encode("utf-8")
+        if i:
+            chunk.append(b",")
+        chunk.append(piece)
+        size += len(piece) + 1
+        if size >= _JSON_CHUNK_SIZE:
+            yield b"".join(chunk)
+            chunk = []
+            size = 0
+    chunk.append(b"]\n")
+    yield b"".join(chunk)
+
+def _catalog_response(key: tuple, loader):
+    return _cached_body_response(key, lambda: _json_bytes(loader()))
+
+def _cached_body_response(key: tuple, build):
+    entry = catalog_cache.get(key, build)
+    return negotiated_response(
+        app.response_class,
+        entry.body,
+        entry.etag,
+        entry.last_modified,
+        app.config["JSONIFY_MIMETYPE"],
+        gzipped=entry.gzipped,
+    )
+
+def _catalog_list_response(key: tuple, rows_loader):
+    """Large catalog lists, encoded row by row from ``db.iter_streams`` pages.
+
+    With the catalog cache on, the cached body is built without an intermediate
+    list of dicts; with it off the rows are streamed as a chunked response.
+    """
+    if _json_pretty():
+        return _catalog_response(key, lambda: list(rows_loader()))
+    if catalog_cache.enabled or not CATALOG_STREAMING:
+        return _cached_body_response(key, lambda: b"".join(_json_chunks(rows_loader())))
+    rows = rows_loader()
+    # Run the query now, so database errors still become a normal error response.
+    first = next(rows, None)
+    rows = itertools.chain([first], rows) if first is not None else iter(())
+    return app.response_class(_json_chunks(rows), mimetype=app.config["JSONIFY_MIMETYPE"])
+
+# (catalog version, {stream_id: epg_channel_id}); rebuilt when a sync bumps the version.
+_epg_channels = (None, {})
+
+def _epg_channel_id(stream_id):
+    global _epg_channels
+    version, _ = catalog_cache.current_version()
+    if _epg_channels[0] != version:
+        _epg_channels = (version, db.get_stream_epg_channels())
+    try:
+        return _epg_channels[1].get(int(stream_id))
+    except (TypeError, ValueError):
+        return None
+
+def _epg_response(stream_id, limit):
+    """Serve get_short_epg/get_simple_data_table from the local guide index."""
+    channel_id = _epg_channel_id(stream_id)
+    if limit is None:
+        listings = epg_index.listings(channel_id, with_status=True)
+    else:
+        listings = epg_index.listings(channel_id, limit=limit)
+    return jsonify({"epg_listings": listings})
+
+def _fetch_vod(action, params):
+    response = api.get_action(VOD_USERNAME, VOD_PASSWORD, action, params)
+    if response.status_code != 200:
+        raise VodUpstreamError(f"{action}: HTTP {response.status_code}")
+    body = response.content
+    try:
+        data = json.loads(body)
+    except ValueError:
+        raise VodUpstreamError(f"{action}: body is not JSON")
+    if not isinstance(data, (list, dict)):
+        raise VodUpstreamError(f"{action}: unexpected body")
+    # A rejected line still answers 200 (user_info with auth 0); never cache that for everyone.
+    user_info = data.get("user_info") if isinstance(data, dict) else None
+    if isinstance(user_info, dict) and not user_info.get("auth"):
+        raise VodUpstreamError(f"{action}: line rejected by the panel")
+    return body
+
+vod_cache = VodCache(_fetch_vod, enabled=VOD_CACHE_ENABLED and bool(VOD_USERNAME and VOD_PASSWORD))
+
+def _vod_response(action):
+    """Cached VOD/series response, or None to fall back to the redirect."""
+    key = vod_cache.key_for(action, request.args)
+    if key is None:
+        return None
+    try:
+        entry = vod_cache.get(key)
+    except (VodUpstreamError, requests.RequestException) as e:
+        app.logger.warning("VOD cache miss for %s could not be filled: %s", action, e)
+        return None
+    return negotiated_response(app.response_class, entry.body, entry.etag, entry.last_modified,
+                               app.config["JSONIFY_MIMETYPE"], gzipped=entry.gzipped)
+
+def _hls_response(fetch, mimetype):
+    try:
+        body = fetch()
+    except HlsUpstreamError as e:
+        return jsonify({"error": "upstream_status", "status": e.status}), 404 if e.status == 404 else 502
+    response = app.response_class(body, mimetype=mimetype)
+    if mimetype == PLAYLIST_MIMETYPE:
+        response.headers["Cache-Control"] = "no-cache"
+    else:
+        # Segments never change once published.
+        response.headers["Cache-Control"] = "public, max-age=300"
+    return response
+
 def _is_user_active_and_not_expired(user_info: dict) -> bool:
     # Xtream-style payloads typically include: auth (1/0), status ("Active"), exp_date (unix timestamp string)
     try:
@@ -89,10 +287,86 @@ def _is_user_active_and_not_expired(user_info: dict) -> bool:
     except Exception:
         return False
 
+def _fetch_upstream_user_info(username: str, password: str):
+    """Check credentials against the upstream panel; return (user_info, server_info) or None."""
+    response = api.get_user_info(username, password, app)
+    if response.status_code != 200:
+        return None
+    try:
+        payload = response.json()
+    except Exception:
+        return None
+    user_info = (payload or {}).get("user_info") or {}
+    server_info = (payload or {}).get("server_info") or {}
+    if not _is_user_active_and_not_expired(user_info):
+        return None
+    return user_info, server_info
+
+def _upstream_login(username: str, password: str, current=None):
+    """Check the credentials with the panel and store the result; one call per credentials at a time.
+
+    Returns the new AuthEntry, or ``current`` if the panel didn't confirm them
+    (None for first logins; the stored copy is kept on failed refreshes).
+    """
+    def load():
+        fetched = _fetch_upstream_user_info(username, password)
+        if fetched is None:
+            return current
+        user_info, server_info = fetched
+        user_id = current.user_id if current is not None else db.save_user(username, password)
+        db.save_user_server_info(user_id, user_info, server_info)
+        return auth_cache.put(username, password, user_id, {"user_info": user_info, "server_info": server_info},
+                              fetched_at=time.time())
+    return auth_cache.load(username, password, load)
+
+def _authenticate(username: str, password: str):
+    """Return the cached AuthEntry for valid credentials, or None if they must be rejected."""
+    entry = auth_cache.get(username, password)
+    if entry is None:
+        if auth_cache.is_denied(username, password):
+            return None
+        user = db.get_user(username, password)
+        if user is not None:
+            info, updated_at = db.get_user_server_info_record(user["id"])
+            entry = auth_cache.put(username, password, user["id"], info, fetched_at=updated_at)
+        elif db.verify_authentication(username, password):
+            # Known locally but not active.
+            return None
+        else:
+            entry = _upstream_login(username, password)
+            if entry is None:
+                auth_cache.deny(username, password)
+            return entry
+
+    # Stale-while-revalidate: answer with the stored copy, refresh it off the request path.
+    if entry.needs_refresh():
+        auth_cache.refresh_later(username, password, lambda: _upstream_login(username, password, entry))
+    return entry
+
+@app.before_request
+def _start_request_timer():
+    request.environ["xtream.start"] = time.perf_counter()
+
+@app.after_request
+def _record_request_metrics(response):
+    start = request.environ.get("xtream.start")
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        action = ""
+        if request.path == "/player_api.php":
+            action = request.args.get("action", "")
+            if action and action not in _METRIC_ACTIONS:
+                action = "other"
+        REQUEST_SECONDS.observe(time.perf_counter() - start, route, action)
+        REQUESTS_TOTAL.inc(route, action, str(response.status_code))
+        REGISTRY.ensure_flusher()
+    sync_scheduler.ensure_started()
+    return response
+
 @app.before_request
 def _bot_mitigation_guardrails():
     # Rate limit the noisiest endpoints first.
-    if request.path == "/player_api.php":
+    if request.path in ("/player_api.php", "/get.php"):
         if not _rate_limit("player_api", _RATE_LIMIT_PLAYER_API_PER_MINUTE):
             return jsonify({"error": "rate_limited"}), 429
     else:
@@ -101,10 +375,38 @@ def _bot_mitigation_guardrails():
             if not _rate_limit("redirect", _RATE_LIMIT_REDIRECT_PER_MINUTE):
                 return jsonify({"error": "rate_limited"}), 429
 
+@app.errorhandler(requests.RequestException)
+def _upstream_unavailable(error):
+    # The panel is down, timing out, or its circuit breaker is open. The message of a
+    # requests error contains the URL with the subscriber's credentials: log it redacted.
+    upstream_request = getattr(error, "request", None)
+    url = getattr(upstream_request, "url", None)
+    app.logger.warning("Upstream request failed: %s%s", type(error).__name__,
+                       " ({})".format(_redact_url(url)) if url else "")
+    return jsonify({"error": "upstream_unavailable"}), 502
+
 # Endpoints
 # Endpoint que redirecciona a otra URL reemplazando la URL original y agregando el resto del path
 @app.route("/<path:path_to_complete>")
 def redirect_url(path_to_complete):
+    if RELAY_ACTIVE:
+        match = _LIVE_TS_PATH.fullmatch(path_to_complete)
+        if match:
+            username, password, stream_id = match.groups()
+            # The relay uses its own panel line, so the viewer is checked here.
+            if _authenticate(username, password) is None:
+                return jsonify({"error": "authentication_failed"}), 401
+            return redirect(relay_url(stream_id, api.get_server_url()))
+    if hls_cache.enabled:
+        match = _LIVE_M3U8_PATH.fullmatch(path_to_complete)
+        if match:
+            username, password, stream_id = match.groups()
+            # Playlists are fetched with the cache's own line, so the viewer is checked here.
+            if _authenticate(username, password) is None:
+                return jsonify({"error": "authentication_failed"}), 401
+            url = hls_cache.live_url(api.get_server_url(), stream_id)
+            return _hls_response(lambda: hls_cache.playlist(stream_id, url, key=("live", stream_id)), PLAYLIST_MIMETYPE)
+
     # Construir la URL de redirección con la nueva URL y el resto del path
     new_url = api.get_redirect(path_to_complete)
     
@@ -113,12 +415,66 @@ def redirect_url(path_to_complete):
     # Redireccionar a la URL construida
     return redirect(new_url)
 
+# Signed links written into playlists served by the HLS cache.
+@app.route("/hls-cache/<stream_id>/<name>")
+def hls_cache_link(stream_id, name):
+    if not hls_cache.enabled:
+        return jsonify({"error": "not_found"}), 404
+    url, ext = hls_cache.resolve(stream_id, name)
+    if url is None:
+        return jsonify({"error": "invalid_link"}), 403
+    if ext == "m3u8":
+        return _hls_response(lambda: hls_cache.playlist(stream_id, url), PLAYLIST_MIMETYPE)
+    return _hls_response(lambda: hls_cache.segment(stream_id, url),
+                         SEGMENT_MIMETYPES.get(ext, "application/octet-stream"))
+
+@app.route("/metrics")
+def metrics():
+    if METRICS_TOKEN and request.headers.get("Authorization") != f"Bearer {METRICS_TOKEN}":
+        return jsonify({"error": "unauthorized"}), 401
+    return app.response_class(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/sync/status")
+def sync_status():
+    # Last run, duration and outcome of each sync job (shared by every worker through SYNC_STATUS_PATH).
+    # Unlike /metrics it is never public: it is disabled until METRICS_TOKEN is set.
+    if not METRICS_TOKEN:
+        return jsonify({"error": "not_found"}), 404
+    if request.headers.get("Authorization") != f"Bearer {METRICS_TOKEN}":
+        return jsonify({"error": "unauthorized"}), 401
+    return jsonify(sync_scheduler.status())
+
 @app.route('/xmltv.php')
 def servir_archivo_xml():
-    # Ruta al archivo XML en tu proyecto
-    ruta_archivo_xml = 'xml/guide.xml'
-    # Devuelve el archivo XML como respuesta
-    return send_file(ruta_archivo_xml, mimetype='text/xml')
+    # Guía filtrada por sync/sync_epg.py; la copia .gz ya viene generada junto al XML.
+    # send_file responde 304/206 a peticiones condicionales y con Range.
+    return send_precompressed_file(EPG_GUIDE_PATH, mimetype='text/xml')
+
+@app.route("/get.php")
+def get_playlist():
+    username = request.args.get("username")
+    password = request.args.get("password")
+    if not username or not password:
+        return jsonify({"error": "missing_credentials"}), 400
+    if _authenticate(username, password) is None:
+        return jsonify({"error": "authentication_failed"}), 401
+
+    kind = request.args.get("type") or "m3u_plus"
+    extension = OUTPUT_EXTENSIONS.get(request.args.get("output") or "ts")
+    if kind not in ("m3u", "m3u_plus") or extension is None:
+        return jsonify({"error": "unsupported_playlist"}), 400
+
+    # Lineup del catálogo local; la plantilla se reutiliza hasta el próximo sync y solo se insertan las credenciales.
+    # Categories are read now, so database errors still become a normal error response.
+    categories = db.get_all_stream_categories()
+    chunks = playlist_cache.chunks(
+        (kind, extension), lambda: render_m3u(categories, db.iter_streams, kind == "m3u_plus", extension))
+    base_url = M3U_BASE_URL or request.host_url.rstrip("/")
+    credentials = "{}/{}".format(quote(username, safe=""), quote(password, safe=""))
+    response = app.response_class(splice(chunks, base_url, credentials), mimetype=M3U_MIMETYPE)
+    response.headers["Content-Disposition"] = 'attachment; filename="playlist.m3u"'
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
 
 @app.route("/player_api.php")
 def player_api():
@@ -134,58 +490,39 @@ def player_api():
         return jsonify({"error": "missing_credentials"}), 400
 
     # Enforce real upstream auth (and cache the result in DB).
-    if not db.verify_authentication(username, password):
-        response = api.get_user_info(username, password, app)
-
-        if response.status_code != 200:
-            return jsonify({"error": "authentication_failed"}), 401
-
-        try:
-            payload = response.json()
-        except Exception:
-            return jsonify({"error": "authentication_failed"}), 401
-
-        user_info = (payload or {}).get("user_info") or {}
-        server_info = (payload or {}).get("server_info") or {}
+    entry = _authenticate(username, password)
+    if entry is None:
+        return jsonify({"error": "authentication_failed"}), 401
 
-        if not _is_user_active_and_not_expired(user_info):
-            return jsonify({"error": "authentication_failed"}), 401
-
-        user_id = db.save_user(username, password)
-        db.save_user_server_info(user_id, user_info, server_info)
-    
     if not action:
-        user = db.get_user(username, password)
-        if not user:
-            return jsonify({"error": "authentication_failed"}), 401
-        
-        user_info = db.get_user_server_info(user["id"])
-        
-        if not user_info:
-            response = api.get_user_info(username, password, app)
-            if response.status_code != 200:
+        if entry.info is None:
+            # No stored user_info yet: concurrent requests for the same line share one upstream call.
+            entry = _upstream_login(username, password, entry)
+            if entry.info is None:
                 return jsonify({"error": "authentication_failed"}), 401
-            payload = response.json()
-            if not _is_user_active_and_not_expired((payload or {}).get("user_info") or {}):
-                return jsonify({"error": "authentication_failed"}), 401
-            db.save_user_server_info(user["id"], payload["user_info"], payload["server_info"])
-            user_info = {"user_info": payload["user_info"], "server_info": payload["server_info"]}
-        else:
-            user_info = user_info
 
-        return jsonify(user_info)
+        return jsonify(entry.info)
     else:
         if action == "get_live_categories":
-            categories_from_db = db.get_all_stream_categories()
-            return jsonify(categories_from_db)
+            return _catalog_response(("categories",), db.get_all_stream_categories)
         elif action == "get_live_streams":
             if category_id:
-                live_stream = db.get_all_streams_by_category(category_id)
-            else:
-                live_stream = db.get_all_streams()
-
-            return jsonify(live_stream)
+                return _catalog_list_response(("streams", category_id), lambda: db.iter_streams(category_id))
+            return _catalog_list_response(("streams", "all"), db.iter_streams)
+        elif action in ("get_short_epg", "get_simple_data_table") and epg_index.loaded():
+            stream_id = request.args.get("stream_id")
+            if action == "get_simple_data_table":
+                return _epg_response(stream_id, None)
+            try:
+                limit = int(request.args.get("limit") or 4)
+            except ValueError:
+                limit = 4
+            return _epg_response(stream_id, limit)
         else:
+            if vod_cache.enabled:
+                response = _vod_response(action)
+                if response is not None:
+                    return response
             if not debugger:
                 if series_id:
                     nueva_url_redireccion = "{}/player_api.php?username={}&password={}&action={}&series_id={}".format(api.get_server_url(), username, password, action, series_id)
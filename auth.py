@@ -0,0 +1,166 @@
+import os
+import time
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import TTLCache, SingleFlight
+
+logger = logging.getLogger(__name__)
+
+AUTH_CACHE_SIZE = int(os.environ.get("AUTH_CACHE_SIZE", "10000"))
+# Seconds a successful login is trusted before the database is consulted again.
+AUTH_CACHE_TTL = float(os.environ.get("AUTH_CACHE_TTL", "300"))
+# Seconds a failed upstream login is remembered, so retries don't hit the panel.
+AUTH_NEGATIVE_TTL = float(os.environ.get("AUTH_NEGATIVE_TTL", "30"))
+# Stored user_info/server_info older than this (seconds) is refreshed from the panel in the background.
+USER_INFO_MAX_AGE = float(os.environ.get("USER_INFO_MAX_AGE", "21600"))
+# Also refresh when exp_date is this close (seconds), so renewals show up before the line expires.
+USER_INFO_EXPIRY_LEAD = float(os.environ.get("USER_INFO_EXPIRY_LEAD", "86400"))
+# Minimum seconds between two refreshes of the same credentials.
+USER_INFO_MIN_REFRESH_INTERVAL = float(os.environ.get("USER_INFO_MIN_REFRESH_INTERVAL", "300"))
+USER_INFO_REFRESH_WORKERS = int(os.environ.get("USER_INFO_REFRESH_WORKERS", "2"))
+
+
+class AuthEntry:
+    __slots__ = ("user_id", "info", "fetched_at")
+
+    def __init__(self, user_id, info=None, fetched_at=None):
+        self.user_id = user_id
+        # {"user_info": ..., "server_info": ...} as returned to clients, or None
+        # until it has been loaded.
+        self.info = info
+        # Unix time the info was fetched from the panel, None if unknown.
+        self.fetched_at = fetched_at
+
+    def needs_refresh(self, now=None, max_age=USER_INFO_MAX_AGE, expiry_lead=USER_INFO_EXPIRY_LEAD,
+                      min_interval=USER_INFO_MIN_REFRESH_INTERVAL) -> bool:
+        if self.info is None or self.fetched_at is None:
+            return False
+        now = time.time() if now is None else now
+        age = now - self.fetched_at
+        if age >= max_age:
+            return True
+        if age < min_interval:
+            return False
+        exp = ((self.info or {}).get("user_info") or {}).get("exp_date")
+        if exp in (None, "", "0", 0):
+            return False
+        try:
+            return int(exp) - now <= expiry_lead
+        except (TypeError, ValueError):
+            return False
+
+
+def credentials_key(username: str, password: str) -> bytes:
+    # Never keep plain-text passwords as cache keys.
+    return hashlib.sha256(f"{username}\0{password}".encode("utf-8")).digest()
+
+
+class AuthCache:
+    """Caches authenticated credentials and recently failed logins.
+
+    Upstream logins go through :meth:`load`, so concurrent requests with the
+    same credentials share one call to the panel; :meth:`refresh_later` runs
+    the same call on a background thread while clients get the stored copy.
+
+    There is no explicit invalidation: every login or refresh that writes the
+    user to the database replaces the entry through :meth:`put`, and changes
+    made outside this process (another worker, the database itself) are picked
+    up once the entry's TTL expires.
+    """
+
+    def __init__(self, maxsize=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL, negative_ttl=AUTH_NEGATIVE_TTL,
+                 refresh_workers=USER_INFO_REFRESH_WORKERS, refresh_interval=USER_INFO_MIN_REFRESH_INTERVAL):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries = TTLCache(maxsize, ttl)
+        self._denied = TTLCache(maxsize, negative_ttl)
+        self._flight = SingleFlight()
+        self.refresh_workers = max(1, refresh_workers)
+        self.refreshes = 0
+        self.refresh_errors = 0
+        # Credentials refreshed recently (successfully or not), so a failing panel isn't retried per request.
+        self._refreshed = TTLCache(maxsize, refresh_interval)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._executor_pid = None
+
+    def _entry_ttl(self, info):
+        # Never trust an entry past the subscription's exp_date.
+        ttl = self.ttl
+        user_info = (info or {}).get("user_info") or {}
+        exp = user_info.get("exp_date")
+        if exp not in (None, "", "0", 0):
+            try:
+                ttl = min(ttl, int(exp) - time.time())
+            except (TypeError, ValueError):
+                pass
+        return ttl
+
+    def get(self, username, password):
+        if self.ttl <= 0:
+            return None
+        return self._entries.get(credentials_key(username, password))
+
+    def put(self, username, password, user_id, info=None, fetched_at=None) -> AuthEntry:
+        key = credentials_key(username, password)
+        entry = AuthEntry(user_id, info, fetched_at)
+        self._denied.pop(key)
+        if self.ttl > 0:
+            self._entries.set(key, entry, ttl=self._entry_ttl(info))
+        return entry
+
+    def is_denied(self, username, password) -> bool:
+        if self.negative_ttl <= 0:
+            return False
+        return self._denied.get(credentials_key(username, password)) is not None
+
+    def deny(self, username, password):
+        key = credentials_key(username, password)
+        self._entries.pop(key)
+        if self.negative_ttl > 0:
+            self._denied.set(key, True)
+
+    def load(self, username, password, fn):
+        """``fn()`` once for all concurrent callers with these credentials (single-flight)."""
+        return self._flight.do(credentials_key(username, password), fn)
+
+    def _pool(self):
+        # Threads don't survive fork, so each worker process gets its own pool.
+        if self._executor_pid != os.getpid():
+            self._executor = ThreadPoolExecutor(self.refresh_workers, thread_name_prefix="user-info-refresh")
+            self._executor_pid = os.getpid()
+        return self._executor
+
+    def refresh_later(self, username, password, fn) -> bool:
+        """Run ``fn`` (which should go through :meth:`load`) in the background, at most once per refresh interval."""
+        key = credentials_key(username, password)
+        with self._lock:
+            if self._refreshed.get(key) is not None:
+                return False
+            self._refreshed.set(key, True)
+            self.refreshes += 1
+            pool = self._pool()
+
+        def run():
+            try:
+                fn()
+            except Exception:
+                self.refresh_errors += 1
+                logger.exception("Background user_info refresh failed")
+
+        pool.submit(run)
+        return True
+
+    def stats(self) -> dict:
+        flight = self._flight.stats()
+        return {
+            "positive": self._entries.stats(),
+            "negative": self._denied.stats(),
+            "upstream_logins": flight["calls"],
+            "coalesced": flight["shared"],
+            "refreshes": self.refreshes,
+            "refresh_errors": self.refresh_errors,
+        }
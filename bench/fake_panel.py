@@ -0,0 +1,141 @@
+"""Local stand-in for an Xtream panel, serving the seed data.
+
+    python bench/fake_panel.py [--port 8081] [--delay-ms 0]
+
+Any username is accepted with password ``bench`` (``FakePanel.PASSWORD``);
+other passwords get ``auth: 0``. Paths other than player_api.php answer 200,
+so the API's health probes and stream redirects have something to hit.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_seed():
+    with open(os.path.join(ROOT, "seed", "data.json")) as f:
+        streams = json.load(f)
+    categories = {}
+    for stream in streams:
+        categories.setdefault(str(stream["category_id"]), {
+            "category_id": str(stream["category_id"]),
+            "category_name": "BENCH {}".format(stream["category_id"]),
+            "parent_id": 0,
+        })
+    return streams, list(categories.values())
+
+
+class FakePanel:
+    PASSWORD = "bench"
+
+    def __init__(self, host="127.0.0.1", port=0, delay=0.0, streams=None, categories=None):
+        self.delay = delay
+        self.set_payload(*(load_seed() if streams is None else (streams, categories)))
+        self.requests = 0
+        self._lock = threading.Lock()
+        panel = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                panel._count()
+                if panel.delay:
+                    time.sleep(panel.delay)
+                parts = urlsplit(self.path)
+                if parts.path == "/player_api.php":
+                    body = panel.player_api(parse_qs(parts.query))
+                    if not isinstance(body, bytes):
+                        body = json.dumps(body).encode("utf-8")
+                    content_type = "application/json"
+                else:
+                    body = b"ok"
+                    content_type = "text/plain"
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def set_payload(self, streams, categories):
+        """Replace what get_live_streams/get_live_categories return (encoded once, served as is)."""
+        self.streams = streams
+        self.categories = categories
+        self._bodies = {
+            "get_live_streams": json.dumps(streams).encode("utf-8"),
+            "get_live_categories": json.dumps(categories).encode("utf-8"),
+        }
+        by_category = {}
+        for stream in streams:
+            by_category.setdefault(str(stream["category_id"]), []).append(stream)
+        self._category_bodies = {category_id: json.dumps(rows).encode("utf-8")
+                                 for category_id, rows in by_category.items()}
+
+    def _count(self):
+        with self._lock:
+            self.requests += 1
+
+    def player_api(self, query):
+        username = (query.get("username") or [""])[0]
+        password = (query.get("password") or [""])[0]
+        action = (query.get("action") or [""])[0]
+        if password != self.PASSWORD:
+            return {"user_info": {"auth": 0}}
+        category_id = (query.get("category_id") or [""])[0]
+        if action == "get_live_streams" and category_id:
+            return self._category_bodies.get(category_id, b"[]")
+        if action in self._bodies:
+            return self._bodies[action]
+        host, port = self.server.server_address[:2]
+        return {
+            "user_info": {
+                "username": username, "password": password, "auth": 1, "status": "Active",
+                "exp_date": str(int(time.time()) + 365 * 86400), "is_trial": "0",
+                "active_cons": "0", "max_connections": "1", "allowed_output_formats": ["m3u8", "ts"],
+            },
+            "server_info": {
+                "url": host, "port": str(port), "https_port": "", "server_protocol": "http",
+                "rtmp_port": "", "timezone": "UTC", "timestamp_now": int(time.time()),
+            },
+        }
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name="fake-panel", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--delay-ms", type=float, default=0.0, help="added latency per request")
+    args = parser.parse_args()
+    panel = FakePanel(args.host, args.port, args.delay_ms / 1000.0)
+    print("Fake panel on", panel.url, file=sys.stderr)
+    try:
+        panel.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
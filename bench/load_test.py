@@ -0,0 +1,253 @@
+"""Load test of the serving path against local stand-ins.
+
+    MYSQL_DATABASE=xtream_bench python bench/load_test.py [--concurrency 16] [--duration 10]
+    python bench/load_test.py --url http://127.0.0.1:5000 --skip-seed   # already running API
+
+By default this starts the fake panel (bench/fake_panel.py), reseeds the
+benchmark database (bench/seed_db.py) and runs the API under gunicorn with
+the repo's gunicorn.conf.py. Each scenario is then driven for --duration
+seconds by --concurrency keep-alive clients. The results (throughput and
+p50/p95/p99 latency per scenario) are written as JSON. With --compare, the
+run is checked against an earlier results file and the exit code is 1 on
+regressions beyond --tolerance.
+"""
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import argparse
+import platform
+import itertools
+import subprocess
+import threading
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_panel import FakePanel
+
+RESULTS_DIR = os.path.join(ROOT, "bench", "results")
+PASSWORD = FakePanel.PASSWORD
+BENCH_USERNAME = "bench-user"
+
+
+def _scenarios(run_id, stream_ids, category_ids):
+    """name -> (request path for the i-th request, expected status)."""
+    auth = f"username={BENCH_USERNAME}&password={PASSWORD}"
+    return {
+        # A new user every request: auth cache miss, DB miss, upstream check, insert.
+        "cold_login": (lambda i: f"/player_api.php?username=cold-{run_id}-{i}&password={PASSWORD}", 200),
+        "cached_login": (lambda i: f"/player_api.php?{auth}", 200),
+        "live_categories": (lambda i: f"/player_api.php?{auth}&action=get_live_categories", 200),
+        "live_streams": (lambda i: f"/player_api.php?{auth}&action=get_live_streams", 200),
+        "live_streams_by_category": (
+            lambda i: f"/player_api.php?{auth}&action=get_live_streams&category_id={category_ids[i % len(category_ids)]}", 200),
+        "stream_redirect": (
+            lambda i: f"/live/{BENCH_USERNAME}/{PASSWORD}/{stream_ids[i % len(stream_ids)]}.ts", 302),
+    }
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def run_scenario(base_url, make_path, expected_status, concurrency, duration, max_requests=None):
+    counter = itertools.count()
+    latencies = [[] for _ in range(concurrency)]
+    errors = [0] * concurrency
+    deadline = time.monotonic() + duration
+
+    def worker(slot):
+        session = requests.Session()
+        while time.monotonic() < deadline:
+            i = next(counter)
+            if max_requests is not None and i >= max_requests:
+                break
+            start = time.perf_counter()
+            try:
+                response = session.get(base_url + make_path(i), allow_redirects=False, timeout=30)
+                response.content
+                ok = response.status_code == expected_status
+            except requests.RequestException:
+                ok = False
+            latencies[slot].append(time.perf_counter() - start)
+            if not ok:
+                errors[slot] += 1
+        session.close()
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=worker, args=(slot,)) for slot in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    values = sorted(itertools.chain.from_iterable(latencies))
+    ms = lambda v: round(v * 1000, 3) if v is not None else None
+    return {
+        "requests": len(values),
+        "errors": sum(errors),
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(len(values) / elapsed, 1) if elapsed else 0.0,
+        "mean_ms": ms(sum(values) / len(values)) if values else None,
+        "p50_ms": ms(percentile(values, 0.50)),
+        "p95_ms": ms(percentile(values, 0.95)),
+        "p99_ms": ms(percentile(values, 0.99)),
+        "max_ms": ms(values[-1]) if values else None,
+    }
+
+
+def compare(current, baseline, tolerance):
+    """Return the list of regressions of ``current`` against ``baseline``."""
+    regressions = []
+    for name, result in current["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name)
+        if not before:
+            continue
+        if before.get("p95_ms") and result["p95_ms"] and result["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {before['p95_ms']} -> {result['p95_ms']} ms")
+        if before.get("throughput_rps") and result["throughput_rps"] < before["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {before['throughput_rps']} -> {result['throughput_rps']} rps")
+        if result["errors"] > before.get("errors", 0):
+            regressions.append(f"{name}: errors {before.get('errors', 0)} -> {result['errors']}")
+    return regressions
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def start_api(port, panel_url, workers, threads):
+    env = dict(
+        os.environ,
+        GUNICORN_BIND=f"127.0.0.1:{port}",
+        GUNICORN_WORKERS=str(workers),
+        GUNICORN_THREADS=str(threads),
+        # Measure the serving path, not the bot guardrails.
+        RATE_LIMIT_PLAYER_API_PER_MINUTE="0",
+        RATE_LIMIT_REDIRECT_PER_MINUTE="0",
+        UPSTREAM_FALLBACK_URL=panel_url,
+    )
+    process = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "app:app"],
+                               cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit("API exited during startup:\n" + process.stderr.read().decode(errors="replace"))
+        try:
+            requests.get(base_url + "/player_api.php", timeout=1)
+            return process, base_url
+        except requests.RequestException:
+            time.sleep(0.2)
+    process.kill()
+    raise SystemExit("API did not start within 30 seconds")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="benchmark an already running API instead of starting one")
+    parser.add_argument("--scenarios", default="all", help="comma-separated scenario names")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per scenario")
+    parser.add_argument("--cold-login-requests", type=int, default=2000,
+                        help="cap on cold_login requests (each one inserts a user)")
+    parser.add_argument("--warmup", type=float, default=1.0, help="seconds of warm-up per scenario")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--panel-delay-ms", type=float, default=0.0, help="simulated panel latency")
+    parser.add_argument("--skip-seed", action="store_true", help="don't reset the benchmark database")
+    parser.add_argument("--output", help="results file (default: bench/results/serving-<rev>-<time>.json)")
+    parser.add_argument("--compare", help="earlier results file to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed relative regression")
+    args = parser.parse_args(argv)
+
+    panel = FakePanel(delay=args.panel_delay_ms / 1000.0).start()
+    process = None
+    try:
+        if not args.skip_seed:
+            import seed_db
+            seed_db.main(["--panel-url", panel.url])
+        if args.url:
+            base_url = args.url.rstrip("/")
+        else:
+            process, base_url = start_api(_free_port(), panel.url, args.workers, args.threads)
+
+        stream_ids = [s["stream_id"] for s in panel.streams]
+        with open(os.path.join(ROOT, "seed", "categories.json")) as f:
+            category_ids = [int(k) for k in json.load(f)]
+        run_id = int(time.time())
+        scenarios = _scenarios(run_id, stream_ids, category_ids)
+        names = list(scenarios) if args.scenarios == "all" else args.scenarios.split(",")
+
+        results = {}
+        for name in names:
+            make_path, expected = scenarios[name]
+            limit = args.cold_login_requests if name == "cold_login" else None
+            if args.warmup > 0 and name != "cold_login":
+                run_scenario(base_url, make_path, expected, args.concurrency, args.warmup)
+            results[name] = run_scenario(base_url, make_path, expected, args.concurrency, args.duration, limit)
+            r = results[name]
+            print(f"{name:<26} {r['throughput_rps']:>9.1f} rps  p50 {r['p50_ms']} ms  p95 {r['p95_ms']} ms"
+                  f"  p99 {r['p99_ms']} ms  errors {r['errors']}/{r['requests']}")
+    finally:
+        if process is not None:
+            process.send_signal(signal.SIGTERM)
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        panel.stop()
+
+    revision = _git_revision()
+    report = {
+        "meta": {
+            "revision": revision,
+            "timestamp": int(time.time()),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "workers": None if args.url else args.workers,
+            "threads": None if args.url else args.threads,
+            "panel_delay_ms": args.panel_delay_ms,
+        },
+        "scenarios": results,
+    }
+    output = args.output or os.path.join(
+        RESULTS_DIR, "serving-{}-{}.json".format(revision or "unknown", time.strftime("%Y%m%d-%H%M%S")))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print("Results written to", output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for line in regressions:
+            print("REGRESSION", line)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,90 @@
+"""Micro-benchmark: channel-name normalization and category lookup on seed/data.json.
+
+Compares the original per-pattern ``re.sub`` loop and linear category scan with
+``sync.normalize`` (the same patterns applied in order, precompiled, with results
+memoized by ``lru_cache``, and an inverted category index) and checks that both
+produce the same results. "cold cache" clears the memo before every pass.
+
+    python bench/normalize_bench.py [--repeat 20]
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sync.normalize import PATTERNS_TO_REMOVE, CategoryIndex, normalize_name
+
+
+def legacy_normalize(name):
+    for pattern in PATTERNS_TO_REMOVE:
+        name = re.sub(pattern, '', name)
+    return name.strip()
+
+
+def legacy_lookup(categories, name):
+    for key, category_list in categories.items():
+        if name in category_list:
+            return int(key)
+    return None
+
+
+def best_of(repeat, func):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--data", default=os.path.join(ROOT, "seed", "data.json"))
+    parser.add_argument("--categories", default=os.path.join(ROOT, "seed", "categories.json"))
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    with open(args.data) as f:
+        names = [entry["name"] for entry in json.load(f)]
+    with open(args.categories) as f:
+        categories = json.load(f)
+    index = CategoryIndex(categories)
+
+    legacy = [(n, legacy_lookup(categories, n)) for n in map(legacy_normalize, names)]
+    current = [(n, index.lookup(n)) for n in map(normalize_name, names)]
+    mismatches = [(a, b) for a, b in zip(legacy, current) if a != b]
+
+    def run_legacy():
+        for name in names:
+            legacy_lookup(categories, legacy_normalize(name))
+
+    def run_cold():
+        normalize_name.cache_clear()
+        for name in names:
+            index.lookup(normalize_name(name))
+
+    def run_warm():
+        for name in names:
+            index.lookup(normalize_name(name))
+
+    t_legacy = best_of(args.repeat, run_legacy)
+    t_cold = best_of(args.repeat, run_cold)
+    run_warm()
+    t_warm = best_of(args.repeat, run_warm)
+
+    print(f"names: {len(names)}, category names: {len(index)}, mismatches: {len(mismatches)}")
+    for label, seconds in (("legacy", t_legacy), ("precompiled (cold cache)", t_cold),
+                           ("precompiled (memoized)", t_warm)):
+        print(f"{label:<24} {seconds * 1000:8.2f} ms  {seconds / len(names) * 1e6:7.2f} us/name  x{t_legacy / seconds:.1f}")
+    for a, b in mismatches[:10]:
+        print(f"  mismatch: legacy={a!r} current={b!r}")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
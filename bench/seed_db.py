@@ -0,0 +1,90 @@
+"""(Re)create a benchmark database from docker/mysql/init.sql and the seed files.
+
+    MYSQL_DATABASE=xtream_bench python bench/seed_db.py --panel-url http://127.0.0.1:8081
+
+init.sql drops and recreates the tables, so this refuses to run against a
+database whose name doesn't contain "bench" unless --force is given.
+"""
+import os
+import re
+import sys
+import json
+import argparse
+
+import pymysql
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import migrate
+from database import MYSQL_HOST, MYSQL_USER, MYSQL_PASSWORD, MYSQL_DATABASE
+from sync.normalize import CategoryIndex, normalize_name
+from sync.stream_sync import FALLBACK_CATEGORY_ID
+
+BENCH_USERNAME = "bench-user"
+
+
+def schema_statements():
+    with open(os.path.join(ROOT, "docker", "mysql", "init.sql")) as f:
+        statements = migrate.split_statements(f.read())
+    # The target database is chosen by the connection, not by the script.
+    return [s for s in statements if not re.match(r"^(CREATE DATABASE|USE)\b", s, re.I)]
+
+
+def seed(connection, panel_url, streams=True):
+    with connection.cursor() as cursor:
+        cursor.execute("SET FOREIGN_KEY_CHECKS = 0")
+        # init.sql only drops the tables it seeds; start every run from empty ones.
+        cursor.execute("DROP TABLE IF EXISTS user_server_info, server_dns, catalog_version, sync_state, schema_migrations")
+        for statement in schema_statements():
+            cursor.execute(statement)
+        cursor.execute("SET FOREIGN_KEY_CHECKS = 1")
+        cursor.execute("INSERT INTO stream_categories (id, category_name, parent_id, cat_order) VALUES (%s, 'OTROS', 0, 99)",
+                       (FALLBACK_CATEGORY_ID,))
+
+        index = CategoryIndex.from_file(os.path.join(ROOT, "seed", "categories.json"))
+        data = []
+        if streams:
+            with open(os.path.join(ROOT, "seed", "data.json")) as f:
+                data = json.load(f)
+        rows = []
+        for entry in data:
+            name = normalize_name(entry["name"])
+            rows.append((
+                entry["num"], name, entry["stream_type"], entry["stream_id"], entry["stream_icon"],
+                entry["epg_channel_id"], entry["added"], entry["is_adult"],
+                index.lookup(name) or FALLBACK_CATEGORY_ID, json.dumps(entry["category_ids"]), entry["custom_sid"],
+                entry["tv_archive"], entry["direct_source"], entry["tv_archive_duration"],
+            ))
+        if rows:
+            cursor.executemany(
+                "INSERT INTO streams (num, name, stream_type, stream_id, stream_icon, epg_channel_id, added, is_adult,"
+                " category_id, category_ids, custom_sid, tv_archive, direct_source, tv_archive_duration)"
+                " VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)", rows)
+
+        # Every upstream call goes to the local fake panel.
+        cursor.execute("DELETE FROM server_dns")
+        cursor.execute("INSERT INTO server_dns (dns_url) VALUES (%s)", (panel_url,))
+    connection.commit()
+    migrate.migrate_up(connection)
+    return len(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--panel-url", default="http://127.0.0.1:8081")
+    parser.add_argument("--force", action="store_true", help="allow a database name without 'bench'")
+    args = parser.parse_args(argv)
+    if "bench" not in (MYSQL_DATABASE or "") and not args.force:
+        raise SystemExit(f"Refusing to reset database {MYSQL_DATABASE!r}; use a *bench* database or --force")
+    connection = pymysql.connect(host=MYSQL_HOST, user=MYSQL_USER, password=MYSQL_PASSWORD,
+                                 database=MYSQL_DATABASE, autocommit=True)
+    try:
+        count = seed(connection, args.panel_url)
+    finally:
+        connection.close()
+    print(f"Seeded {count} streams into {MYSQL_DATABASE}; server_dns -> {args.panel_url}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+"""Benchmark of the sync scripts against synthetic large panels.
+
+    MYSQL_HOST=127.0.0.1 MYSQL_USER=root MYSQL_PASSWORD=... MYSQL_DATABASE=xtream_bench \\
+        python bench/sync_bench.py [--sizes 10000,50000,200000] [--changed 0.01]
+
+For every size the benchmark database is reset (bench/seed_db.py, without
+streams) and a fake panel (bench/fake_panel.py) serves a payload derived
+from seed/data.json. Then these runs are made, each in a fresh process:
+
+* categories  - sync_data_live_categories
+* full        - sync_data_live_streams into an empty streams table
+* incremental - the same payload with --changed of the rows modified
+* unchanged   - the incremental payload again (fingerprint skip)
+
+With --streams-mode category the stream runs use the parallel per-category
+fetch (SYNC_STREAMS_MODE=category); that mode has no fingerprint skip.
+
+For each run it records wall time, DB round trips (the server's Questions
+counter), rows written (InnoDB row counters), peak RSS, and the stream
+engine's per-phase timings and RSS. Results are written as JSON.
+"""
+import os
+import sys
+import json
+import time
+import resource
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCH_DIR)
+
+RESULTS_DIR = os.path.join(ROOT, "bench", "results")
+# Synthetic stream ids start here, clear of real panel ids.
+_SYNTHETIC_ID_BASE = 10_000_000
+_STATUS_COUNTERS = ("Questions", "Innodb_rows_inserted", "Innodb_rows_updated", "Innodb_rows_deleted")
+
+
+def synthesize(size, seed_streams, changed=0.0, generation=0):
+    """``size`` streams cycling over the seed, with unique ids and names.
+
+    ``changed`` of the rows (spread evenly) get a different name in
+    ``generation`` > 0, which the sync must write back.
+    """
+    step = int(round(1 / changed)) if changed > 0 else 0
+    streams = []
+    for i in range(size):
+        base = seed_streams[i % len(seed_streams)]
+        copy = i // len(seed_streams)
+        stream = dict(base)
+        stream["num"] = i + 1
+        stream["stream_id"] = _SYNTHETIC_ID_BASE + i
+        stream["name"] = base["name"] if copy == 0 else "{} #{}".format(base["name"], copy)
+        if generation and step and i % step == 0:
+            stream["name"] += " (v{})".format(generation)
+        streams.append(stream)
+    return streams
+
+
+def categories_for(streams):
+    categories = {}
+    for stream in streams:
+        categories.setdefault(str(stream["category_id"]), {
+            "category_id": str(stream["category_id"]),
+            "category_name": "BENCH {}".format(stream["category_id"]),
+            "parent_id": 0,
+        })
+    return list(categories.values())
+
+
+def _connect():
+    import pymysql
+    from database import MYSQL_HOST, MYSQL_USER, MYSQL_PASSWORD, MYSQL_DATABASE
+    return pymysql.connect(host=MYSQL_HOST, user=MYSQL_USER, password=MYSQL_PASSWORD,
+                           database=MYSQL_DATABASE, autocommit=True)
+
+
+def _server_counters(connection):
+    with connection.cursor() as cursor:
+        cursor.execute("SHOW GLOBAL STATUS WHERE Variable_name IN ({})".format(
+            ", ".join(["%s"] * len(_STATUS_COUNTERS))), _STATUS_COUNTERS)
+        return {name: int(value) for name, value in cursor.fetchall()}
+
+
+def run_child(kind, env):
+    """Run one sync in a fresh process; returns its report plus wall time and peak RSS."""
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--child", kind],
+                               cwd=ROOT, env=env, stdout=subprocess.PIPE)
+    output = process.stdout.read()
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    wall = time.perf_counter() - start
+    if process.returncode != 0:
+        raise SystemExit(f"{kind} sync exited with {process.returncode}")
+    lines = output.decode("utf-8", errors="replace").strip().splitlines()
+    report = json.loads(lines[-1]) if lines else {}
+    report["wall_seconds"] = round(wall, 3)
+    # ru_maxrss is in KiB on Linux.
+    report["peak_rss_mb"] = round(usage.ru_maxrss / 1024, 1)
+    return report
+
+
+def child(kind):
+    """Entry point of the child process: fetch from SYNC_PANEL_URL, apply, print a JSON report."""
+    db = (os.getenv("MYSQL_HOST"), os.getenv("MYSQL_USER"), os.getenv("MYSQL_PASSWORD"), os.getenv("MYSQL_DATABASE"))
+    username, password = os.getenv("USERNAME"), os.getenv("PASSWORD")
+    report = {}
+    start = time.perf_counter()
+    if kind == "categories":
+        from sync import sync_data_live_categories as module
+        data = module.fetch_categories(username, password)
+        if data is None:
+            raise SystemExit("categories fetch failed")
+        report["fetch_seconds"] = round(time.perf_counter() - start, 3)
+        cleaned = module.tool.remove_categories_by_name(data)
+        counts = module.save_to_database(cleaned, *db, filtered_ids=module.filtered_category_ids(data, cleaned))
+        report["counts"] = counts
+    elif os.getenv("SYNC_STREAMS_MODE") == "category":
+        import pymysql
+        from sync import sync_data_live_streams as module
+        connection = pymysql.connect(host=db[0], user=db[1], password=db[2], database=db[3])
+        try:
+            stats = module.sync_streams_by_category(connection, username, password)
+        finally:
+            connection.close()
+        report["counts"] = stats.counts
+        report["phase_seconds"] = {k: round(v, 3) for k, v in stats.timings.items()}
+        report["phase_peak_rss_mb"] = {k: round(v / 1024, 1) for k, v in stats.peak_rss_kb.items()}
+    else:
+        from sync import sync_data_live_streams as module
+        data = module.fetch_json_data(username, password)
+        if data is None:
+            raise SystemExit("streams fetch failed")
+        report["fetch_seconds"] = round(time.perf_counter() - start, 3)
+        report["fetch_peak_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+        stats = module.save_to_database(data, module.allowed_category_ids, *db)
+        if stats is not None:
+            report["counts"] = stats.counts
+            report["phase_seconds"] = {k: round(v, 3) for k, v in stats.timings.items()}
+            report["phase_peak_rss_mb"] = {k: round(v / 1024, 1) for k, v in stats.peak_rss_kb.items()}
+        else:
+            report["counts"] = {"skipped": 1}
+    print(json.dumps(report))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="10000,50000,200000")
+    parser.add_argument("--changed", type=float, default=0.01, help="fraction of rows changed in the incremental run")
+    parser.add_argument("--no-incremental", action="store_true")
+    parser.add_argument("--streams-mode", choices=("full", "category"), default="full",
+                        help="SYNC_STREAMS_MODE of the stream runs")
+    parser.add_argument("--output", help="results file (default: bench/results/sync-<rev>-<time>.json)")
+    args = parser.parse_args(argv)
+
+    import seed_db
+    from fake_panel import FakePanel, load_seed
+    from load_test import _git_revision
+    from database import MYSQL_DATABASE
+
+    if "bench" not in (MYSQL_DATABASE or ""):
+        raise SystemExit(f"Refusing to reset database {MYSQL_DATABASE!r}; use a *bench* database")
+
+    seed_streams, _ = load_seed()
+    panel = FakePanel(streams=[], categories=[]).start()
+    env = dict(os.environ, SYNC_PANEL_URL=panel.url, USERNAME="bench-sync", PASSWORD=FakePanel.PASSWORD,
+               SYNC_STREAMS_MODE=args.streams_mode)
+    connection = _connect()
+    results = {}
+    try:
+        for size in [int(s) for s in args.sizes.split(",")]:
+            seed_db.seed(connection, panel.url, streams=False)
+            streams = synthesize(size, seed_streams)
+            panel.set_payload(streams, categories_for(streams))
+            runs = [("categories", "categories"), ("full", "streams")]
+            if not args.no_incremental:
+                runs += [("incremental", "streams"), ("unchanged", "streams")]
+            results[size] = {}
+            for name, kind in runs:
+                if name == "incremental":
+                    streams = synthesize(size, seed_streams, args.changed, generation=1)
+                    panel.set_payload(streams, categories_for(streams))
+                before = _server_counters(connection)
+                report = run_child(kind, env)
+                after = _server_counters(connection)
+                report["db_round_trips"] = after["Questions"] - before["Questions"] - 1
+                report["rows_written"] = sum(after[k] - before[k] for k in _STATUS_COUNTERS[1:])
+                results[size][name] = report
+                phases = " ".join(f"{k}={v}s" for k, v in report.get("phase_seconds", {}).items())
+                print(f"{size:>7} {name:<12} {report['wall_seconds']:>8.2f}s  round_trips={report['db_round_trips']:<7}"
+                      f" rows_written={report['rows_written']:<7} peak_rss={report['peak_rss_mb']}MB  {phases}")
+    finally:
+        connection.close()
+        panel.stop()
+
+    revision = _git_revision()
+    output = args.output or os.path.join(
+        RESULTS_DIR, "sync-{}-{}.json".format(revision or "unknown", time.strftime("%Y%m%d-%H%M%S")))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump({"meta": {"revision": revision, "timestamp": int(time.time()), "changed": args.changed,
+                            "streams_mode": args.streams_mode},
+                   "sizes": results}, f, indent=2)
+    print("Results written to", output)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "--child":
+        child(sys.argv[2])
+    else:
+        main()
@@ -0,0 +1,152 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+from responses import GZIP_MIN_SIZE, gzip_bytes
+
+
+def _env_bool(name: str, default: bool = False) -> bool:
+    raw = os.environ.get(name)
+    if raw is None:
+        return default
+    return str(raw).strip().lower() in {"1", "true", "t", "yes", "y", "on"}
+
+
+CATALOG_CACHE_ENABLED = _env_bool("CATALOG_CACHE_ENABLED", True)
+# How often (seconds) the catalog version stamp is re-read from the database.
+CATALOG_VERSION_CHECK_SECONDS = float(os.environ.get("CATALOG_VERSION_CHECK_SECONDS", "5"))
+# Upper bound on an entry's age, in case the sync scripts never bump the stamp.
+CATALOG_CACHE_MAX_AGE = float(os.environ.get("CATALOG_CACHE_MAX_AGE", "3600"))
+CATALOG_CACHE_MAX_ENTRIES = int(os.environ.get("CATALOG_CACHE_MAX_ENTRIES", "256"))
+
+
+class CatalogEntry:
+    __slots__ = ("version", "updated_at", "body", "created_at", "last_modified", "etag", "_gzip_body")
+
+    def __init__(self, version, updated_at, body: bytes):
+        self.version = version
+        self.updated_at = updated_at
+        self.body = body
+        self.created_at = time.monotonic()
+        self.last_modified = updated_at if updated_at is not None else int(time.time())
+        # Strong validator: catalog version plus a digest of the exact bytes served.
+        self.etag = "v{}-{}".format(version, hashlib.sha1(body).hexdigest()[:16])
+        self._gzip_body = None
+
+    def gzipped(self):
+        """Compressed body, built once per entry; None for bodies too small to bother."""
+        if len(self.body) < GZIP_MIN_SIZE:
+            return None
+        if self._gzip_body is None:
+            self._gzip_body = gzip_bytes(self.body)
+        return self._gzip_body
+
+
+class CatalogCache:
+    """Serialized live catalog responses, invalidated by the catalog version stamp.
+
+    ``version_loader`` returns ``(version, updated_at)``; it is called at most
+    once every ``check_interval`` seconds, so cache hits never touch the database.
+    """
+
+    def __init__(self, version_loader, check_interval=CATALOG_VERSION_CHECK_SECONDS,
+                 max_age=CATALOG_CACHE_MAX_AGE, max_entries=CATALOG_CACHE_MAX_ENTRIES,
+                 enabled=CATALOG_CACHE_ENABLED):
+        self.version_loader = version_loader
+        self.check_interval = check_interval
+        self.max_age = max_age
+        self.max_entries = max(1, int(max_entries))
+        self.enabled = enabled
+
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[tuple, CatalogEntry]" = OrderedDict()
+        self._build_locks: dict[tuple, threading.Lock] = {}
+        self._version = None
+        self._updated_at = None
+        self._checked_at = 0.0
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def current_version(self):
+        """Return the cached ``(version, updated_at)``, refreshing it when due."""
+        now = time.monotonic()
+        if self._version is not None and now - self._checked_at < self.check_interval:
+            return self._version, self._updated_at
+        try:
+            version, updated_at = self.version_loader()
+        except Exception:
+            # Keep serving the last known catalog if the stamp can't be read.
+            if self._version is None:
+                raise
+            version, updated_at = self._version, self._updated_at
+        with self._lock:
+            if self._version is not None and version != self._version:
+                self._entries.clear()
+                self.invalidations += 1
+            self._version, self._updated_at = version, updated_at
+            self._checked_at = now
+        return version, updated_at
+
+    def _fresh(self, entry, version):
+        if entry is None or entry.version != version:
+            return False
+        return self.max_age <= 0 or time.monotonic() - entry.created_at < self.max_age
+
+    def get(self, key: tuple, build) -> CatalogEntry:
+        """Return the entry for ``key``, calling ``build()`` for the body bytes on a miss.
+
+        Concurrent misses for the same key wait for a single build.
+        """
+        version, updated_at = self.current_version()
+        if self.enabled:
+            with self._lock:
+                entry = self._entries.get(key)
+                if self._fresh(entry, version):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry
+                build_lock = self._build_locks.setdefault(key, threading.Lock())
+        else:
+            build_lock = threading.Lock()
+
+        with build_lock:
+            if self.enabled:
+                with self._lock:
+                    entry = self._entries.get(key)
+                    if self._fresh(entry, version):
+                        self._entries.move_to_end(key)
+                        self.hits += 1
+                        return entry
+            try:
+                body = build()
+            except Exception:
+                with self._lock:
+                    self._build_locks.pop(key, None)
+                raise
+            entry = CatalogEntry(version, updated_at, body)
+            with self._lock:
+                self.misses += 1
+                if self.enabled and entry.version == self._version:
+                    self._entries[key] = entry
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.max_entries:
+                        old_key, _ = self._entries.popitem(last=False)
+                        self._build_locks.pop(old_key, None)
+                else:
+                    self._build_locks.pop(key, None)
+            return entry
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "version": self._version,
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+            }
@@ -1,7 +1,11 @@
 import os
 import json
+import logging
+import threading
 import pymysql
 from datetime import datetime
+from pool import ConnectionPool
+from metrics import DB_QUERY_SECONDS, timed
 
 # Obtener las variables de entorno
 MYSQL_HOST = os.environ.get('MYSQL_HOST')
@@ -11,6 +15,66 @@ MYSQL_DATABASE = os.environ.get('MYSQL_DATABASE')
 PORT = os.environ.get('PORT')
 SERVER_IP = os.environ.get('SERVER_IP')
 
+logger = logging.getLogger(__name__)
+
+# Hot-path tables that have a status column (older schemas don't)
+PROBE_STATUS_SQL = (
+    "SELECT TABLE_NAME FROM information_schema.COLUMNS"
+    " WHERE TABLE_SCHEMA = DATABASE() AND COLUMN_NAME = 'status'"
+    " AND TABLE_NAME IN ('users', 'streams', 'stream_categories')"
+)
+
+_STREAMS_JOIN = "SELECT * FROM streams as st INNER JOIN stream_categories as st_cat ON st.category_id = st_cat.id"
+# Keyset pagination for iter_streams on the raw columns, so idx_streams_category_name and
+# idx_streams_name serve both the seek and the order: streams without a name come
+# first (as NULLs sort in ORDER BY name) by id, then rows after (name, id) of the previous page.
+_STREAMS_NULL_SEEK = "st.name IS NULL AND st.id > %s ORDER BY st.id ASC LIMIT %s"
+_STREAMS_SEEK = "(st.name > %s OR (st.name = %s AND st.id > %s)) ORDER BY st.name ASC, st.id ASC LIMIT %s"
+
+# Rows read per query by iter_streams; the pooled connection is released between pages.
+CATALOG_PAGE_SIZE = int(os.environ.get("CATALOG_PAGE_SIZE", "2000"))
+
+
+def _stream_row(row) -> dict:
+    # Columnas de streams (st.*) en el orden de la tabla; la primera es el id interno
+    return {
+        "num": row[1],
+        "name": row[2],
+        "stream_type": row[3],
+        "stream_id": row[4],
+        "stream_icon": row[5],
+        "epg_channel_id": row[6],
+        "added": row[7],
+        "is_adult": row[8],
+        "category_id": row[9],
+        "category_ids": row[10],
+        "custom_sid": row[11],
+        "tv_archive": row[12],
+        "direct_source": row[13],
+        "tv_archive_duration": row[14],
+    }
+
+
+def build_statements(status_tables) -> dict:
+    """Hot-path SQL for a schema where ``status_tables`` have a ``status`` column.
+
+    Tables with the column only return rows with ``status = 'Active'``; the
+    stream listings filter on it only when both joined tables have it.
+    """
+    users_active = " AND status = 'Active'" if "users" in status_tables else ""
+    categories_active = " WHERE status = 'Active'" if "stream_categories" in status_tables else ""
+    streams_active = {"streams", "stream_categories"} <= set(status_tables)
+    streams_where = _STREAMS_JOIN + " WHERE " + ("st.status = 'Active' AND st_cat.status = 'Active' AND " if streams_active else "")
+    return {
+        "user_by_credentials": "SELECT id,username,password FROM users WHERE username = %s AND password = %s" + users_active,
+        "all_stream_categories": "SELECT * FROM stream_categories" + categories_active + " ORDER BY cat_order ASC",
+        "streams_null_page": streams_where + _STREAMS_NULL_SEEK,
+        "streams_page": streams_where + _STREAMS_SEEK,
+        "streams_by_category_null_page": streams_where + "st.category_id = %s AND " + _STREAMS_NULL_SEEK,
+        "streams_by_category_page": streams_where + "st.category_id = %s AND " + _STREAMS_SEEK,
+    }
+
+
 class Database:
     def __init__(self, app):
         self.app = app
@@ -20,14 +84,36 @@ class Database:
         self.database = MYSQL_DATABASE
         self.port = PORT
         self.server_ip = SERVER_IP
-    
-    def connect(self):
-        return pymysql.connect(
-            host=self.host,
-            user=self.user,
-            password=self.password,
-            database=self.database
-        )
+        self.pool = ConnectionPool({
+            "host": self.host,
+            "user": self.user,
+            "password": self.password,
+            "database": self.database,
+        })
+        self._statements = None
+        self._statements_lock = threading.Lock()
+
+    def connection(self):
+        # Todas las consultas pasan por el pool de conexiones
+        return self.pool.connection()
+
+    @timed(DB_QUERY_SECONDS)
+    def probe_schema(self):
+        """Return the hot-path tables that have a ``status`` column."""
+        with self.connection() as connection:
+            with connection.cursor() as cursor:
+                cursor.execute(PROBE_STATUS_SQL)
+                return frozenset(row[0] for row in cursor.fetchall())
+
+    def statements(self) -> dict:
+        # Se prueba el esquema una sola vez por proceso en lugar de fallar y reintentar en cada consulta
+        if self._statements is None:
+            with self._statements_lock:
+                if self._statements is None:
+                    status_tables = self.probe_schema()
+                    logger.info("Tables with a status column: %s", ", ".join(sorted(status_tables)) or "none")
+                    self._statements = build_statements(status_tables)
+        return self._statements
         
     @staticmethod
     def is_expired_user_info(user_info: dict) -> bool:
@@ -44,20 +130,18 @@ class Database:
     
     # Esta función verifica si un usuario existe en la base de datos
 
+    @timed(DB_QUERY_SECONDS)
     def user_exists(self, username, password):
-        connection = self.connect()
-        try:
+        with self.connection() as connection:
             with connection.cursor() as cursor:
                 sql = "SELECT * FROM users WHERE username = %s AND password = %s"
                 cursor.execute(sql, (username, password,))
                 result = cursor.fetchone()
                 return result is not None
-        finally:
-            connection.close()
 
+    @timed(DB_QUERY_SECONDS)
     def save_user(self, username, password):
-        connection = self.connect()
-        try:
+        with self.connection() as connection:
             with connection.cursor() as cursor:
                 # Avoid duplicates if the same user already exists.
                 try:
@@ -74,38 +158,28 @@ class Database:
                 user_id = cursor.lastrowid
             connection.commit()
             return user_id  # Devolver el ID del usuario insertado
-        finally:
-            connection.close()
 
+    @timed(DB_QUERY_SECONDS)
     def get_user(self, user, passw):
-        connection = self.connect()
-        try:
+        with self.connection() as connection:
             with connection.cursor() as cursor:
-                # Prefer enforcing status if the column exists, but fall back gracefully.
-                try:
-                    sql = "SELECT id,username,password FROM users WHERE username = %s AND password = %s AND status = 'Active'"
-                    cursor.execute(sql, (user, passw,))
-                    result = cursor.fetchone()
-                except pymysql.err.OperationalError:
-                    sql = "SELECT id,username,password FROM users WHERE username = %s AND password = %s"
-                    cursor.execute(sql, (user, passw,))
-                    result = cursor.fetchone()
+                # Enforces status = 'Active' when the column exists
+                cursor.execute(self.statements()["user_by_credentials"], (user, passw,))
+                result = cursor.fetchone()
                 if result:
                     id, username, password = result
                     return {"id": id, "username": username, "password": password}
                 else:
                     return None
-        finally:
-            connection.close()
 
     
+    @timed(DB_QUERY_SECONDS)
     def save_user_server_info(self, user_id, user_info, server_info):
-        connection = self.connect()
         server_info["url"] = self.server_ip or server_info["url"]
         server_info["port"] = self.port or server_info["port"]
         user_info_json = json.dumps(user_info)
         server_info_json = json.dumps(server_info)
-        try:
+        with self.connection() as connection:
             with connection.cursor() as cursor:
                 # Verificar si ya existe una fila para el usuario
                 sql_select = "SELECT id FROM user_server_info WHERE user_id = %s"
@@ -122,13 +196,12 @@ class Database:
                     sql_insert = "INSERT INTO user_server_info (user_id, user_info, server_info) VALUES (%s, %s, %s)"
                     cursor.execute(sql_insert, (user_id, user_info_json, server_info_json))
                     connection.commit()
-        finally:
-            connection.close()
 
 
-    def get_user_server_info(self, user_id):
-        connection = self.connect()
-        try:
+    @timed(DB_QUERY_SECONDS)
+    def get_user_server_info_record(self, user_id):
+        """Return ``(info, updated_at)``; ``updated_at`` is a unix time, or None before migration 0003."""
+        with self.connection() as connection:
             with connection.cursor() as cursor:
                 sql = "SELECT * FROM user_server_info WHERE user_id = %s"
                 cursor.execute(sql, (user_id,))
@@ -137,11 +210,14 @@ class Database:
                     # Convertir la tupla en un diccionario
                     user_info = json.loads(row[2])  # user_info está en la segunda posición de la tupla
                     server_info = json.loads(row[3])  # server_info está en la tercera posición de la tupla
-                    return {"user_info": user_info, "server_info": server_info}
+                    # updated_at (si existe) llega como datetime en la zona horaria del servidor
+                    updated_at = row[4].timestamp() if len(row) > 4 and row[4] is not None else None
+                    return {"user_info": user_info, "server_info": server_info}, updated_at
                 else:
-                    return None
-        finally:
-            connection.close()
+                    return None, None
+
+    def get_user_server_info(self, user_id):
+        return self.get_user_server_info_record(user_id)[0]
 
 
     def verify_authentication(self, username, password):
@@ -151,9 +227,9 @@ class Database:
         return True  # Simplemente devolvemos True para este ejemplo
 
     # Esta función obtiene una URL aleatoria de la tabla server_dns
+    @timed(DB_QUERY_SECONDS)
     def get_dns_url_random(self):
-        connection = self.connect()
-        try:
+        with self.connection() as connection:
             with connection.cursor() as cursor:
                 try:
                     sql = "SELECT dns_url FROM server_dns ORDER BY RAND() LIMIT 1"
@@ -162,20 +238,45 @@ class Database:
                     return url
                 except:
                     return 'http://m3u.star4k.me'
-        finally:
-            connection.close()
 
-    
-    def get_all_stream_categories(self):
-        connection = self.connect()
-        try:
+
+    # Devuelve todas las URLs de la tabla server_dns
+    @timed(DB_QUERY_SECONDS)
+    def get_dns_urls(self):
+        with self.connection() as connection:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT dns_url FROM server_dns ORDER BY id ASC")
+                return [row[0] for row in cursor.fetchall()]
+
+    # Devuelve la versión del catálogo; los scripts de sync la incrementan al terminar
+    @timed(DB_QUERY_SECONDS)
+    def get_catalog_version(self):
+        with self.connection() as connection:
             with connection.cursor() as cursor:
                 try:
-                    sql = "SELECT * FROM stream_categories WHERE status = 'Active' ORDER BY cat_order ASC"
-                    cursor.execute(sql)
-                except pymysql.err.OperationalError:
-                    sql = "SELECT * FROM stream_categories ORDER BY cat_order ASC"
-                    cursor.execute(sql)
+                    cursor.execute("SELECT version, UNIX_TIMESTAMP(updated_at) FROM catalog_version WHERE id = 1")
+                    row = cursor.fetchone()
+                except pymysql.err.ProgrammingError:
+                    # La tabla aún no existe (ningún sync la ha creado)
+                    row = None
+                if row:
+                    return row[0], int(row[1]) if row[1] is not None else None
+                return 0, None
+
+    # Devuelve {stream_id: epg_channel_id} de los streams que tienen guía
+    @timed(DB_QUERY_SECONDS)
+    def get_stream_epg_channels(self):
+        with self.connection() as connection:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT stream_id, epg_channel_id FROM streams"
+                               " WHERE epg_channel_id IS NOT NULL AND epg_channel_id <> ''")
+                return {int(row[0]): row[1] for row in cursor.fetchall()}
+
+    @timed(DB_QUERY_SECONDS)
+    def get_all_stream_categories(self):
+        with self.connection() as connection:
+            with connection.cursor() as cursor:
+                cursor.execute(self.statements()["all_stream_categories"])
                 # Obtener todos los resultados de la consulta
                 results = cursor.fetchall()
                 # Formatear los resultados como una lista de diccionarios
@@ -188,82 +289,39 @@ class Database:
                     }
                     categories.append(category)
                 return categories
-        finally:
-            connection.close()
     
-    def get_all_streams(self):
-        connection = self.connect()
-        try:
-            with connection.cursor() as cursor:
-                try:
-                    sql = "SELECT * FROM streams as st INNER JOIN stream_categories as st_cat ON st.category_id = st_cat.id"
-                    sql += " WHERE st.status = 'Active' AND st_cat.status = 'Active' ORDER BY st.name ASC"
-                    cursor.execute(sql)
-                except pymysql.err.OperationalError:
-                    sql = "SELECT * FROM streams as st INNER JOIN stream_categories as st_cat ON st.category_id = st_cat.id"
-                    sql += " ORDER BY st.name ASC"
-                    cursor.execute(sql)
-                # Obtener todos los resultados de la consulta
-                results = cursor.fetchall()
-                # Formatear los resultados como una lista de diccionarios
-                streams = []
-                for row in results:
-                    stream = {
-                        "num": row[1],
-                        "name": row[2],
-                        "stream_type": row[3],
-                        "stream_id": row[4],
-                        "stream_icon": row[5],
-                        "epg_channel_id": row[6],
-                        "added": row[7],
-                        "is_adult": row[8],
-                        "category_id": row[9],
-                        "category_ids": row[10],
-                        "custom_sid": row[11],
-                        "tv_archive": row[12],
-                        "direct_source": row[13],
-                        "tv_archive_duration": row[14],
-                    }
-                    streams.append(stream)
-                return streams
-        finally:
-            connection.close()
-            
-    def get_all_streams_by_category(self, category_id):
-        connection = self.connect()
-        try:
-            with connection.cursor() as cursor:
-                try:
-                    sql = "SELECT * FROM streams as st INNER JOIN stream_categories as st_cat ON st.category_id = st_cat.id"
-                    sql += " WHERE st.status = 'Active' AND st_cat.status = 'Active' AND category_id = %s ORDER BY st.name ASC"
-                    cursor.execute(sql, (category_id,))
-                except pymysql.err.OperationalError:
-                    sql = "SELECT * FROM streams as st INNER JOIN stream_categories as st_cat ON st.category_id = st_cat.id"
-                    sql += " WHERE category_id = %s ORDER BY st.name ASC"
-                    cursor.execute(sql, (category_id,))
-                # Obtener todos los resultados de la consulta
-                results = cursor.fetchall()
-                # Formatear los resultados como una lista de diccionarios
-                streams = []
-                for row in results:
-                    stream = {
-                        "num": row[1],
-                        "name": row[2],
-                        "stream_type": row[3],
-                        "stream_id": row[4],
-                        "stream_icon": row[5],
-                        "epg_channel_id": row[6],
-                        "added": row[7],
-                        "is_adult": row[8],
-                        "category_id": row[9],
-                        "category_ids": row[10],
-                        "custom_sid": row[11],
-                        "tv_archive": row[12],
-                        "direct_source": row[13],
-                        "tv_archive_duration": row[14],
-                    }
-                    streams.append(stream)
-                return streams
-        finally:
-            connection.close()
+    def iter_streams(self, category_id=None, page_size=CATALOG_PAGE_SIZE):
+        """Yield the catalog's stream dicts ordered by name, one row at a time.
 
+        Rows are read ``page_size`` at a time (keyset pagination on name, id),
+        and the pooled connection goes back to the pool after every page, so a
+        slow client reading a streamed response never holds one. Memory stays
+        bounded by the page size however large the catalog is.
+        """
+        statements = self.statements()
+        if category_id is None:
+            null_page, page, scope = statements["streams_null_page"], statements["streams_page"], ()
+        else:
+            null_page, page = statements["streams_by_category_null_page"], statements["streams_by_category_page"]
+            scope = (category_id,)
+        # Streams without a name first (name None), then the named ones from ("", 0).
+        name, last_id = None, 0
+        while True:
+            with self.connection() as connection:
+                with connection.cursor() as cursor:
+                    if name is None:
+                        cursor.execute(null_page, scope + (last_id, page_size))
+                    else:
+                        cursor.execute(page, scope + (name, name, last_id, page_size))
+                    rows = cursor.fetchall()
+            for row in rows:
+                yield _stream_row(row)
+            if len(rows) == page_size:
+                # st.id and st.name are the first columns of the join
+                last_id = rows[-1][0]
+                if name is not None:
+                    name = rows[-1][2]
+            elif name is None:
+                name, last_id = "", 0
+            else:
+                return
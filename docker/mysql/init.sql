@@ -7,7 +7,8 @@ CREATE TABLE IF NOT EXISTS users (
     id INT NOT NULL AUTO_INCREMENT,
     username VARCHAR(255) NOT NULL,
     password VARCHAR(255) NOT NULL,
-    PRIMARY KEY (id)
+    PRIMARY KEY (id),
+    KEY idx_users_username_password (username, password)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8 COLLATE=utf8_unicode_ci AUTO_INCREMENT=1;
 
 -- Estructura de tabla para la tabla `stream_categories`
@@ -74,6 +75,9 @@ CREATE TABLE IF NOT EXISTS streams (
     direct_source VARCHAR(255),
     tv_archive_duration INT,
     PRIMARY KEY (id),
+    UNIQUE KEY uq_streams_stream_id (stream_id),
+    KEY idx_streams_category_name (category_id, name),
+    KEY idx_streams_name (name),
     FOREIGN KEY (category_id) REFERENCES stream_categories(id)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8 COLLATE=utf8_unicode_ci AUTO_INCREMENT=1;
 
@@ -83,6 +87,7 @@ CREATE TABLE IF NOT EXISTS user_server_info (
     user_id INT,
     user_info JSON,
     server_info JSON,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
     FOREIGN KEY (user_id) REFERENCES users(id)
 );
 
@@ -99,3 +104,34 @@ VALUES
 ('http://m3u.smartvent.me'),
 ('http://m3u.zen-ott.me'),
 ('http://m3u.star4k.me');
+
+-- Versión del catálogo (la incrementan los scripts de sync para invalidar la caché de la API)
+CREATE TABLE IF NOT EXISTS catalog_version (
+    id TINYINT NOT NULL PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO catalog_version (id, version) VALUES (1, 1);
+
+-- Huella del último payload aplicado por cada script de sync (para saltar payloads sin cambios)
+CREATE TABLE IF NOT EXISTS sync_state (
+    name VARCHAR(64) NOT NULL PRIMARY KEY,
+    fingerprint CHAR(64) NOT NULL,
+    record_count INT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+);
+
+-- Este esquema ya incluye las migraciones 0001-0004; migrate.py solo aplica las posteriores
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version INT NOT NULL PRIMARY KEY,
+    name VARCHAR(255) NOT NULL,
+    applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT IGNORE INTO schema_migrations (version, name)
+VALUES
+(1, 'catalog_version_and_sync_state'),
+(2, 'hot_path_indexes'),
+(3, 'user_server_info_updated_at'),
+(4, 'streams_name_index');
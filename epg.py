@@ -0,0 +1,347 @@
+import os
+import gzip
+import time
+import base64
+import logging
+import threading
+from array import array
+from bisect import bisect_right
+from datetime import datetime, timezone
+import xml.etree.ElementTree as ET
+
+logger = logging.getLogger(__name__)
+
+# Programmes that ended more than EPG_PAST_HOURS ago, or start more than
+# EPG_FUTURE_HOURS from now, are dropped from the guide.
+EPG_PAST_HOURS = float(os.environ.get("EPG_PAST_HOURS", "24"))
+EPG_FUTURE_HOURS = float(os.environ.get("EPG_FUTURE_HOURS", "72"))
+# Guide served by /xmltv.php, relative to the project root; a pre-gzipped
+# copy is written next to it as <path>.gz.
+EPG_GUIDE_PATH = os.environ.get("EPG_GUIDE_PATH", "xml/guide.xml")
+EPG_GZIP_LEVEL = int(os.environ.get("EPG_GZIP_LEVEL", "9"))
+
+_XML_HEADER = b'<?xml version="1.0" encoding="UTF-8"?>\n<!DOCTYPE tv SYSTEM "xmltv.dtd">\n'
+
+
+def parse_xmltv_time(value):
+    """``20240101120000 +0000`` -> unix timestamp (None if unparseable).
+
+    The offset is optional (UTC is assumed) and seconds may be missing.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    stamp, _, offset = value.partition(" ")
+    try:
+        dt = datetime.strptime(stamp[:14].ljust(14, "0"), "%Y%m%d%H%M%S").replace(tzinfo=timezone.utc)
+    except ValueError:
+        return None
+    ts = dt.timestamp()
+    offset = offset.strip()
+    if len(offset) == 5 and offset[0] in "+-" and offset[1:].isdigit():
+        seconds = int(offset[1:3]) * 3600 + int(offset[3:5]) * 60
+        ts -= seconds if offset[0] == "+" else -seconds
+    return int(ts)
+
+
+def _compact(elem):
+    # Drop indentation-only text/tails; it is a large share of a typical guide.
+    for node in elem.iter():
+        if node.text is not None and len(node) and not node.text.strip():
+            node.text = None
+        if node.tail is not None and not node.tail.strip():
+            node.tail = None
+    elem.tail = "\n"
+
+
+class _GuideWriter:
+    """Writes the same bytes to ``path`` and a gzip ``path.gz``, both swapped in atomically."""
+
+    def __init__(self, path, level=EPG_GZIP_LEVEL):
+        self.path = path
+        self.gz_path = path + ".gz"
+        suffix = f".{os.getpid()}.tmp"
+        self.tmp_path = self.path + suffix
+        self.tmp_gz_path = self.gz_path + suffix
+        self._plain = open(self.tmp_path, "wb")
+        self._gz = gzip.GzipFile(self.tmp_gz_path, "wb", compresslevel=level, mtime=0)
+        self.bytes_written = 0
+
+    def write(self, data: bytes):
+        self._plain.write(data)
+        self._gz.write(data)
+        self.bytes_written += len(data)
+
+    def commit(self):
+        self._plain.close()
+        self._gz.close()
+        # Same mtime on both so the server never considers the .gz stale;
+        # the .gz goes in first so it is never older than the file it shadows.
+        now = time.time()
+        os.utime(self.tmp_path, (now, now))
+        os.utime(self.tmp_gz_path, (now, now))
+        os.replace(self.tmp_gz_path, self.gz_path)
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        for f in (self._plain, self._gz):
+            try:
+                f.close()
+            except Exception:
+                pass
+        for path in (self.tmp_path, self.tmp_gz_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def filter_guide(source, dest_path, channel_ids, now=None,
+                 past_hours=EPG_PAST_HOURS, future_hours=EPG_FUTURE_HOURS) -> dict:
+    """Stream an XMLTV document into a guide restricted to ``channel_ids``.
+
+    ``source`` is a path (optionally ``.gz``) or a binary file object, e.g. an
+    HTTP response body. Elements are parsed and discarded one at a time, so
+    memory stays flat no matter how large the upstream guide is. The result replaces ``dest_path``
+    (and ``dest_path.gz``) only if the whole document parsed.
+    """
+    now = time.time() if now is None else now
+    window_start = now - past_hours * 3600
+    window_end = now + future_hours * 3600
+    channel_ids = frozenset(channel_ids)
+    stats = {"channels": 0, "channels_kept": 0, "programmes": 0, "programmes_kept": 0,
+             "programmes_out_of_window": 0, "bytes_written": 0}
+
+    if isinstance(source, str) and source.endswith(".gz"):
+        with gzip.open(source, "rb") as f:
+            return filter_guide(f, dest_path, channel_ids, now, past_hours, future_hours)
+
+    writer = _GuideWriter(dest_path)
+    try:
+        depth = 0
+        root = None
+        for event, elem in ET.iterparse(source, events=("start", "end")):
+            if event == "start":
+                depth += 1
+                if depth == 1:
+                    root = elem
+                    attrs = "".join(f' {k}="{_escape_attr(v)}"' for k, v in elem.attrib.items())
+                    writer.write(_XML_HEADER + f"<tv{attrs}>\n".encode("utf-8"))
+                continue
+            depth -= 1
+            if depth != 1:
+                continue
+            keep = False
+            if elem.tag == "channel":
+                stats["channels"] += 1
+                keep = elem.get("id") in channel_ids
+                stats["channels_kept"] += keep
+            elif elem.tag == "programme":
+                stats["programmes"] += 1
+                if elem.get("channel") in channel_ids:
+                    start = parse_xmltv_time(elem.get("start"))
+                    stop = parse_xmltv_time(elem.get("stop"))
+                    stop = start if stop is None else stop
+                    if start is not None and stop >= window_start and start <= window_end:
+                        keep = True
+                        stats["programmes_kept"] += 1
+                    else:
+                        stats["programmes_out_of_window"] += 1
+            if keep:
+                _compact(elem)
+                writer.write(ET.tostring(elem, encoding="utf-8", xml_declaration=False))
+            # Parsed children stay attached to the root unless removed.
+            root.clear()
+        if root is None:
+            raise ValueError("empty XMLTV document")
+        writer.write(b"</tv>\n")
+        writer.commit()
+    except BaseException:
+        writer.abort()
+        raise
+    stats["bytes_written"] = writer.bytes_written
+    return stats
+
+
+def _escape_attr(value):
+    return (value.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+            .replace('"', "&quot;"))
+
+
+# How often (seconds) the guide file is stat()ed for changes by EpgIndex.
+EPG_INDEX_CHECK_SECONDS = float(os.environ.get("EPG_INDEX_CHECK_SECONDS", "30"))
+
+
+def _b64(text):
+    return base64.b64encode((text or "").encode("utf-8")).decode("ascii")
+
+
+class ChannelProgrammes:
+    """Time-sorted programmes of one channel.
+
+    Start/stop times live in two ``array('q')`` columns for bisecting;
+    titles and descriptions are kept already base64-encoded, as served.
+    """
+
+    __slots__ = ("starts", "stops", "entries", "digest")
+
+    def __init__(self, records, digest):
+        records.sort(key=lambda r: r[0])
+        self.starts = array("q", (r[0] for r in records))
+        self.stops = array("q", (r[1] for r in records))
+        self.entries = tuple((_b64(r[2]), _b64(r[3]), r[4]) for r in records)
+        self.digest = digest
+
+    def __len__(self):
+        return len(self.starts)
+
+    def current_index(self, now) -> int:
+        """Index of the programme airing at ``now``, or of the next one."""
+        i = bisect_right(self.starts, now) - 1
+        if i >= 0 and self.stops[i] > now:
+            return i
+        return i + 1
+
+
+class EpgIndex:
+    """In-memory per-channel programme index over the filtered guide.
+
+    The file is stat()ed at most every ``check_interval`` seconds; when it has
+    changed it is re-parsed, and channels whose programmes are identical keep
+    their existing arrays. Lookups during a rebuild use the previous index.
+    """
+
+    def __init__(self, path, check_interval=EPG_INDEX_CHECK_SECONDS):
+        self.path = path
+        self.check_interval = check_interval
+        self._channels: dict[str, ChannelProgrammes] = {}
+        self._signature = None
+        self._checked_at = 0.0
+        self._loaded = False
+        self._rebuild_lock = threading.Lock()
+        self.rebuilds = 0
+        self.channels_reused = 0
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def refresh(self):
+        now = time.monotonic()
+        if self._loaded and now - self._checked_at < self.check_interval:
+            return
+        # Only the first load makes callers wait; afterwards whoever gets the
+        # lock rebuilds and everyone else keeps reading the current index.
+        if not self._rebuild_lock.acquire(blocking=not self._loaded):
+            return
+        try:
+            if self._loaded and now - self._checked_at < self.check_interval:
+                return
+            signature = self._stat()
+            if signature != self._signature:
+                self._channels = self._build() if signature is not None else {}
+                self._signature = signature
+                self.rebuilds += 1
+            self._checked_at = now
+            self._loaded = True
+        except Exception:
+            # Keep the previous index; retry after the next interval.
+            logger.exception("Could not index EPG guide %s", self.path)
+            self._checked_at = now
+            self._loaded = True
+        finally:
+            self._rebuild_lock.release()
+
+    def _build(self):
+        records = {}
+        depth = 0
+        root = None
+        for event, elem in ET.iterparse(self.path, events=("start", "end")):
+            if event == "start":
+                depth += 1
+                if depth == 1:
+                    root = elem
+                continue
+            depth -= 1
+            if depth != 1:
+                continue
+            if elem.tag == "programme":
+                start = parse_xmltv_time(elem.get("start"))
+                if start is not None:
+                    stop = parse_xmltv_time(elem.get("stop"))
+                    title = elem.find("title")
+                    records.setdefault(elem.get("channel"), []).append((
+                        start,
+                        start if stop is None else stop,
+                        elem.findtext("title"),
+                        elem.findtext("desc"),
+                        (title.get("lang") if title is not None else None) or "",
+                    ))
+            root.clear()
+
+        previous = self._channels
+        channels = {}
+        for channel_id, channel_records in records.items():
+            digest = hash(tuple(channel_records))
+            old = previous.get(channel_id)
+            if old is not None and old.digest == digest:
+                channels[channel_id] = old
+                self.channels_reused += 1
+            else:
+                channels[channel_id] = ChannelProgrammes(channel_records, digest)
+        return channels
+
+    def loaded(self) -> bool:
+        """True when a guide file has been indexed."""
+        self.refresh()
+        return self._signature is not None
+
+    def channel(self, channel_id):
+        self.refresh()
+        return self._channels.get(channel_id) if channel_id else None
+
+    def listings(self, channel_id, limit=None, now=None, with_status=False) -> list:
+        """Xtream ``epg_listings`` for a channel.
+
+        With ``limit`` only the current and upcoming programmes are returned
+        (``get_short_epg``); without it the whole day table is returned
+        (``get_simple_data_table``), flagged with ``now_playing``.
+        """
+        programmes = self.channel(channel_id)
+        if programmes is None:
+            return []
+        now = int(time.time() if now is None else now)
+        first = programmes.current_index(now) if limit is not None else 0
+        last = len(programmes) if limit is None else min(len(programmes), first + max(0, limit))
+        listings = []
+        for i in range(first, last):
+            start, stop = programmes.starts[i], programmes.stops[i]
+            title, description, lang = programmes.entries[i]
+            listing = {
+                "id": str(i),
+                "epg_id": str(i),
+                "title": title,
+                "lang": lang,
+                "start": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(start)),
+                "end": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(stop)),
+                "description": description,
+                "channel_id": channel_id,
+                "start_timestamp": str(start),
+                "stop_timestamp": str(stop),
+            }
+            if with_status:
+                listing["now_playing"] = 1 if start <= now < stop else 0
+                listing["has_archive"] = 0
+            listings.append(listing)
+        return listings
+
+    def stats(self) -> dict:
+        return {
+            "channels": len(self._channels),
+            "programmes": sum(len(c) for c in self._channels.values()),
+            "rebuilds": self.rebuilds,
+            "channels_reused": self.channels_reused,
+        }
@@ -0,0 +1,54 @@
+# Configuración de gunicorn para producción: gunicorn -c gunicorn.conf.py app:app
+import os
+import multiprocessing
+
+
+def _env_int(name: str, default: int) -> int:
+    raw = os.environ.get(name)
+    if raw is None or str(raw).strip() == "":
+        return default
+    return int(raw)
+
+
+def _env_bool(name: str, default: bool = False) -> bool:
+    raw = os.environ.get(name)
+    if raw is None:
+        return default
+    return str(raw).strip().lower() in {"1", "true", "t", "yes", "y", "on"}
+
+
+bind = os.environ.get("GUNICORN_BIND") or "0.0.0.0:{}".format(os.environ.get("PORT") or 5000)
+
+# Pre-fork workers, each with a thread pool (requests mostly wait on MySQL or the panel).
+workers = _env_int("GUNICORN_WORKERS", _env_int("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "gthread"
+threads = _env_int("GUNICORN_THREADS", 8)
+
+# Seconds an idle client connection is kept open between requests.
+keepalive = _env_int("GUNICORN_KEEPALIVE", 5)
+# A worker whose heartbeat is silent for longer than this is killed and replaced. With gthread
+# workers the heartbeat runs on its own thread, so this does not bound individual requests; those
+# are bounded by the upstream (HTTP_*_TIMEOUT) and database (MYSQL_*_TIMEOUT) timeouts.
+timeout = _env_int("GUNICORN_TIMEOUT", 30)
+# Time given to in-flight requests on HUP/TERM before workers are force-killed.
+graceful_timeout = _env_int("GUNICORN_GRACEFUL_TIMEOUT", 30)
+
+# Recycle workers periodically; the jitter avoids restarting them all at once.
+max_requests = _env_int("GUNICORN_MAX_REQUESTS", 10000)
+max_requests_jitter = _env_int("GUNICORN_MAX_REQUESTS_JITTER", 1000)
+
+# Request line / header limits.
+limit_request_line = _env_int("GUNICORN_LIMIT_REQUEST_LINE", 4094)
+limit_request_fields = _env_int("GUNICORN_LIMIT_REQUEST_FIELDS", 100)
+
+# Loading the app in the master shares memory between workers, but every
+# per-process resource (connection pool, caches) is only created after fork
+# when this stays off. The connection pool also discards inherited sockets.
+preload_app = _env_bool("GUNICORN_PRELOAD", False)
+
+# Heartbeat files on tmpfs so a slow container disk can't stall workers.
+worker_tmp_dir = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+accesslog = os.environ.get("GUNICORN_ACCESS_LOG") or None
+errorlog = "-"
+loglevel = os.environ.get("GUNICORN_LOG_LEVEL", "info")
@@ -0,0 +1,347 @@
+import os
+import re
+import hmac
+import time
+import base64
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from urllib.parse import urljoin, urlsplit
+
+from cache import TTLCache, SingleFlight
+
+logger = logging.getLogger(__name__)
+
+
+def _env_bool(name: str, default: bool = False) -> bool:
+    raw = os.environ.get(name)
+    if raw is None:
+        return default
+    return str(raw).strip().lower() in {"1", "true", "t", "yes", "y", "on"}
+
+
+# Serve /live/<user>/<pass>/<id>.m3u8 from a shared cache instead of redirecting to the panel.
+HLS_CACHE_ENABLED = _env_bool("HLS_CACHE_ENABLED", False)
+# Encrypts and signs the links written into rewritten playlists (same value on every instance).
+HLS_SECRET = os.environ.get("HLS_SECRET") or ""
+# Seconds a playlist link stays valid; players keep polling a variant playlist for the whole session.
+HLS_LINK_TTL = int(os.environ.get("HLS_LINK_TTL", "21600"))
+# Panel line the playlists and segments are fetched with (defaults to the sync scripts' line).
+HLS_USERNAME = os.environ.get("HLS_USERNAME") or os.environ.get("USERNAME") or ""
+HLS_PASSWORD = os.environ.get("HLS_PASSWORD") or os.environ.get("PASSWORD") or ""
+# Seconds a playlist is reused; keep it well under the segment duration.
+HLS_PLAYLIST_TTL = float(os.environ.get("HLS_PLAYLIST_TTL", "0.5"))
+HLS_PLAYLIST_MAX_ENTRIES = int(os.environ.get("HLS_PLAYLIST_MAX_ENTRIES", "2048"))
+# Segment budget per worker, in memory and on disk (0 disables the disk tier).
+HLS_MEMORY_BYTES = int(os.environ.get("HLS_MEMORY_BYTES", str(128 * 1024 * 1024)))
+HLS_DISK_BYTES = int(os.environ.get("HLS_DISK_BYTES", str(1024 * 1024 * 1024)))
+HLS_CACHE_DIR = os.environ.get("HLS_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "xtream_hls")
+# Channels with their own hit/miss counters per worker; the least recently used are folded into "other".
+HLS_CHANNEL_STATS_MAX = int(os.environ.get("HLS_CHANNEL_STATS_MAX", "1000"))
+
+_URI_ATTRIBUTE = re.compile(r'URI="([^"]+)"')
+_EXTENSION = re.compile(r"[A-Za-z0-9]{1,8}")
+_LINK_NAME = re.compile(r"^([A-Za-z0-9_-]+)\.([0-9]{1,12})\.([A-Za-z0-9]{1,8})$")
+_TAG_SIZE = 16
+
+PLAYLIST_MIMETYPE = "application/vnd.apple.mpegurl"
+SEGMENT_MIMETYPES = {"ts": "video/mp2t", "aac": "audio/aac", "mp4": "video/mp4", "m4s": "video/iso.segment"}
+
+
+class HlsUpstreamError(Exception):
+    def __init__(self, status):
+        super().__init__(f"upstream answered {status}")
+        self.status = status
+
+
+def rewrite_playlist(text, base_url, make_link):
+    """Point every URI of an m3u8 (segments, variants, keys, maps) at ``make_link(absolute_url)``."""
+    lines = []
+    for line in text.splitlines():
+        stripped = line.strip()
+        if stripped and not stripped.startswith("#"):
+            line = make_link(urljoin(base_url, stripped))
+        elif 'URI="' in stripped:
+            line = _URI_ATTRIBUTE.sub(lambda m: 'URI="{}"'.format(make_link(urljoin(base_url, m.group(1)))), line)
+        lines.append(line)
+    return "\n".join(lines) + "\n"
+
+
+def _new_counts() -> dict:
+    return {"playlist_hits": 0, "playlist_misses": 0, "segment_hits": 0, "segment_misses": 0}
+
+
+def _pid_alive(pid) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class SegmentStore:
+    """Byte-budgeted LRU of segments; entries evicted from memory spill to disk.
+
+    The disk tier lives in a directory per process, so workers never evict
+    each other's files; directories left by dead processes are removed.
+    """
+
+    def __init__(self, memory_bytes=HLS_MEMORY_BYTES, disk_bytes=HLS_DISK_BYTES, directory=HLS_CACHE_DIR):
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.root = directory
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._disk: "OrderedDict[str, int]" = OrderedDict()
+        self.memory_used = 0
+        self.disk_used = 0
+        self.spills = 0
+        self._lock = threading.Lock()
+        self._pid = None
+        self._directory = None
+
+    def _dir(self):
+        # Created lazily so a forked worker never writes into its parent's directory.
+        pid = os.getpid()
+        if self._pid == pid:
+            return self._directory
+        with self._lock:
+            if self._pid != pid:
+                self._disk.clear()
+                self.disk_used = 0
+                os.makedirs(self.root, exist_ok=True)
+                for name in os.listdir(self.root):
+                    if name.isdigit() and int(name) != pid and not _pid_alive(int(name)):
+                        shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+                self._directory = os.path.join(self.root, str(pid))
+                shutil.rmtree(self._directory, ignore_errors=True)
+                os.makedirs(self._directory, exist_ok=True)
+                self._pid = pid
+        return self._directory
+
+    def get(self, key):
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                return data
+            if key not in self._disk or self._pid != os.getpid():
+                return None
+            self._disk.move_to_end(key)
+        try:
+            with open(os.path.join(self._directory, key), "rb") as f:
+                return f.read()
+        except OSError:
+            with self._lock:
+                size = self._disk.pop(key, None)
+                if size is not None:
+                    self.disk_used -= size
+            return None
+
+    def put(self, key, data):
+        if len(data) > self.memory_bytes:
+            return
+        evicted = []
+        with self._lock:
+            if key in self._memory:
+                return
+            self._memory[key] = data
+            self.memory_used += len(data)
+            while self.memory_used > self.memory_bytes:
+                old_key, old_data = self._memory.popitem(last=False)
+                self.memory_used -= len(old_data)
+                evicted.append((old_key, old_data))
+        if self.disk_bytes > 0:
+            for old_key, old_data in evicted:
+                self._spill(old_key, old_data)
+
+    def _spill(self, key, data):
+        try:
+            directory = self._dir()
+            path = os.path.join(directory, key)
+            with open(path + ".tmp", "wb") as f:
+                f.write(data)
+            os.replace(path + ".tmp", path)
+        except OSError:
+            logger.exception("Could not spill HLS segment to %s", self.root)
+            return
+        removed = []
+        with self._lock:
+            if key not in self._disk:
+                self._disk[key] = len(data)
+                self.disk_used += len(data)
+                self.spills += 1
+            while self.disk_used > self.disk_bytes:
+                old_key, size = self._disk.popitem(last=False)
+                self.disk_used -= size
+                removed.append(old_key)
+        for old_key in removed:
+            try:
+                os.remove(os.path.join(directory, old_key))
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "memory_entries": len(self._memory), "memory_bytes": self.memory_used,
+                "disk_entries": len(self._disk), "disk_bytes": self.disk_used, "spills": self.spills,
+            }
+
+
+class HlsCache:
+    """Shared HLS playlists and segments for live channels.
+
+    Playlists are fetched from the panel with one line (``username``/``password``),
+    rewritten so every URI points back at this API as an encrypted, expiring link, and reused
+    for ``playlist_ttl`` seconds. Segments are kept in a :class:`SegmentStore`.
+    Concurrent misses for the same playlist or segment share one upstream fetch.
+    Hits and misses are counted per channel.
+    """
+
+    def __init__(self, http, secret=HLS_SECRET, username=HLS_USERNAME, password=HLS_PASSWORD,
+                 link_ttl=HLS_LINK_TTL, playlist_ttl=HLS_PLAYLIST_TTL, playlist_entries=HLS_PLAYLIST_MAX_ENTRIES,
+                 store=None, channel_stats_max=HLS_CHANNEL_STATS_MAX, enabled=HLS_CACHE_ENABLED):
+        self.http = http
+        self.secret = secret
+        self.username = username
+        self.password = password
+        self.link_ttl = link_ttl
+        # Separate keys for encrypting and for signing links.
+        self._cipher_key = hmac.new(secret.encode("utf-8"), b"hls-link-cipher", hashlib.sha256).digest()
+        self._mac_key = hmac.new(secret.encode("utf-8"), b"hls-link-mac", hashlib.sha256).digest()
+        self.enabled = bool(enabled and secret and username and password)
+        if enabled and not self.enabled:
+            logger.warning("HLS_CACHE_ENABLED is set but HLS_SECRET or the panel line is missing; cache disabled")
+        self.playlists = TTLCache(playlist_entries, playlist_ttl)
+        self.segments = store or SegmentStore()
+        self._flight = SingleFlight()
+        # stream_id -> counters, least recently used first; evicted counters go to _other.
+        self._channels = OrderedDict()
+        self._other = _new_counts()
+        self.channel_stats_max = max(1, channel_stats_max)
+        self._lock = threading.Lock()
+
+    # --- links ---
+
+    def _tag(self, stream_id, expires, url: bytes) -> bytes:
+        message = "{}\n{}\n".format(stream_id, expires).encode("utf-8") + url
+        return hmac.new(self._mac_key, message, hashlib.sha256).digest()[:_TAG_SIZE]
+
+    def _keystream(self, tag, size) -> bytes:
+        blocks = []
+        for counter in range((size + 31) // 32):
+            blocks.append(hmac.new(self._cipher_key, tag + counter.to_bytes(4, "big"), hashlib.sha256).digest())
+        return b"".join(blocks)[:size]
+
+    def _xor(self, tag, data) -> bytes:
+        return bytes(a ^ b for a, b in zip(data, self._keystream(tag, len(data))))
+
+    def link(self, stream_id, url) -> str:
+        """Link to ``url`` valid for ``link_ttl`` seconds.
+
+        The upstream URL carries the panel line, so it is encrypted: the HMAC
+        tag of (stream, expiry, URL) doubles as the keystream nonce.
+        """
+        name = urlsplit(url).path.rsplit("/", 1)[-1]
+        ext = name.rsplit(".", 1)[-1] if "." in name else "ts"
+        if not _EXTENSION.fullmatch(ext):
+            ext = "ts"
+        expires = int(time.time() + self.link_ttl)
+        raw = url.encode("utf-8")
+        tag = self._tag(stream_id, expires, raw)
+        payload = base64.urlsafe_b64encode(tag + self._xor(tag, raw)).decode("ascii").rstrip("=")
+        return f"/hls-cache/{stream_id}/{payload}.{expires}.{ext}"
+
+    def resolve(self, stream_id, name):
+        """(upstream URL, extension) of a link name, or (None, None) if it isn't ours or has expired."""
+        match = _LINK_NAME.match(name)
+        if not match:
+            return None, None
+        payload, expires, ext = match.groups()
+        if int(expires) < time.time():
+            return None, None
+        try:
+            data = base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4))
+        except ValueError:
+            return None, None
+        tag, encrypted = data[:_TAG_SIZE], data[_TAG_SIZE:]
+        raw = self._xor(tag, encrypted)
+        if len(tag) != _TAG_SIZE or not hmac.compare_digest(self._tag(stream_id, int(expires), raw), tag):
+            return None, None
+        try:
+            return raw.decode("utf-8"), ext
+        except UnicodeDecodeError:
+            return None, None
+
+    def live_url(self, server_url, stream_id) -> str:
+        return f"{server_url}/live/{self.username}/{self.password}/{stream_id}.m3u8"
+
+    # --- counters ---
+
+    def _count(self, stream_id, kind, hit):
+        # stream_id comes from the request, so the map is bounded: any id can be asked for.
+        with self._lock:
+            counts = self._channels.get(stream_id)
+            if counts is None:
+                if len(self._channels) >= self.channel_stats_max:
+                    _, evicted = self._channels.popitem(last=False)
+                    for key, value in evicted.items():
+                        self._other[key] += value
+                counts = self._channels[stream_id] = _new_counts()
+            else:
+                self._channels.move_to_end(stream_id)
+            counts[kind + ("_hits" if hit else "_misses")] += 1
+
+    def channel_stats(self) -> dict:
+        """Counters per channel, plus ``"other"`` for the channels evicted from the map."""
+        with self._lock:
+            stats = {stream_id: dict(counts) for stream_id, counts in self._channels.items()}
+            if any(self._other.values()):
+                stats["other"] = dict(self._other)
+            return stats
+
+    # --- lookups ---
+
+    def playlist(self, stream_id, url, key=None) -> bytes:
+        key = key or url
+        body = self.playlists.get(key)
+        if body is not None:
+            self._count(stream_id, "playlist", True)
+            return body
+        self._count(stream_id, "playlist", False)
+        return self._flight.do(("playlist", key), lambda: self._load_playlist(stream_id, url, key))
+
+    def _load_playlist(self, stream_id, url, key):
+        response = self.http.get(url, headers={"User-Agent": "curl/7.88.1"})
+        if response.status_code != 200:
+            raise HlsUpstreamError(response.status_code)
+        # response.url is after redirects, which is what relative URIs resolve against.
+        body = rewrite_playlist(response.text, response.url, lambda u: self.link(stream_id, u)).encode("utf-8")
+        self.playlists.set(key, body)
+        return body
+
+    def segment(self, stream_id, url) -> bytes:
+        key = hashlib.sha1(url.encode("utf-8")).hexdigest()
+        data = self.segments.get(key)
+        if data is not None:
+            self._count(stream_id, "segment", True)
+            return data
+        self._count(stream_id, "segment", False)
+        return self._flight.do(("segment", key), lambda: self._load_segment(url, key))
+
+    def _load_segment(self, url, key):
+        response = self.http.get(url, headers={"User-Agent": "curl/7.88.1"})
+        if response.status_code != 200:
+            raise HlsUpstreamError(response.status_code)
+        data = response.content
+        self.segments.put(key, data)
+        return data
+
+    def stats(self) -> dict:
+        return {"enabled": self.enabled, "playlists": self.playlists.stats(), "segments": self.segments.stats(),
+                "single_flight": self._flight.stats()}
@@ -0,0 +1,211 @@
+import os
+import time
+import random
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Timeouts in seconds. The read timeout bounds each socket read, not the whole body.
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", "3.05"))
+HTTP_READ_TIMEOUT = float(os.environ.get("HTTP_READ_TIMEOUT", "10"))
+# Extra attempts for idempotent requests that fail with a connection error,
+# a timeout or a 502/503/504, with jittered exponential backoff between them.
+HTTP_RETRIES = int(os.environ.get("HTTP_RETRIES", "2"))
+HTTP_BACKOFF = float(os.environ.get("HTTP_BACKOFF", "0.3"))
+# Keep-alive connections kept per upstream host, and how many hosts get a pool.
+HTTP_POOL_MAXSIZE = int(os.environ.get("HTTP_POOL_MAXSIZE", "20"))
+HTTP_POOL_HOSTS = int(os.environ.get("HTTP_POOL_HOSTS", "10"))
+# Consecutive failures that open a host's circuit, and how long it stays open.
+HTTP_BREAKER_THRESHOLD = int(os.environ.get("HTTP_BREAKER_THRESHOLD", "5"))
+HTTP_BREAKER_COOLDOWN = float(os.environ.get("HTTP_BREAKER_COOLDOWN", "30"))
+
+RETRY_STATUSES = frozenset({502, 503, 504})
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised without touching the network while an upstream's circuit is open."""
+
+
+class CircuitBreaker:
+    """Opens after ``threshold`` consecutive failures; lets one probe through after ``cooldown``."""
+
+    def __init__(self, threshold=HTTP_BREAKER_THRESHOLD, cooldown=HTTP_BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        if self.threshold <= 0:
+            return True
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.cooldown or self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.threshold > 0 and (self.opened_at is not None or self.failures >= self.threshold):
+                self.opened_at = time.monotonic()
+
+
+class HostStats:
+    __slots__ = ("requests", "errors", "retries", "rejected", "total_seconds", "max_seconds", "last_error")
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.rejected = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.last_error = None
+
+
+class UpstreamClient:
+    """Keep-alive HTTP client for the Xtream panels, shared by the API and the sync scripts."""
+
+    def __init__(self, connect_timeout=HTTP_CONNECT_TIMEOUT, read_timeout=HTTP_READ_TIMEOUT,
+                 retries=HTTP_RETRIES, backoff=HTTP_BACKOFF, pool_maxsize=HTTP_POOL_MAXSIZE,
+                 pool_hosts=HTTP_POOL_HOSTS):
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.pool_maxsize = pool_maxsize
+        self.pool_hosts = pool_hosts
+        self._lock = threading.Lock()
+        self._breakers: dict[str, CircuitBreaker] = {}
+        self._stats: dict[str, HostStats] = {}
+        self._session = None
+        self._pid = None
+
+    def _new_session(self):
+        session = requests.Session()
+        # Retries are handled here so they can be jittered and counted.
+        adapter = HTTPAdapter(pool_connections=self.pool_hosts, pool_maxsize=self.pool_maxsize, max_retries=0)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    @property
+    def session(self):
+        # Keep-alive sockets must not be shared with a forked child.
+        if self._session is None or self._pid != os.getpid():
+            with self._lock:
+                if self._session is None or self._pid != os.getpid():
+                    self._session = self._new_session()
+                    self._pid = os.getpid()
+        return self._session
+
+    def _host(self, host):
+        with self._lock:
+            breaker = self._breakers.get(host)
+            if breaker is None:
+                breaker = self._breakers[host] = CircuitBreaker()
+                self._stats[host] = HostStats()
+            return breaker, self._stats[host]
+
+    def breaker(self, url) -> CircuitBreaker:
+        return self._host(urlsplit(url).netloc)[0]
+
+    def _sleep_backoff(self, attempt):
+        # "Full jitter" exponential backoff.
+        time.sleep(random.uniform(0, self.backoff * (2 ** attempt)))
+
+    def get(self, url, params=None, headers=None, timeout=None, retries=None, **kwargs) -> requests.Response:
+        """GET with per-host circuit breaking and retries (GET is idempotent)."""
+        breaker, stats = self._host(urlsplit(url).netloc)
+        retries = self.retries if retries is None else retries
+        timeout = self.timeout if timeout is None else timeout
+        attempt = 0
+        while True:
+            if not breaker.allow():
+                with self._lock:
+                    stats.rejected += 1
+                raise CircuitOpenError(f"Circuit open for {urlsplit(url).netloc}")
+            start = time.monotonic()
+            error = None
+            response = None
+            try:
+                response = self.session.get(url, params=params, headers=headers, timeout=timeout, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                error = e
+            except Exception:
+                breaker.record_failure()
+                raise
+            elapsed = time.monotonic() - start
+            failed = error is not None or response.status_code in RETRY_STATUSES
+            with self._lock:
+                stats.requests += 1
+                stats.total_seconds += elapsed
+                stats.max_seconds = max(stats.max_seconds, elapsed)
+                if failed:
+                    stats.errors += 1
+                    stats.last_error = repr(error) if error is not None else f"HTTP {response.status_code}"
+            if not failed:
+                breaker.record_success()
+                return response
+            breaker.record_failure()
+            if attempt >= retries or breaker.state == "open":
+                if error is not None:
+                    raise error
+                return response
+            if response is not None:
+                response.close()
+            with self._lock:
+                stats.retries += 1
+            self._sleep_backoff(attempt)
+            attempt += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            result = {}
+            for host, stats in self._stats.items():
+                result[host] = {
+                    "requests": stats.requests,
+                    "errors": stats.errors,
+                    "retries": stats.retries,
+                    "rejected": stats.rejected,
+                    "avg_seconds": round(stats.total_seconds / stats.requests, 6) if stats.requests else 0.0,
+                    "max_seconds": round(stats.max_seconds, 6),
+                    "last_error": stats.last_error,
+                    "circuit": self._breakers[host].state,
+                }
+            return result
+
+
+_default_client = None
+_default_client_lock = threading.Lock()
+
+
+def get_client() -> UpstreamClient:
+    """Process-wide client, so every caller shares the same keep-alive pools."""
+    global _default_client
+    if _default_client is None:
+        with _default_client_lock:
+            if _default_client is None:
+                _default_client = UpstreamClient()
+    return _default_client
@@ -0,0 +1,333 @@
+import os
+import json
+import time
+import fcntl
+import logging
+import tempfile
+import functools
+import threading
+from bisect import bisect_left
+
+logger = logging.getLogger(__name__)
+
+# Every worker process writes a snapshot of its metrics here; /metrics sums
+# them, so any worker can answer for all of them. Ideally on tmpfs.
+METRICS_DIR = os.environ.get("METRICS_DIR") or (
+    "/dev/shm/xtream_metrics" if os.path.isdir("/dev/shm") else os.path.join(tempfile.gettempdir(), "xtream_metrics"))
+# Seconds between snapshot writes of each worker (a scrape may see data this old from other workers).
+METRICS_FLUSH_SECONDS = float(os.environ.get("METRICS_FLUSH_SECONDS", "5"))
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_ARCHIVE = "archive.json"
+
+
+class Counter:
+    __slots__ = ("name", "help", "labelnames", "_values", "_lock")
+    type = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues, amount=1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [[list(k), v] for k, v in self._values.items()]
+
+
+class Histogram:
+    """Fixed-bucket histogram; ``observe`` is one bisect and three increments."""
+
+    __slots__ = ("name", "help", "labelnames", "buckets", "_values", "_lock")
+    type = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labelvalues -> [per-bucket counts (last one is +Inf), sum, count]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labelvalues)
+            if state is None:
+                state = self._values[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def samples(self):
+        with self._lock:
+            return [[list(k), [list(v[0]), v[1], v[2]]] for k, v in self._values.items()]
+
+
+def timed(histogram):
+    """Decorator: observe the wall time of every call, labelled with the function name."""
+    def decorator(func):
+        label = func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start, label)
+        return wrapper
+    return decorator
+
+
+class Registry:
+    """Process-local metrics plus stats callbacks, shared across workers through snapshot files.
+
+    Callbacks return ``(name, type, help, labels_dict, value)`` tuples for
+    counters/gauges that already live elsewhere (pool, caches, rate limiter);
+    they are only evaluated when a snapshot is written.
+    """
+
+    def __init__(self, directory=METRICS_DIR, flush_interval=METRICS_FLUSH_SECONDS):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._metrics = {}
+        self._callbacks = []
+        self._flusher_pid = None
+        self._lock = threading.Lock()
+
+    def counter(self, name, help, labelnames=()):
+        return self._register(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def _register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def register_callback(self, callback):
+        self._callbacks.append(callback)
+
+    # --- snapshots ---
+
+    def snapshot(self) -> dict:
+        families = {}
+        for metric in self._metrics.values():
+            families[metric.name] = {
+                "type": metric.type, "help": metric.help, "labelnames": list(metric.labelnames),
+                "buckets": list(metric.buckets) if metric.type == "histogram" else None,
+                "samples": metric.samples(),
+            }
+        for callback in self._callbacks:
+            try:
+                rows = list(callback())
+            except Exception:
+                logger.exception("Metrics callback %r failed", callback)
+                continue
+            for name, kind, help, labels, value in rows:
+                family = families.setdefault(name, {
+                    "type": kind, "help": help, "labelnames": sorted(labels), "buckets": None, "samples": []})
+                family["samples"].append([[str(labels[k]) for k in family["labelnames"]], value])
+        return families
+
+    def _path(self, pid):
+        return os.path.join(self.directory, f"{pid}.json")
+
+    def flush(self):
+        """Write this process' snapshot; returns False if the directory isn't usable."""
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = self._path(os.getpid())
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"pid": os.getpid(), "metrics": self.snapshot()}, f)
+            os.replace(tmp_path, path)
+            return True
+        except OSError:
+            logger.exception("Could not write metrics snapshot to %s", self.directory)
+            return False
+
+    def ensure_flusher(self):
+        # Threads don't survive fork: each worker starts its own, on first use.
+        if self._flusher_pid == os.getpid() or self.flush_interval <= 0:
+            return
+        with self._lock:
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+            threading.Thread(target=self._flush_loop, name="metrics-flusher", daemon=True).start()
+
+    def _flush_loop(self):
+        pid = os.getpid()
+        while self._flusher_pid == pid:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    # --- aggregation ---
+
+    def collect(self) -> dict:
+        """Metrics of every worker on the host (only this process' if snapshots are unavailable)."""
+        if not self.flush():
+            return self.snapshot()
+        merged = {}
+        lock_path = os.path.join(self.directory, ".lock")
+        with open(lock_path, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                archive_path = os.path.join(self.directory, _ARCHIVE)
+                archive = _load(archive_path) or {}
+                archive_changed = False
+                for filename in os.listdir(self.directory):
+                    if not filename.endswith(".json") or filename == _ARCHIVE:
+                        continue
+                    data = _load(os.path.join(self.directory, filename))
+                    if data is None:
+                        continue
+                    if _alive(data.get("pid")):
+                        _merge(merged, data["metrics"], gauges=True)
+                    else:
+                        # Keep the counters of workers that exited; their gauges no longer apply.
+                        _merge(archive, data["metrics"], gauges=False)
+                        archive_changed = True
+                        os.remove(os.path.join(self.directory, filename))
+                if archive_changed:
+                    tmp_path = archive_path + ".tmp"
+                    with open(tmp_path, "w") as f:
+                        json.dump(archive, f)
+                    os.replace(tmp_path, archive_path)
+                _merge(merged, archive, gauges=False)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+        return merged
+
+    def render(self) -> str:
+        families = add_hit_ratios(self.collect())
+        return render(add_hit_ratios(families, "xtream_hls_hits_total", "xtream_hls_misses_total", "xtream_hls_hit_ratio"))
+
+
+def _load(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _alive(pid) -> bool:
+    if not isinstance(pid, int):
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _merge(into, families, gauges):
+    for name, family in families.items():
+        if family["type"] == "gauge" and not gauges:
+            continue
+        target = into.get(name)
+        if target is None:
+            target = into[name] = dict(family, samples=[])
+            target["_index"] = {}
+        index = target.setdefault("_index", {tuple(s[0]): s for s in target["samples"]})
+        for labels, value in family["samples"]:
+            key = tuple(labels)
+            current = index.get(key)
+            if current is None:
+                if family["type"] == "histogram":
+                    value = [list(value[0]), value[1], value[2]]
+                sample = [list(labels), value]
+                index[key] = sample
+                target["samples"].append(sample)
+            elif family["type"] == "histogram":
+                counts, total, count = current[1]
+                current[1] = [[a + b for a, b in zip(counts, value[0])], total + value[1], count + value[2]]
+            else:
+                current[1] += value
+    for family in into.values():
+        family.pop("_index", None)
+
+
+def add_hit_ratios(families, hits="xtream_cache_hits_total", misses="xtream_cache_misses_total",
+                   name="xtream_cache_hit_ratio"):
+    """Derive hit ratio gauges from the aggregated hit/miss counters (ratios themselves don't sum)."""
+    if hits not in families or misses not in families:
+        return families
+    missed = {tuple(labels): value for labels, value in families[misses]["samples"]}
+    samples = []
+    for labels, hit in families[hits]["samples"]:
+        lookups = hit + missed.get(tuple(labels), 0)
+        samples.append([labels, round(hit / lookups, 6) if lookups else 0.0])
+    families[name] = {"type": "gauge", "help": "Cache hit ratio over all workers since start.",
+                      "labelnames": families[hits]["labelnames"], "buckets": None, "samples": samples}
+    return families
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return repr(value)
+    return str(value)
+
+
+def render(families) -> str:
+    """Prometheus text exposition format (version 0.0.4)."""
+    lines = []
+    for name in sorted(families):
+        family = families[name]
+        names = family["labelnames"]
+        lines.append(f"# HELP {name} {family['help']}")
+        lines.append(f"# TYPE {name} {family['type']}")
+        for labels, value in sorted(family["samples"], key=lambda s: s[0]):
+            if family["type"] == "histogram":
+                counts, total, count = value
+                cumulative = 0
+                for bound, bucket_count in zip(family["buckets"] + [float("inf")], counts):
+                    cumulative += bucket_count
+                    le = 'le="{}"'.format(_number(bound))
+                    lines.append(f"{name}_bucket{_labels(names, labels, le)} {cumulative}")
+                lines.append(f"{name}_sum{_labels(names, labels)} {_number(total)}")
+                lines.append(f"{name}_count{_labels(names, labels)} {count}")
+            else:
+                lines.append(f"{name}{_labels(names, labels)} {_number(value)}")
+    return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUESTS_TOTAL = REGISTRY.counter(
+    "xtream_http_requests_total", "HTTP requests served, by route, player_api action and status.",
+    ("route", "action", "status"))
+REQUEST_SECONDS = REGISTRY.histogram(
+    "xtream_http_request_duration_seconds", "Time to produce the response, by route and player_api action.",
+    ("route", "action"))
+DB_QUERY_SECONDS = REGISTRY.histogram(
+    "xtream_db_query_duration_seconds", "Database method call time, including pool checkout.", ("method",))
+UPSTREAM_SECONDS = REGISTRY.histogram(
+    "xtream_upstream_request_duration_seconds", "Upstream panel call time, by Api method, host and outcome.",
+    ("method", "host", "outcome"))
@@ -0,0 +1,161 @@
+"""Versioned schema migrations.
+
+    python migrate.py            apply pending migrations (same as "up")
+    python migrate.py status     list applied and pending migrations
+    python migrate.py verify     EXPLAIN the hot queries and check they use their indexes without a filesort
+
+Migrations are the numbered ``migrations/NNNN_name.sql`` files, applied in
+order and recorded in ``schema_migrations``. MariaDB commits DDL implicitly,
+so every statement is written to be safe to re-run if a migration stops halfway.
+The migrations use MariaDB's ``IF NOT EXISTS`` forms of ``CREATE INDEX``,
+``ADD UNIQUE KEY`` and ``ADD COLUMN``, which MySQL does not support.
+"""
+import os
+import re
+import sys
+import time
+import logging
+
+import pymysql
+
+from database import (MYSQL_HOST, MYSQL_USER, MYSQL_PASSWORD, MYSQL_DATABASE, PROBE_STATUS_SQL, CATALOG_PAGE_SIZE,
+                      build_statements)
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+_FILENAME_RE = re.compile(r"^(\d+)_([\w-]+)\.sql$")
+# Connection attempts (2 s apart) before giving up, for "python migrate.py" at container start.
+MIGRATE_CONNECT_RETRIES = int(os.environ.get("MIGRATE_CONNECT_RETRIES", "30"))
+
+logger = logging.getLogger("migrate")
+
+# (description, statement, params, table alias that must use ``key``, key). The stream
+# pages are the statements Database.iter_streams runs, seeking from the middle of the catalog.
+HOT_QUERIES = (
+    ("login", "user_by_credentials", ("user", "pass"), "users", "idx_users_username_password"),
+    ("streams page", "streams_page", ("Channel 5000", "Channel 5000", 5000, CATALOG_PAGE_SIZE),
+     "st", "idx_streams_name"),
+    ("streams null page", "streams_null_page", (0, CATALOG_PAGE_SIZE), "st", "idx_streams_name"),
+    ("category page", "streams_by_category_page", (1, "Channel 5000", "Channel 5000", 5000, CATALOG_PAGE_SIZE),
+     "st", "idx_streams_category_name"),
+    ("category null page", "streams_by_category_null_page", (1, 0, CATALOG_PAGE_SIZE),
+     "st", "idx_streams_category_name"),
+    ("stream by stream_id", "SELECT id FROM streams WHERE stream_id = %s", (1,), "streams", "uq_streams_stream_id"),
+)
+
+
+def connect(retries=MIGRATE_CONNECT_RETRIES):
+    # At container start MariaDB may still be starting up.
+    for attempt in range(retries + 1):
+        try:
+            return pymysql.connect(host=MYSQL_HOST, user=MYSQL_USER, password=MYSQL_PASSWORD,
+                                   database=MYSQL_DATABASE, autocommit=True)
+        except pymysql.err.OperationalError:
+            if attempt >= retries:
+                raise
+            logger.warning("Database not reachable yet, retrying (%d/%d)", attempt + 1, retries)
+            time.sleep(2)
+
+
+def available_migrations():
+    migrations = []
+    for filename in sorted(os.listdir(MIGRATIONS_DIR)):
+        match = _FILENAME_RE.match(filename)
+        if match:
+            migrations.append((int(match.group(1)), match.group(2), os.path.join(MIGRATIONS_DIR, filename)))
+    versions = [m[0] for m in migrations]
+    if len(versions) != len(set(versions)):
+        raise SystemExit("Duplicate migration numbers in {}".format(MIGRATIONS_DIR))
+    return migrations
+
+
+def split_statements(sql):
+    # One statement per ";" at the end of a line; "--" comment lines are dropped.
+    lines = [line for line in sql.splitlines() if not line.strip().startswith("--")]
+    return [s.strip() for s in re.split(r";\s*$", "\n".join(lines), flags=re.M) if s.strip()]
+
+
+def applied_versions(connection):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            " version INT NOT NULL PRIMARY KEY,"
+            " name VARCHAR(255) NOT NULL,"
+            " applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP"
+            ")"
+        )
+        cursor.execute("SELECT version FROM schema_migrations")
+        return {row[0] for row in cursor.fetchall()}
+
+
+def migrate_up(connection):
+    applied = applied_versions(connection)
+    pending = [m for m in available_migrations() if m[0] not in applied]
+    for version, name, path in pending:
+        logger.info("Applying %04d_%s", version, name)
+        with open(path) as f:
+            statements = split_statements(f.read())
+        with connection.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
+            cursor.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+    logger.info("%d migration(s) applied", len(pending))
+
+
+def status(connection):
+    applied = applied_versions(connection)
+    for version, name, _ in available_migrations():
+        print("{:04d}_{:<40} {}".format(version, name, "applied" if version in applied else "pending"))
+
+
+def probe_status_tables(connection):
+    with connection.cursor() as cursor:
+        cursor.execute(PROBE_STATUS_SQL)
+        return frozenset(row[0] for row in cursor.fetchall())
+
+
+def explain_hot_queries(connection):
+    """EXPLAIN the API's hot queries (as built by ``database.build_statements``).
+
+    Yields ``(description, table, expected key, EXPLAIN row of that table or None)``.
+    """
+    statements = build_statements(probe_status_tables(connection))
+    with connection.cursor(pymysql.cursors.DictCursor) as cursor:
+        for description, statement, params, table, key in HOT_QUERIES:
+            cursor.execute("EXPLAIN " + statements.get(statement, statement), params)
+            plan = [row for row in cursor.fetchall() if row["table"] == table]
+            yield description, table, key, plan[0] if plan else None
+
+
+def uses_filesort(row) -> bool:
+    return "filesort" in (row.get("Extra") or "")
+
+
+def verify(connection):
+    """EXPLAIN the API's hot queries; returns False if any of them misses its index or sorts."""
+    ok = True
+    for description, table, key, row in explain_hot_queries(connection):
+        used = row["key"] if row else None
+        good = used == key and not uses_filesort(row)
+        ok = ok and good
+        print("{:<22} {:<5} table={} key={} type={} rows={} extra={}".format(
+            description, "ok" if good else "FAIL", table, used,
+            row["type"] if row else None, row["rows"] if row else None, row["Extra"] if row else None))
+    return ok
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    command = sys.argv[1] if len(sys.argv) > 1 else "up"
+    connection = connect()
+    try:
+        if command == "up":
+            migrate_up(connection)
+        elif command == "status":
+            status(connection)
+        elif command == "verify":
+            sys.exit(0 if verify(connection) else 1)
+        else:
+            print(__doc__)
+            sys.exit(2)
+    finally:
+        connection.close()
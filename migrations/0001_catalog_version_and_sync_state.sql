@@ -0,0 +1,15 @@
+-- Tablas que crean los scripts de sync al vuelo; se declaran aquí para bases existentes
+CREATE TABLE IF NOT EXISTS catalog_version (
+    id TINYINT NOT NULL PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT IGNORE INTO catalog_version (id, version) VALUES (1, 1);
+
+CREATE TABLE IF NOT EXISTS sync_state (
+    name VARCHAR(64) NOT NULL PRIMARY KEY,
+    fingerprint CHAR(64) NOT NULL,
+    record_count INT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+);
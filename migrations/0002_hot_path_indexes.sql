@@ -0,0 +1,12 @@
+-- Login: users WHERE username = ? AND password = ?
+CREATE INDEX IF NOT EXISTS idx_users_username_password ON users (username, password);
+
+-- get_live_streams&category_id=: streams WHERE category_id = ? ORDER BY name
+-- (also serves the category_id foreign key)
+CREATE INDEX IF NOT EXISTS idx_streams_category_name ON streams (category_id, name);
+
+-- Un stream_id por fila: se conserva la fila más antigua de cada duplicado
+DELETE s_dup FROM streams AS s_dup
+    INNER JOIN streams AS s_keep ON s_dup.stream_id = s_keep.stream_id AND s_dup.id > s_keep.id;
+
+ALTER TABLE streams ADD UNIQUE KEY IF NOT EXISTS uq_streams_stream_id (stream_id);
@@ -0,0 +1,4 @@
+-- Edad de user_info/server_info: la API los refresca en segundo plano cuando envejecen.
+-- ON UPDATE basta porque server_info trae timestamp_now y cambia en cada consulta al panel.
+ALTER TABLE user_server_info
+    ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP;
@@ -0,0 +1,3 @@
+-- get_live_streams sin category_id: páginas por (name, id) en iter_streams
+-- (con category_id las sirve idx_streams_category_name)
+CREATE INDEX IF NOT EXISTS idx_streams_name ON streams (name);
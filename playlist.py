@@ -0,0 +1,105 @@
+import os
+import threading
+
+# Public address written into playlist stream URLs (defaults to the address the request came in on).
+M3U_BASE_URL = (os.environ.get("M3U_BASE_URL") or "").rstrip("/")
+
+# Placeholders spliced per request; NUL can't appear in names coming from the catalog.
+BASE_PLACEHOLDER = b"\x00base\x00"
+CREDENTIALS_PLACEHOLDER = b"\x00credentials\x00"
+M3U_MIMETYPE = "audio/x-mpegurl"
+_CHUNK_SIZE = 64 * 1024
+
+# get.php output= -> stream URL extension
+OUTPUT_EXTENSIONS = {"ts": "ts", "mpegts": "ts", "m3u8": "m3u8", "hls": "m3u8"}
+
+
+def _attribute(value) -> str:
+    # Attribute values are double-quoted and a playlist entry is one line.
+    return str(value or "").replace('"', "'").replace("\r", " ").replace("\n", " ")
+
+
+def render_m3u(categories, streams_for, plus=True, extension="ts"):
+    """Yield the playlist template in ~64 KiB chunks.
+
+    Channels are grouped in category order (``categories`` as returned by
+    ``get_all_stream_categories``); ``streams_for(category_id)`` yields that
+    category's stream rows. Stream URLs contain the placeholders instead of the
+    server address and the user's credentials.
+    """
+    chunk = [b"#EXTM3U\n"]
+    size = 0
+    for category in categories:
+        group = _attribute(category["category_name"])
+        for stream in streams_for(category["category_id"]):
+            name = _attribute(stream["name"]).replace(",", " ")
+            if plus:
+                line = '#EXTINF:-1 tvg-id="{}" tvg-name="{}" tvg-logo="{}" group-title="{}",{}\n'.format(
+                    _attribute(stream["epg_channel_id"]), name, _attribute(stream["stream_icon"]), group, name)
+            else:
+                line = "#EXTINF:-1,{}\n".format(name)
+            piece = b"".join((line.encode("utf-8"), BASE_PLACEHOLDER, b"/live/", CREDENTIALS_PLACEHOLDER,
+                              "/{}.{}\n".format(stream["stream_id"], extension).encode("ascii")))
+            chunk.append(piece)
+            size += len(piece)
+            if size >= _CHUNK_SIZE:
+                yield b"".join(chunk)
+                chunk = []
+                size = 0
+    yield b"".join(chunk)
+
+
+def splice(chunks, base_url: str, credentials: str):
+    """Fill a template's placeholders for one request."""
+    base = base_url.encode("utf-8")
+    credentials = credentials.encode("utf-8")
+    for chunk in chunks:
+        yield chunk.replace(BASE_PLACEHOLDER, base).replace(CREDENTIALS_PLACEHOLDER, credentials)
+
+
+class PlaylistCache:
+    """M3U templates per ``(type, output)``, valid for one catalog version.
+
+    A miss renders the template while it is being sent, and keeps it only if the
+    whole playlist was generated (a client that disconnects early stores nothing).
+    ``version_loader`` is ``CatalogCache.current_version``.
+    """
+
+    def __init__(self, version_loader):
+        self.version_loader = version_loader
+        self._templates = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def chunks(self, key: tuple, build):
+        """Template chunks for ``key``; ``build()`` returns a fresh ``render_m3u`` generator."""
+        version, _ = self.version_loader()
+        with self._lock:
+            cached = self._templates.get(key)
+        if cached is not None and cached[0] == version:
+            self.hits += 1
+            return iter(cached[1])
+        self.misses += 1
+        return self._collect(key, version, build())
+
+    def _collect(self, key, version, generator):
+        collected = []
+        for chunk in generator:
+            collected.append(chunk)
+            yield chunk
+        with self._lock:
+            current = self._templates.get(key)
+            if current is None or current[0] != version:
+                # Drop templates left over from older catalog versions.
+                self._templates = {k: v for k, v in self._templates.items() if v[0] == version}
+                self._templates[key] = (version, collected)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "templates": len(self._templates),
+                "bytes": sum(len(c) for _, chunks in self._templates.values() for c in chunks),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
@@ -0,0 +1,234 @@
+import os
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+import pymysql
+
+
+def _env_int(name: str, default: int) -> int:
+    raw = os.environ.get(name)
+    if raw is None or str(raw).strip() == "":
+        return default
+    try:
+        return int(raw)
+    except ValueError:
+        return default
+
+
+MYSQL_POOL_SIZE = _env_int("MYSQL_POOL_SIZE", 10)
+MYSQL_POOL_TIMEOUT = _env_int("MYSQL_POOL_TIMEOUT", 10)
+MYSQL_POOL_MAX_IDLE = _env_int("MYSQL_POOL_MAX_IDLE", 300)
+MYSQL_POOL_MAX_LIFETIME = _env_int("MYSQL_POOL_MAX_LIFETIME", 3600)
+MYSQL_POOL_PING_INTERVAL = _env_int("MYSQL_POOL_PING_INTERVAL", 30)
+# Socket timeouts of pooled connections, so a stuck MariaDB can't hold a request thread forever
+# (gunicorn's gthread timeout only watches the worker's heartbeat, not individual requests).
+MYSQL_CONNECT_TIMEOUT = _env_int("MYSQL_CONNECT_TIMEOUT", 5)
+MYSQL_READ_TIMEOUT = _env_int("MYSQL_READ_TIMEOUT", 30)
+MYSQL_WRITE_TIMEOUT = _env_int("MYSQL_WRITE_TIMEOUT", 30)
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection could be checked out within the pool timeout."""
+
+
+class _PooledConnection:
+    __slots__ = ("conn", "created_at", "last_used")
+
+    def __init__(self, conn):
+        now = time.monotonic()
+        self.conn = conn
+        self.created_at = now
+        self.last_used = now
+
+
+class ConnectionPool:
+    """Bounded, thread-safe pool of pymysql connections.
+
+    At most ``size`` connections exist at once; callers block up to ``timeout``
+    seconds waiting for one to be returned. Idle connections are recycled after
+    ``max_idle`` seconds, every connection after ``max_lifetime`` seconds, and a
+    connection idle for longer than ``ping_interval`` is pinged before reuse.
+    """
+
+    def __init__(self, connect_kwargs, size=MYSQL_POOL_SIZE, timeout=MYSQL_POOL_TIMEOUT,
+                 max_idle=MYSQL_POOL_MAX_IDLE, max_lifetime=MYSQL_POOL_MAX_LIFETIME,
+                 ping_interval=MYSQL_POOL_PING_INTERVAL):
+        self.connect_kwargs = dict(connect_kwargs)
+        # Statements run outside explicit transactions must not pin a snapshot
+        # on a connection that is going to be reused by another request.
+        self.connect_kwargs.setdefault("autocommit", True)
+        self.connect_kwargs.setdefault("connect_timeout", MYSQL_CONNECT_TIMEOUT)
+        self.connect_kwargs.setdefault("read_timeout", MYSQL_READ_TIMEOUT or None)
+        self.connect_kwargs.setdefault("write_timeout", MYSQL_WRITE_TIMEOUT or None)
+        self.size = max(1, int(size))
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.max_lifetime = max_lifetime
+        self.ping_interval = ping_interval
+
+        self._idle = deque()
+        self._total = 0
+        self._cond = threading.Condition(threading.Lock())
+        self._pid = os.getpid()
+
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_seconds = 0.0
+        self._timeouts = 0
+        self._created = 0
+        self._recycled = 0
+        self._discarded = 0
+        self._ping_failures = 0
+
+    def _check_fork(self):
+        # Sockets inherited from a parent process must never be reused by a child.
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._idle.clear()
+            self._total = 0
+
+    def _is_stale(self, pooled, now):
+        if self.max_lifetime > 0 and now - pooled.created_at >= self.max_lifetime:
+            return True
+        if self.max_idle > 0 and now - pooled.last_used >= self.max_idle:
+            return True
+        return False
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _acquire(self):
+        deadline = None
+        waited_since = None
+        with self._cond:
+            self._check_fork()
+            while True:
+                now = time.monotonic()
+                while self._idle:
+                    pooled = self._idle.pop()
+                    if self._is_stale(pooled, now):
+                        self._total -= 1
+                        self._recycled += 1
+                        self._close_quietly(pooled.conn)
+                        continue
+                    self._checkouts += 1
+                    if waited_since is not None:
+                        self._wait_seconds += now - waited_since
+                    return pooled
+                if self._total < self.size:
+                    self._total += 1
+                    self._checkouts += 1
+                    if waited_since is not None:
+                        self._wait_seconds += now - waited_since
+                    break
+                if waited_since is None:
+                    waited_since = now
+                    deadline = now + self.timeout
+                    self._waits += 1
+                remaining = deadline - now
+                if remaining <= 0:
+                    self._timeouts += 1
+                    self._wait_seconds += now - waited_since
+                    raise PoolTimeout("Timed out waiting for a database connection")
+                self._cond.wait(remaining)
+
+        # Open the new connection outside the lock; give the slot back on failure.
+        try:
+            conn = pymysql.connect(**self.connect_kwargs)
+        except Exception:
+            with self._cond:
+                self._total -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._created += 1
+        return _PooledConnection(conn)
+
+    def _healthy(self, pooled):
+        if self.ping_interval < 0:
+            return True
+        if time.monotonic() - pooled.last_used < self.ping_interval:
+            return True
+        try:
+            pooled.conn.ping(reconnect=False)
+            return True
+        except Exception:
+            with self._cond:
+                self._ping_failures += 1
+            return False
+
+    def _release(self, pooled, discard=False):
+        with self._cond:
+            if self._pid != os.getpid():
+                return
+            if discard:
+                self._total -= 1
+                self._discarded += 1
+                self._close_quietly(pooled.conn)
+            else:
+                pooled.last_used = time.monotonic()
+                self._idle.append(pooled)
+            self._cond.notify()
+
+    def checkout(self):
+        """Return a healthy pooled connection; pair with ``checkin``."""
+        while True:
+            pooled = self._acquire()
+            if self._healthy(pooled):
+                return pooled
+            self._release(pooled, discard=True)
+
+    def checkin(self, pooled, discard=False):
+        self._release(pooled, discard=discard)
+
+    @contextmanager
+    def connection(self):
+        """Check a connection out for the duration of the ``with`` block.
+
+        On error the connection is rolled back, or dropped from the pool when
+        it can no longer be used.
+        """
+        pooled = self.checkout()
+        try:
+            yield pooled.conn
+        except BaseException:
+            discard = False
+            try:
+                pooled.conn.rollback()
+            except Exception:
+                discard = True
+            self._release(pooled, discard=discard)
+            raise
+        else:
+            self._release(pooled)
+
+    def close(self):
+        with self._cond:
+            while self._idle:
+                pooled = self._idle.pop()
+                self._total -= 1
+                self._close_quietly(pooled.conn)
+            self._cond.notify_all()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "size": self.size,
+                "open": self._total,
+                "idle": len(self._idle),
+                "in_use": self._total - len(self._idle),
+                "checkouts": self._checkouts,
+                "waits": self._waits,
+                "wait_seconds": round(self._wait_seconds, 6),
+                "timeouts": self._timeouts,
+                "created": self._created,
+                "recycled": self._recycled,
+                "discarded": self._discarded,
+                "ping_failures": self._ping_failures,
+            }
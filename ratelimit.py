@@ -0,0 +1,179 @@
+import os
+import time
+import sqlite3
+import threading
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# "memory" keeps buckets per worker process; "sqlite" shares them between all
+# workers on the host through a small database file (ideally on tmpfs).
+RATE_LIMIT_BACKEND = os.environ.get("RATE_LIMIT_BACKEND", "memory").strip().lower()
+RATE_LIMIT_SQLITE_PATH = os.environ.get("RATE_LIMIT_SQLITE_PATH", "/dev/shm/xtream_ratelimit.sqlite3")
+# Upper bound on tracked (client, key) buckets; least recently used are dropped first.
+RATE_LIMIT_MAX_KEYS = int(os.environ.get("RATE_LIMIT_MAX_KEYS", "100000"))
+RATE_LIMIT_STRIPES = int(os.environ.get("RATE_LIMIT_STRIPES", "16"))
+
+
+def _refill(tokens, updated, now, capacity, rate):
+    """Token bucket refill: ``rate`` tokens per second, never above ``capacity``."""
+    return min(capacity, tokens + (now - updated) * rate)
+
+
+class MemoryBackend:
+    """Token buckets in process memory, split across lock-striped LRU maps."""
+
+    def __init__(self, max_keys=RATE_LIMIT_MAX_KEYS, stripes=RATE_LIMIT_STRIPES):
+        self.stripes = max(1, int(stripes))
+        self.max_keys_per_stripe = max(1, int(max_keys) // self.stripes)
+        self._locks = [threading.Lock() for _ in range(self.stripes)]
+        self._buckets = [OrderedDict() for _ in range(self.stripes)]
+        # Counted per stripe, under that stripe's lock.
+        self._evictions = [0] * self.stripes
+
+    @property
+    def evictions(self) -> int:
+        return sum(self._evictions)
+
+    def take(self, key: str, capacity: float, rate: float, now: float) -> bool:
+        index = hash(key) % self.stripes
+        buckets = self._buckets[index]
+        with self._locks[index]:
+            state = buckets.get(key)
+            if state is None:
+                tokens = capacity
+            else:
+                tokens = _refill(state[0], state[1], now, capacity, rate)
+                buckets.move_to_end(key)
+            allowed = tokens >= 1.0
+            if allowed:
+                tokens -= 1.0
+            buckets[key] = (tokens, now)
+            # A bucket that has refilled completely is indistinguishable from a new one.
+            idle_after = capacity / rate
+            while buckets:
+                _, oldest_updated = next(iter(buckets.values()))
+                if len(buckets) > self.max_keys_per_stripe:
+                    self._evictions[index] += 1
+                elif now - oldest_updated < idle_after:
+                    break
+                buckets.popitem(last=False)
+            return allowed
+
+    def size(self) -> int:
+        return sum(len(b) for b in self._buckets)
+
+
+class SqliteBackend:
+    """Token buckets in a SQLite file shared by every worker process on the host."""
+
+    PRUNE_EVERY = 1000
+
+    def __init__(self, path=RATE_LIMIT_SQLITE_PATH, max_keys=RATE_LIMIT_MAX_KEYS):
+        self.path = path
+        self.max_keys = int(max_keys)
+        self._local = threading.local()
+        self._calls = 0
+        self._calls_lock = threading.Lock()
+        self.evictions = 0
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets ("
+                " key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS buckets_updated ON buckets (updated)")
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=1.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def take(self, key: str, capacity: float, rate: float, now: float) -> bool:
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens = capacity if row is None else _refill(row[0], row[1], now, capacity, rate)
+            allowed = tokens >= 1.0
+            if allowed:
+                tokens -= 1.0
+            conn.execute(
+                "INSERT INTO buckets (key, tokens, updated) VALUES (?, ?, ?)"
+                " ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated",
+                (key, tokens, now),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        with self._calls_lock:
+            self._calls += 1
+            prune = self._calls % self.PRUNE_EVERY == 0
+        if prune:
+            self._prune(now, capacity / rate)
+        return allowed
+
+    def _prune(self, now, idle_after):
+        conn = self._connection()
+        deleted = conn.execute("DELETE FROM buckets WHERE updated < ?", (now - idle_after,)).rowcount
+        excess = conn.execute("SELECT COUNT(*) FROM buckets").fetchone()[0] - self.max_keys
+        if excess > 0:
+            deleted += conn.execute(
+                "DELETE FROM buckets WHERE key IN (SELECT key FROM buckets ORDER BY updated ASC LIMIT ?)",
+                (excess,),
+            ).rowcount
+        with self._calls_lock:
+            self.evictions += max(0, deleted)
+
+    def size(self) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM buckets").fetchone()[0]
+
+
+class RateLimiter:
+    """Token-bucket rate limiter: ``per_minute`` sustained rate with bursts up to ``per_minute``."""
+
+    def __init__(self, backend=None):
+        self.backend = backend if backend is not None else make_backend()
+        self._lock = threading.Lock()
+        self.allowed = {}
+        self.rejected = {}
+        self.errors = 0
+
+    def allow(self, key: str, client: str, per_minute: int) -> bool:
+        """Return True if allowed, False if rate-limited."""
+        if per_minute <= 0:
+            return True
+        try:
+            allowed = self.backend.take(f"{key}:{client}", float(per_minute), per_minute / 60.0, time.time())
+        except Exception:
+            # Fail open: a broken limiter must not take the API down with it.
+            logger.exception("Rate limiter backend failed")
+            with self._lock:
+                self.errors += 1
+            return True
+        counters = self.allowed if allowed else self.rejected
+        with self._lock:
+            counters[key] = counters.get(key, 0) + 1
+        return allowed
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "backend": type(self.backend).__name__,
+                "allowed": dict(self.allowed),
+                "rejected": dict(self.rejected),
+                "errors": self.errors,
+                "evictions": self.backend.evictions,
+            }
+
+
+def make_backend():
+    if RATE_LIMIT_BACKEND == "sqlite":
+        return SqliteBackend()
+    return MemoryBackend()
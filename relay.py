@@ -0,0 +1,459 @@
+"""Fan-out relay for live MPEG-TS streams: python relay.py
+
+The API authenticates the viewer and redirects ``/live/<user>/<pass>/<id>.ts``
+to a short-lived signed ``/relay/<id>.ts`` link on this process. The relay
+opens one upstream connection per channel, with its own panel line
+(RELAY_USERNAME / RELAY_PASSWORD), and hands every chunk it reads to all the
+viewers of that channel. Chunks are shared between viewers, never copied; each
+viewer has its own bounded queue and is disconnected when it falls more than
+RELAY_CLIENT_BUFFER bytes behind, so one slow client can't stall the rest. The
+upstream connection is kept for RELAY_IDLE_GRACE seconds after the last viewer
+leaves (channel zapping) and then closed.
+"""
+import os
+import re
+import ssl
+import hmac
+import json
+import time
+import signal
+import asyncio
+import hashlib
+import logging
+from collections import deque
+from urllib.parse import urlsplit, urljoin, urlencode, parse_qs, quote
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+
+def _env_bool(name: str, default: bool = False) -> bool:
+    raw = os.environ.get(name)
+    if raw is None:
+        return default
+    return str(raw).strip().lower() in {"1", "true", "t", "yes", "y", "on"}
+
+
+# API side: redirect live .ts requests to the relay instead of the panel.
+RELAY_ENABLED = _env_bool("RELAY_ENABLED", False)
+# Base URL viewers reach the relay at, e.g. http://tv.example.com:5080
+RELAY_PUBLIC_URL = (os.environ.get("RELAY_PUBLIC_URL") or "").rstrip("/")
+# Shared by the API and the relay to sign relay links.
+RELAY_SECRET = os.environ.get("RELAY_SECRET") or ""
+# Seconds a relay link can be used to start playback.
+RELAY_LINK_TTL = int(os.environ.get("RELAY_LINK_TTL", "30"))
+
+# Relay side.
+RELAY_BIND = os.environ.get("RELAY_BIND", "0.0.0.0:5080")
+# Panel line used for the shared upstream connections (defaults to the sync scripts' line).
+RELAY_USERNAME = os.environ.get("RELAY_USERNAME") or os.environ.get("USERNAME") or ""
+RELAY_PASSWORD = os.environ.get("RELAY_PASSWORD") or os.environ.get("PASSWORD") or ""
+# Bytes a viewer may fall behind before it is disconnected.
+RELAY_CLIENT_BUFFER = int(os.environ.get("RELAY_CLIENT_BUFFER", str(4 * 1024 * 1024)))
+# Seconds the upstream connection outlives its last viewer.
+RELAY_IDLE_GRACE = float(os.environ.get("RELAY_IDLE_GRACE", "15"))
+RELAY_CONNECT_TIMEOUT = float(os.environ.get("RELAY_CONNECT_TIMEOUT", "5"))
+# Seconds without upstream data before the connection is considered dead.
+RELAY_READ_TIMEOUT = float(os.environ.get("RELAY_READ_TIMEOUT", "15"))
+# Consecutive failed upstream (re)connections before a channel's viewers are disconnected.
+RELAY_UPSTREAM_RETRIES = int(os.environ.get("RELAY_UPSTREAM_RETRIES", "3"))
+# 0 means unlimited.
+RELAY_MAX_VIEWERS = int(os.environ.get("RELAY_MAX_VIEWERS", "0"))
+
+TS_PACKET_SIZE = 188
+# Upstream reads of whole TS packets (~64 KiB).
+_READ_SIZE = TS_PACKET_SIZE * 348
+# Socket send buffer in front of each viewer's queue; beyond it, data waits in the queue.
+_TRANSPORT_HIGH_WATER = 256 * 1024
+_REQUEST_TIMEOUT = 10
+_MAX_REDIRECTS = 3
+_RELAY_PATH = re.compile(r"^/relay/(\d+)\.ts$")
+
+
+class RelayError(Exception):
+    pass
+
+
+# --- signed links ---
+
+def _signature(stream_id, upstream, expires, secret):
+    message = "{}\n{}\n{}".format(stream_id, upstream, expires).encode("utf-8")
+    return hmac.new(secret.encode("utf-8"), message, hashlib.sha256).hexdigest()
+
+
+def relay_url(stream_id, upstream, now=None, public_url=RELAY_PUBLIC_URL, secret=RELAY_SECRET, ttl=RELAY_LINK_TTL):
+    """Relay link for ``stream_id`` whose upstream is the panel at ``upstream``."""
+    expires = int(now if now is not None else time.time()) + ttl
+    query = urlencode({"u": upstream, "e": expires, "s": _signature(stream_id, upstream, expires, secret)})
+    return "{}/relay/{}.ts?{}".format(public_url, stream_id, query)
+
+
+def verify_link(stream_id, upstream, expires, signature, now=None, secret=RELAY_SECRET) -> bool:
+    try:
+        expires = int(expires)
+    except (TypeError, ValueError):
+        return False
+    if expires < (now if now is not None else time.time()):
+        return False
+    return hmac.compare_digest(_signature(stream_id, upstream, expires, secret), signature or "")
+
+
+# --- upstream HTTP ---
+
+async def open_upstream(url, connect_timeout=RELAY_CONNECT_TIMEOUT):
+    """GET ``url`` following redirects; returns (reader, writer, chunked) positioned at the body."""
+    for _ in range(_MAX_REDIRECTS + 1):
+        parts = urlsplit(url)
+        secure = parts.scheme == "https"
+        port = parts.port or (443 if secure else 80)
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(parts.hostname, port, ssl=ssl.create_default_context() if secure else None),
+            connect_timeout)
+        try:
+            path = parts.path or "/"
+            if parts.query:
+                path += "?" + parts.query
+            writer.write("GET {} HTTP/1.1\r\nHost: {}\r\nUser-Agent: curl/7.88.1\r\nAccept: */*\r\n"
+                         "Connection: close\r\n\r\n".format(path, parts.netloc).encode("latin-1"))
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), connect_timeout)
+        except BaseException:
+            writer.close()
+            raise
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            status = int(lines[0].split(" ", 2)[1])
+        except (IndexError, ValueError):
+            writer.close()
+            raise RelayError("bad upstream status line {!r}".format(lines[0][:80]))
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        if status in (301, 302, 303, 307, 308) and headers.get("location"):
+            writer.close()
+            url = urljoin(url, headers["location"])
+            continue
+        if status != 200:
+            writer.close()
+            raise RelayError("upstream answered {}".format(status))
+        return reader, writer, "chunked" in headers.get("transfer-encoding", "").lower()
+    raise RelayError("too many upstream redirects")
+
+
+async def _body(reader, chunked, read_timeout=RELAY_READ_TIMEOUT):
+    if not chunked:
+        while True:
+            data = await asyncio.wait_for(reader.read(_READ_SIZE), read_timeout)
+            if not data:
+                return
+            yield data
+    while True:
+        line = await asyncio.wait_for(reader.readline(), read_timeout)
+        try:
+            size = int(line.split(b";", 1)[0].strip(), 16)
+        except ValueError:
+            raise RelayError("bad chunk size line")
+        if size == 0:
+            return
+        data = await asyncio.wait_for(reader.readexactly(size + 2), read_timeout)
+        yield memoryview(data)[:-2]
+
+
+# --- fan-out ---
+
+class Viewer:
+    """One client connection with its own queue of shared chunks."""
+
+    __slots__ = ("relay", "writer", "queue", "queued", "limit", "wakeup", "closed", "reason", "sent")
+
+    def __init__(self, relay, writer, limit=RELAY_CLIENT_BUFFER):
+        self.relay = relay
+        self.writer = writer
+        self.queue = deque()
+        self.queued = 0
+        self.limit = limit
+        self.wakeup = asyncio.Event()
+        self.closed = False
+        self.reason = None
+        self.sent = 0
+
+    def offer(self, chunk) -> bool:
+        """Queue ``chunk``; False (and the viewer is closed) if it is too far behind."""
+        if self.closed:
+            return False
+        size = len(chunk)
+        if self.queued + size > self.limit:
+            self.close("slow")
+            return False
+        self.queue.append(chunk)
+        self.queued += size
+        self.wakeup.set()
+        return True
+
+    def close(self, reason):
+        if not self.closed:
+            self.closed = True
+            self.reason = reason
+            if reason == "slow":
+                # The pump may be stuck in drain() on a stalled socket: abort it so
+                # the pump wakes up, and release the chunks it was holding.
+                self.queue.clear()
+                self.queued = 0
+                self.writer.transport.abort()
+            self.wakeup.set()
+
+    async def pump(self, header):
+        """Write queued chunks until closed; a slow viewer's backlog is discarded."""
+        writer = self.writer
+        while True:
+            if not self.queue:
+                if self.closed:
+                    return
+                await self.wakeup.wait()
+                self.wakeup.clear()
+                continue
+            if self.closed and self.reason == "slow":
+                return
+            chunk = self.queue.popleft()
+            self.queued -= len(chunk)
+            if not self.sent:
+                writer.write(header)
+            writer.write(chunk)
+            self.sent += len(chunk)
+            self.relay.counters["bytes_out"] += len(chunk)
+            await writer.drain()
+
+
+class Channel:
+    """The shared upstream connection of one stream and its viewers."""
+
+    def __init__(self, relay, stream_id, upstream):
+        self.relay = relay
+        self.stream_id = stream_id
+        self.upstream = upstream
+        self.viewers = set()
+        self.task = None
+        self.connected = False
+        self.bytes_in = 0
+        self._idle_handle = None
+        self._tail = b""
+
+    def add(self, viewer, upstream):
+        # Reconnections go to the panel the API picked most recently.
+        self.upstream = upstream
+        if self._idle_handle is not None:
+            self._idle_handle.cancel()
+            self._idle_handle = None
+        self.viewers.add(viewer)
+        if self.task is None:
+            self.task = asyncio.create_task(self._run(), name=f"relay-{self.stream_id}")
+
+    def remove(self, viewer):
+        self.viewers.discard(viewer)
+        if not self.viewers and self.task is not None and self._idle_handle is None:
+            self._idle_handle = asyncio.get_running_loop().call_later(self.relay.idle_grace, self._idle_expired)
+
+    def _idle_expired(self):
+        self._idle_handle = None
+        if not self.viewers:
+            logger.info("Channel %s idle, closing upstream", self.stream_id)
+            self.close()
+
+    def close(self):
+        if self.relay.channels.get(self.stream_id) is self:
+            del self.relay.channels[self.stream_id]
+        if self._idle_handle is not None:
+            self._idle_handle.cancel()
+            self._idle_handle = None
+        if self.task is not None and self.task is not asyncio.current_task():
+            self.task.cancel()
+        for viewer in self.viewers:
+            viewer.close("upstream")
+        self.viewers.clear()
+
+    def _broadcast(self, data):
+        # Forward whole TS packets only, so a viewer joining later starts on a packet boundary.
+        if self._tail:
+            data = self._tail + data
+        view = memoryview(data)
+        cut = len(view) - len(view) % TS_PACKET_SIZE
+        self._tail = bytes(view[cut:])
+        if not cut:
+            return
+        chunk = view[:cut] if cut != len(view) else view
+        dropped = [viewer for viewer in self.viewers if not viewer.offer(chunk)]
+        for viewer in dropped:
+            self.relay.counters["viewers_dropped"] += 1
+            logger.info("Dropped slow viewer of channel %s", self.stream_id)
+            self.remove(viewer)
+
+    async def _stream(self):
+        url = "{}/live/{}/{}/{}.ts".format(self.upstream, quote(self.relay.username, safe=""),
+                                           quote(self.relay.password, safe=""), self.stream_id)
+        reader, writer, chunked = await open_upstream(url, self.relay.connect_timeout)
+        self.relay.counters["upstream_connects"] += 1
+        self.connected = True
+        self._tail = b""
+        received = 0
+        try:
+            async for data in _body(reader, chunked, self.relay.read_timeout):
+                received += len(data)
+                self.bytes_in += len(data)
+                self.relay.counters["bytes_in"] += len(data)
+                self._broadcast(data)
+        finally:
+            self.connected = False
+            writer.close()
+        return received
+
+    async def _run(self):
+        failures = 0
+        try:
+            while self.viewers:
+                try:
+                    received = await self._stream()
+                    failures = 0 if received else failures + 1
+                    logger.info("Upstream of channel %s ended after %d bytes", self.stream_id, received)
+                except (OSError, EOFError, asyncio.TimeoutError, asyncio.IncompleteReadError, RelayError) as e:
+                    failures += 1
+                    self.relay.counters["upstream_errors"] += 1
+                    logger.warning("Upstream of channel %s failed (%d): %r", self.stream_id, failures, e)
+                if failures > self.relay.upstream_retries:
+                    break
+                await asyncio.sleep(min(failures, 4) * 0.5)
+        finally:
+            self.task = None
+            self.close()
+
+
+class Relay:
+    def __init__(self, username=RELAY_USERNAME, password=RELAY_PASSWORD, secret=RELAY_SECRET,
+                 client_buffer=RELAY_CLIENT_BUFFER, idle_grace=RELAY_IDLE_GRACE,
+                 connect_timeout=RELAY_CONNECT_TIMEOUT, read_timeout=RELAY_READ_TIMEOUT,
+                 upstream_retries=RELAY_UPSTREAM_RETRIES, max_viewers=RELAY_MAX_VIEWERS):
+        self.username = username
+        self.password = password
+        self.secret = secret
+        self.client_buffer = client_buffer
+        self.idle_grace = idle_grace
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.upstream_retries = upstream_retries
+        self.max_viewers = max_viewers
+        self.channels: dict[str, Channel] = {}
+        self.viewers = 0
+        self.counters = dict.fromkeys(("viewers_accepted", "viewers_dropped", "rejected", "upstream_connects",
+                                       "upstream_errors", "bytes_in", "bytes_out"), 0)
+
+    def stats(self) -> dict:
+        return {
+            "channels": len(self.channels),
+            "viewers": self.viewers,
+            "upstream_connected": sum(1 for c in self.channels.values() if c.connected),
+            **self.counters,
+        }
+
+    def metrics(self):
+        stats = self.stats()
+        yield "xtream_relay_channels", "gauge", "Channels with an upstream connection (or in their idle grace).", {}, stats["channels"]
+        yield "xtream_relay_viewers", "gauge", "Connected relay viewers.", {}, stats["viewers"]
+        yield "xtream_relay_viewers_total", "counter", "Relay viewers accepted.", {}, stats["viewers_accepted"]
+        yield "xtream_relay_viewers_dropped_total", "counter", "Viewers disconnected for falling behind.", {}, stats["viewers_dropped"]
+        yield "xtream_relay_rejected_total", "counter", "Relay requests refused (bad link, viewer limit).", {}, stats["rejected"]
+        yield "xtream_relay_upstream_connects_total", "counter", "Upstream connections opened by the relay.", {}, stats["upstream_connects"]
+        yield "xtream_relay_upstream_errors_total", "counter", "Failed upstream connections or reads.", {}, stats["upstream_errors"]
+        for direction in ("in", "out"):
+            yield "xtream_relay_bytes_total", "counter", "Stream bytes read from upstream / written to viewers.", {"direction": direction}, stats["bytes_" + direction]
+
+    async def _respond(self, writer, status, body, content_type="application/json"):
+        reasons = {200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found", 405: "Method Not Allowed",
+                   502: "Bad Gateway", 503: "Service Unavailable"}
+        writer.write("HTTP/1.1 {} {}\r\nContent-Type: {}\r\nContent-Length: {}\r\nConnection: close\r\n\r\n".format(
+            status, reasons.get(status, ""), content_type, len(body)).encode("latin-1") + body)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+    async def handle(self, reader, writer):
+        try:
+            try:
+                head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), _REQUEST_TIMEOUT)
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError):
+                return
+            parts = head.split(b"\r\n", 1)[0].decode("latin-1").split(" ")
+            if len(parts) != 3:
+                return await self._respond(writer, 400, b'{"error": "bad_request"}')
+            method, target = parts[0], urlsplit(parts[1])
+            if method != "GET":
+                return await self._respond(writer, 405, b'{"error": "method_not_allowed"}')
+            if target.path == "/healthz":
+                return await self._respond(writer, 200, json.dumps(self.stats()).encode("utf-8"))
+            match = _RELAY_PATH.match(target.path)
+            if not match:
+                return await self._respond(writer, 404, b'{"error": "not_found"}')
+            stream_id = match.group(1)
+            query = {k: v[0] for k, v in parse_qs(target.query).items()}
+            upstream = query.get("u", "")
+            if not upstream.startswith(("http://", "https://")) or not verify_link(
+                    stream_id, upstream, query.get("e"), query.get("s"), secret=self.secret):
+                self.counters["rejected"] += 1
+                return await self._respond(writer, 403, b'{"error": "invalid_link"}')
+            if self.max_viewers and self.viewers >= self.max_viewers:
+                self.counters["rejected"] += 1
+                return await self._respond(writer, 503, b'{"error": "relay_full"}')
+            await self._serve_viewer(writer, stream_id, upstream)
+        except Exception:
+            logger.exception("Relay request failed")
+        finally:
+            writer.close()
+
+    async def _serve_viewer(self, writer, stream_id, upstream):
+        writer.transport.set_write_buffer_limits(high=_TRANSPORT_HIGH_WATER)
+        viewer = Viewer(self, writer, self.client_buffer)
+        channel = self.channels.get(stream_id)
+        if channel is None:
+            channel = self.channels[stream_id] = Channel(self, stream_id, upstream)
+        channel.add(viewer, upstream)
+        self.viewers += 1
+        self.counters["viewers_accepted"] += 1
+        header = (b"HTTP/1.1 200 OK\r\nContent-Type: video/mp2t\r\nCache-Control: no-cache\r\n"
+                  b"Connection: close\r\n\r\n")
+        try:
+            await viewer.pump(header)
+            if not viewer.sent and viewer.reason == "upstream":
+                await self._respond(writer, 502, b'{"error": "upstream_unavailable"}')
+        except ConnectionError:
+            pass
+        finally:
+            self.viewers -= 1
+            viewer.close("gone")
+            channel.remove(viewer)
+
+    def close(self):
+        for channel in list(self.channels.values()):
+            channel.close()
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle, host, port, backlog=1024)
+        REGISTRY.register_callback(self.metrics)
+        REGISTRY.ensure_flusher()
+        logger.info("Relay listening on %s:%s", host, port)
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stop.set)
+        async with server:
+            await stop.wait()
+        self.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if not RELAY_SECRET:
+        raise SystemExit("RELAY_SECRET must be set (and shared with the API)")
+    if not RELAY_USERNAME or not RELAY_PASSWORD:
+        raise SystemExit("RELAY_USERNAME/RELAY_PASSWORD (or USERNAME/PASSWORD) must be set")
+    host, _, port = RELAY_BIND.rpartition(":")
+    asyncio.run(Relay().serve(host or "0.0.0.0", int(port)))
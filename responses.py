@@ -0,0 +1,110 @@
+import os
+import gzip
+import shutil
+import threading
+
+from flask import current_app, request, send_file
+
+# Bodies smaller than this are not worth compressing.
+GZIP_MIN_SIZE = int(os.environ.get("GZIP_MIN_SIZE", "1024"))
+GZIP_LEVEL = int(os.environ.get("GZIP_LEVEL", "6"))
+
+_gzip_file_lock = threading.Lock()
+
+
+def gzip_bytes(body: bytes) -> bytes:
+    # mtime=0 keeps the output (and therefore its ETag) stable across processes.
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def accepts_gzip() -> bool:
+    return request.accept_encodings["gzip"] > 0
+
+
+def _etag_matches(etags) -> bool:
+    if_none_match = request.if_none_match
+    if not if_none_match:
+        return False
+    if if_none_match.star_tag:
+        return True
+    return any(if_none_match.contains(tag) for tag in etags)
+
+
+def _not_modified_since(last_modified) -> bool:
+    since = request.if_modified_since
+    if since is None or last_modified is None:
+        return False
+    return int(last_modified) <= int(since.timestamp())
+
+
+def negotiated_response(response_class, body: bytes, etag: str, last_modified, mimetype: str, gzipped=None):
+    """Build a response for a cached body, honouring validators and Accept-Encoding.
+
+    ``etag`` is the unquoted strong validator of the identity body; the gzip
+    representation uses ``<etag>-gz``. ``gzipped`` is a callable returning the
+    pre-compressed body (or None when compression isn't worth it). ``body``
+    may also be a callable, for entries stored only compressed; it is only
+    called when the identity body is actually sent.
+    """
+    use_gzip = gzipped is not None and accepts_gzip()
+    gz_body = gzipped() if use_gzip else None
+    if gz_body is None:
+        use_gzip = False
+    if not use_gzip and callable(body):
+        body = body()
+    selected_etag = f"{etag}-gz" if use_gzip else etag
+
+    # If-None-Match takes precedence over If-Modified-Since (RFC 7232 section 6).
+    if request.if_none_match:
+        not_modified = _etag_matches((etag, f"{etag}-gz"))
+    else:
+        not_modified = _not_modified_since(last_modified)
+
+    if not_modified:
+        response = response_class(status=304)
+    else:
+        response = response_class(gz_body if use_gzip else body, mimetype=mimetype)
+        if use_gzip:
+            response.headers["Content-Encoding"] = "gzip"
+    response.set_etag(selected_etag)
+    if last_modified is not None:
+        response.last_modified = int(last_modified)
+    if gzipped is not None:
+        response.vary.add("Accept-Encoding")
+    response.cache_control.no_cache = True
+    return response
+
+
+def gzip_file(path: str) -> str:
+    """Return the path of a ``.gz`` sibling of ``path``, rebuilding it only when stale."""
+    gz_path = path + ".gz"
+    source_mtime = os.stat(path).st_mtime
+    try:
+        if os.stat(gz_path).st_mtime >= source_mtime:
+            return gz_path
+    except FileNotFoundError:
+        pass
+    with _gzip_file_lock:
+        try:
+            if os.stat(gz_path).st_mtime >= source_mtime:
+                return gz_path
+        except FileNotFoundError:
+            pass
+        tmp_path = f"{gz_path}.{os.getpid()}.tmp"
+        with open(path, "rb") as src, gzip.GzipFile(tmp_path, "wb", compresslevel=GZIP_LEVEL, mtime=0) as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        os.utime(tmp_path, (source_mtime, source_mtime))
+        os.replace(tmp_path, gz_path)
+    return gz_path
+
+
+def send_precompressed_file(path: str, mimetype: str):
+    """``send_file`` with a pre-compressed variant negotiated by Accept-Encoding."""
+    path = os.path.join(current_app.root_path, path)
+    if accepts_gzip() and os.path.getsize(path) >= GZIP_MIN_SIZE:
+        response = send_file(gzip_file(path), mimetype=mimetype, conditional=True, etag=True)
+        response.headers["Content-Encoding"] = "gzip"
+    else:
+        response = send_file(path, mimetype=mimetype, conditional=True, etag=True)
+    response.vary.add("Accept-Encoding")
+    return response
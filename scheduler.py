@@ -0,0 +1,242 @@
+import os
+import re
+import json
+import time
+import fcntl
+import random
+import logging
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def _env_bool(name: str, default: bool = False) -> bool:
+    raw = os.environ.get(name)
+    if raw is None:
+        return default
+    return str(raw).strip().lower() in {"1", "true", "t", "yes", "y", "on"}
+
+
+# Run the category and stream syncs inside the API workers instead of from host cron.
+SYNC_SCHEDULER_ENABLED = _env_bool("SYNC_SCHEDULER_ENABLED", False)
+# Seconds between runs (0 disables a job), plus up to SYNC_JITTER random seconds.
+SYNC_CATEGORIES_INTERVAL = float(os.environ.get("SYNC_CATEGORIES_INTERVAL", "604800"))
+SYNC_STREAMS_INTERVAL = float(os.environ.get("SYNC_STREAMS_INTERVAL", "86400"))
+SYNC_JITTER = float(os.environ.get("SYNC_JITTER", "300"))
+# Seconds before a failed run is retried.
+SYNC_RETRY_SECONDS = float(os.environ.get("SYNC_RETRY_SECONDS", "600"))
+# Shared by every worker and by the sync scripts run from cron, so runs never overlap.
+SYNC_LOCK_PATH = os.environ.get("SYNC_LOCK_PATH") or os.path.join(tempfile.gettempdir(), "xtream_sync.lock")
+SYNC_STATUS_PATH = os.environ.get("SYNC_STATUS_PATH") or os.path.join(tempfile.gettempdir(), "xtream_sync_status.json")
+# Panel line the syncs fetch with (same variables as the sync scripts).
+SYNC_USERNAME = os.environ.get("USERNAME") or ""
+SYNC_PASSWORD = os.environ.get("PASSWORD") or ""
+
+# Upstream URLs in error messages carry the panel line (username=...&password=...).
+_URL_IN_TEXT = re.compile(r"(?:[a-z][a-z0-9+.-]*://[^\s'\"]+|/[^\s'\"]*\?[^\s'\"]+)", re.IGNORECASE)
+
+
+class SyncLock:
+    """Exclusive, non-blocking ``flock`` on ``path``; the ``with`` value says whether it was acquired.
+
+    The kernel drops the lock when the holder exits, so a crashed run never
+    leaves it stuck. The holder writes its pid into the file, so
+    :func:`lock_holder` can tell a run is in progress without taking the lock.
+    """
+
+    def __init__(self, path=SYNC_LOCK_PATH):
+        self.path = path
+        self._file = None
+
+    def __enter__(self) -> bool:
+        self._file = open(self.path, "a+")
+        try:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._file.close()
+            self._file = None
+            return False
+        self._file.truncate(0)
+        self._file.write(str(os.getpid()))
+        self._file.flush()
+        return True
+
+    def __exit__(self, *exc):
+        if self._file is not None:
+            self._file.truncate(0)
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+        return False
+
+
+def _pid_alive(pid) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def lock_holder(path=SYNC_LOCK_PATH):
+    """Pid of the process running a sync, or None; reads the lock file without locking it."""
+    try:
+        with open(path) as f:
+            pid = int(f.read().strip() or 0)
+    except (OSError, ValueError):
+        return None
+    return pid if pid > 0 and _pid_alive(pid) else None
+
+
+def _error_text(error) -> str:
+    """Exception class and message for the status file, with any URL replaced by ``<url>``."""
+    return "{}: {}".format(type(error).__name__, _URL_IN_TEXT.sub("<url>", str(error)))
+
+
+def read_status(path=SYNC_STATUS_PATH) -> dict:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_status(path, status):
+    tmp = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp, "w") as f:
+        json.dump(status, f, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+
+
+class SyncJob:
+    __slots__ = ("name", "interval", "run")
+
+    def __init__(self, name, interval, run):
+        self.name = name
+        self.interval = interval
+        # run(connection) -> dict of counts
+        self.run = run
+
+
+def default_jobs():
+    """The category and stream syncs from ``sync/``, fetching with ``USERNAME``/``PASSWORD``."""
+    from sync import sync_data_live_categories, sync_data_live_streams
+
+    return [
+        SyncJob("live_categories", SYNC_CATEGORIES_INTERVAL,
+                lambda connection: sync_data_live_categories.run(connection, SYNC_USERNAME, SYNC_PASSWORD)),
+        SyncJob("live_streams", SYNC_STREAMS_INTERVAL,
+                lambda connection: sync_data_live_streams.run(connection, SYNC_USERNAME, SYNC_PASSWORD)),
+    ]
+
+
+class SyncScheduler:
+    """Runs sync jobs on a background thread of each worker.
+
+    Every worker runs the loop, but a job only runs while holding the
+    cross-process :class:`SyncLock`, and is skipped when the status file shows
+    another process finished it less than ``interval`` seconds ago, so each job
+    runs once per interval per host. ``connection()`` is the app's pool context
+    manager; the jobs fetch with the process-wide HTTP client.
+    """
+
+    def __init__(self, connection, jobs=default_jobs, lock_path=SYNC_LOCK_PATH, status_path=SYNC_STATUS_PATH,
+                 jitter=SYNC_JITTER, retry_seconds=SYNC_RETRY_SECONDS, enabled=SYNC_SCHEDULER_ENABLED):
+        self.connection = connection
+        self.jobs = jobs
+        self.lock_path = lock_path
+        self.status_path = status_path
+        self.jitter = jitter
+        self.retry_seconds = retry_seconds
+        self.enabled = enabled
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        # Threads don't survive fork, so each worker starts its own loop.
+        if not self.enabled or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._loop, name="sync-scheduler", daemon=True).start()
+
+    def _earliest(self, job, entry):
+        # Wall-clock time the job is due again according to the status file (None: never ran).
+        finished = entry.get("finished_at")
+        if finished is None:
+            return None
+        return finished + (self.retry_seconds if entry.get("outcome") == "error" else job.interval)
+
+    def _next_run(self, job, entry, now):
+        earliest = self._earliest(job, entry)
+        return max(now, earliest or now) + random.uniform(0, self.jitter)
+
+    def _loop(self):
+        try:
+            jobs = [job for job in self.jobs() if job.interval > 0]
+        except Exception:
+            logger.exception("Sync scheduler could not load its jobs; not starting")
+            return
+        if not jobs:
+            return
+        status = read_status(self.status_path)
+        now = time.time()
+        due = {job.name: self._next_run(job, status.get(job.name, {}), now) for job in jobs}
+        while True:
+            time.sleep(max(1.0, min(due.values()) - time.time()))
+            for job in jobs:
+                if due[job.name] <= time.time():
+                    try:
+                        due[job.name] = self._run_due(job)
+                    except Exception:
+                        # e.g. the status file can't be written; keep the thread alive and retry later.
+                        logger.exception("Sync scheduler could not run %s", job.name)
+                        due[job.name] = time.time() + self.retry_seconds
+
+    def _run_due(self, job):
+        """Run ``job`` unless another process holds the lock or just ran it; return its next due time."""
+        with SyncLock(self.lock_path) as acquired:
+            if not acquired:
+                return time.time() + min(60.0, self.retry_seconds)
+            status = read_status(self.status_path)
+            entry = status.get(job.name, {})
+            now = time.time()
+            earliest = self._earliest(job, entry)
+            if earliest is not None and earliest > now:
+                # Another process already ran it.
+                return self._next_run(job, entry, now)
+            return self.run_now(job, status)
+
+    def run_now(self, job, status=None):
+        """Run ``job`` (the caller holds the lock) and record its outcome."""
+        status = status if status is not None else read_status(self.status_path)
+        entry = status.get(job.name, {})
+        started = time.time()
+        entry.update({"state": "running", "started_at": started, "pid": os.getpid(), "interval": job.interval})
+        status[job.name] = entry
+        _write_status(self.status_path, status)
+        logger.info("Sync %s started", job.name)
+        try:
+            with self.connection() as connection:
+                result = job.run(connection)
+            entry.update({"outcome": "ok", "error": None, "result": result})
+        except Exception as e:
+            logger.exception("Sync %s failed", job.name)
+            entry.update({"outcome": "error", "error": _error_text(e), "result": None})
+        finished = time.time()
+        entry.update({"state": "idle", "finished_at": finished, "duration_seconds": round(finished - started, 3)})
+        if entry["outcome"] == "ok":
+            entry["last_success_at"] = finished
+        _write_status(self.status_path, status)
+        logger.info("Sync %s finished: %s in %.1fs", job.name, entry["outcome"], finished - started)
+        return self._next_run(job, entry, finished)
+
+    def status(self) -> dict:
+        # Never takes the lock: a poll must not make a cron run think a sync is in progress.
+        running = lock_holder(self.lock_path) is not None
+        return {"enabled": self.enabled, "running": running, "jobs": read_status(self.status_path)}
@@ -1,5 +1,10 @@
+import os
+import sys
 import json
-import re
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sync.normalize import CategoryIndex, normalize_name
 
 # Nombre del archivo JSON
 json_file = "data.json"
@@ -10,31 +15,12 @@ categories_json_file = "categories.json"
 # Nombre del archivo SQL de salida
 sql_file = "output.sql"
 
-# Expresiones regulares para eliminar las palabras específicas
-patterns_to_remove = [
-    r'OL\| US LATIN ',
-    r'LA: ',
-    r'MX\| ',
-    r'MXC: ',
-    r'LATINO \| ',
-    r'US\| \(LATIN\) ',
-    r'LATIN ',
-    r'LATIN  ',
-    r'CLARO\| ',
-    r'ARG\| ',
-    r'PE\| ',
-    r'US\| ',
-    r'UY\| ',
-    r'\| '
-]
-
 # Comenzar el archivo SQL con la declaración INSERT INTO
 with open(sql_file, 'w') as f:
     f.write("INSERT INTO tabla (num, name, stream_type, stream_id, stream_icon, epg_channel_id, added, is_adult, category_id, custom_sid, tv_archive, direct_source, tv_archive_duration) VALUES\n")
 
-# Leer el archivo JSON de categorías
-with open(categories_json_file, 'r') as cat_file:
-    categories_data = json.load(cat_file)
+# Leer el archivo JSON de categorías y construir el índice nombre -> categoría
+categories_index = CategoryIndex.from_file(categories_json_file)
 
 # Leer el archivo JSON y escribir en el archivo SQL
 with open(json_file, 'r') as f:
@@ -42,17 +28,10 @@ with open(json_file, 'r') as f:
     with open(sql_file, 'a') as f_sql:
         for entry in data:
             # Remover palabras específicas y espacios en blanco al principio y final
-            name = entry["name"]
-            for pattern in patterns_to_remove:
-                name = re.sub(pattern, '', name)
-            name = name.strip()
+            name = normalize_name(entry["name"])
 
             # Buscar el nombre en las categorías y obtener el ID correspondiente
-            category_id = None
-            for key, category_list in categories_data.items():
-                if name in category_list:
-                    category_id = int(key)
-                    break
+            category_id = categories_index.lookup(name)
 
             num = entry["num"]
             stream_type = entry["stream_type"]
@@ -0,0 +1,61 @@
+import re
+import json
+from functools import lru_cache
+
+# Text patterns to remove from channel names, in the order they used to be applied
+PATTERNS_TO_REMOVE = [
+    r'OL\| US LATIN ',
+    r'LA: ',
+    r'MX\| ',
+    r'MXC: ',
+    r'LATINO \| ',
+    r'US\| \(LATIN\) ',
+    r'LATIN ',
+    r'LATIN  ',
+    r'CLARO\| ',
+    r'ARG\| ',
+    r'PE\| ',
+    r'US\| ',
+    r'UY\| ',
+    r'\| '
+]
+
+# Applied one after another, as before: removing one pattern can join text into a
+# match for a later one, which a single alternation pass would miss.
+_REMOVE_RES = tuple(re.compile(pattern) for pattern in PATTERNS_TO_REMOVE)
+
+NORMALIZE_CACHE_SIZE = 65536
+
+
+@lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def normalize_name(name):
+    """Strip panel prefixes (``LA: ``, ``MX| ``...) and surrounding whitespace."""
+    for pattern in _REMOVE_RES:
+        name = pattern.sub('', name)
+    return name.strip()
+
+
+class CategoryIndex:
+    """Inverted ``channel name -> category id`` index over ``categories.json``.
+
+    When a name is listed under several categories the first one in file order
+    wins, as with the original linear scan.
+    """
+
+    def __init__(self, categories):
+        self._index = {}
+        for key, names in categories.items():
+            category_id = int(key)
+            for name in names:
+                self._index.setdefault(name, category_id)
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path, 'r') as f:
+            return cls(json.load(f))
+
+    def lookup(self, name):
+        return self._index.get(name)
+
+    def __len__(self):
+        return len(self._index)
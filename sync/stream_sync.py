@@ -0,0 +1,242 @@
+import time
+import hashlib
+import resource
+import logging
+
+import pymysql
+
+logger = logging.getLogger(__name__)
+
+# Category assigned to streams whose upstream category doesn't exist locally.
+FALLBACK_CATEGORY_ID = 1153
+# Rows per multi-row statement, and per transaction.
+DEFAULT_BATCH_SIZE = 1000
+
+# Columns written by the sync, in statement order.
+STREAM_COLUMNS = (
+    "name", "added", "category_id", "custom_sid", "direct_source", "epg_channel_id", "is_adult",
+    "num", "stream_icon", "stream_id", "stream_type", "tv_archive", "tv_archive_duration",
+)
+
+_STREAM_ID = STREAM_COLUMNS.index("stream_id")
+_CATEGORY_ID = STREAM_COLUMNS.index("category_id")
+
+_INSERT_SQL = "INSERT INTO streams ({}) VALUES ({})".format(
+    ", ".join(STREAM_COLUMNS), ", ".join(["%s"] * len(STREAM_COLUMNS)))
+
+# Updates are upserts on the primary key of rows that are known to exist, so
+# they batch like inserts without needing a unique key on stream_id.
+_UPDATE_SQL = "INSERT INTO streams (id, {}) VALUES (%s, {}) ON DUPLICATE KEY UPDATE {}".format(
+    ", ".join(STREAM_COLUMNS), ", ".join(["%s"] * len(STREAM_COLUMNS)),
+    ", ".join("{0} = VALUES({0})".format(c) for c in STREAM_COLUMNS if c != "stream_id"))
+
+
+def record_hash(values) -> bytes:
+    """Compact hash of a row's normalized column values.
+
+    MySQL hands back ints and strings where the panel may send either, so
+    every value is compared as text; NULL is kept distinct from "".
+    """
+    text = "\x1f".join("\x00" if v is None else str(v) for v in values)
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest()
+
+
+class SyncStats:
+    """Row counts, per-phase wall time and peak RSS of one sync run.
+
+    ``peak_rss_kb`` is the process' high-water mark when each phase ended, so
+    the first phase whose value jumps is the one that allocated the memory.
+    """
+
+    def __init__(self):
+        self.counts = {
+            "fetched": 0,
+            "inserted": 0,
+            "changed": 0,
+            "unchanged": 0,
+            "protected": 0,
+            "missing_upstream": 0,
+            "fallback_category": 0,
+        }
+        self.timings = {}
+        self.peak_rss_kb = {}
+
+    def phase(self, name):
+        return _Phase(self, name)
+
+    def summary(self) -> str:
+        counts = ", ".join(f"{k}={v}" for k, v in self.counts.items())
+        timings = ", ".join(f"{k}={v:.3f}s" for k, v in self.timings.items())
+        return f"{counts} | {timings}"
+
+
+class _Phase:
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        self.stats.timings[self.name] = self.stats.timings.get(self.name, 0.0) + elapsed
+        self.stats.peak_rss_kb[self.name] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return False
+
+
+class StreamSyncEngine:
+    """Set-based sync of the upstream live stream list into ``streams``.
+
+    Existing streams and categories are loaded once into memory, the upstream
+    list is diffed against them in Python, and the resulting inserts and
+    updates are written with multi-row statements committed in batches.
+
+    Semantics match the original row-by-row sync:
+
+    * a stream whose upstream category doesn't exist locally goes to
+      ``fallback_category_id``;
+    * new streams are inserted with their normalized name;
+    * existing streams are only rewritten (with the upstream name) when their
+      current category is not one of ``allowed_category_ids``, i.e. streams
+      curated into our own categories are left alone.
+    """
+
+    def __init__(self, connection, allowed_category_ids, normalize_name,
+                 batch_size=DEFAULT_BATCH_SIZE, fallback_category_id=FALLBACK_CATEGORY_ID):
+        self.connection = connection
+        self.allowed_category_ids = set(allowed_category_ids)
+        self.normalize_name = normalize_name
+        self.batch_size = max(1, int(batch_size))
+        self.fallback_category_id = fallback_category_id
+        self.stats = SyncStats()
+        # stream_id -> (row ids, record_hash of the first row, category_id)
+        self.existing = {}
+        self.category_ids = set()
+        # stream_ids present in the upstream payload(s) seen so far
+        self.seen = set()
+
+    def load(self):
+        with self.stats.phase("load"):
+            with self.connection.cursor(pymysql.cursors.Cursor) as cursor:
+                cursor.execute("SELECT id FROM stream_categories")
+                self.category_ids = {row[0] for row in cursor.fetchall()}
+                cursor.execute("SELECT id, {} FROM streams ORDER BY id ASC".format(", ".join(STREAM_COLUMNS)))
+                existing = {}
+                for row in cursor.fetchall():
+                    values = row[1:]
+                    current = existing.get(values[_STREAM_ID])
+                    if current is None:
+                        existing[values[_STREAM_ID]] = ([row[0]], record_hash(values), values[_CATEGORY_ID])
+                    else:
+                        current[0].append(row[0])
+                self.existing = existing
+
+    def _category_for(self, item):
+        try:
+            category_id = int(item["category_id"])
+        except (TypeError, ValueError):
+            category_id = None
+        if category_id in self.category_ids:
+            return category_id
+        self.stats.counts["fallback_category"] += 1
+        return self.fallback_category_id
+
+    @staticmethod
+    def _values(item, name, category_id):
+        return (
+            name, item["added"], category_id, item["custom_sid"], item["direct_source"], item["epg_channel_id"],
+            item["is_adult"], item["num"], item["stream_icon"], item["stream_id"], item["stream_type"],
+            item["tv_archive"], item["tv_archive_duration"],
+        )
+
+    def diff(self, items):
+        """Return ``(inserts, updates)``; updates are ``(id, *values)`` tuples."""
+        counts = self.stats.counts
+        inserts = {}
+        updates = []
+        with self.stats.phase("diff"):
+            for item in items:
+                counts["fetched"] += 1
+                stream_id = int(item["stream_id"])
+                self.seen.add(stream_id)
+                category_id = self._category_for(item)
+                existing = self.existing.get(stream_id)
+                if existing is None:
+                    pending = inserts.get(stream_id)
+                    if pending is None:
+                        inserts[stream_id] = self._values(item, self.normalize_name(item["name"]), category_id)
+                    elif pending[_CATEGORY_ID] not in self.allowed_category_ids:
+                        # Repeated in the same payload: the later entry overwrites
+                        # the row as an update would.
+                        inserts[stream_id] = self._values(item, item["name"], category_id)
+                    continue
+                row_ids, current, current_category = existing
+                if current_category in self.allowed_category_ids:
+                    counts["protected"] += 1
+                    continue
+                values = self._values(item, item["name"], category_id)
+                if record_hash(values) == current:
+                    counts["unchanged"] += 1
+                    continue
+                for row_id in row_ids:
+                    updates.append((row_id,) + values)
+        return list(inserts.values()), updates
+
+    def _write(self, sql, rows, phase):
+        with self.stats.phase(phase):
+            with self.connection.cursor() as cursor:
+                for start in range(0, len(rows), self.batch_size):
+                    cursor.executemany(sql, rows[start:start + self.batch_size])
+                    self.connection.commit()
+
+    def _inserted_ids(self, inserts):
+        # stream_id -> row ids of the rows just inserted, so a later batch can update them.
+        stream_ids = [values[_STREAM_ID] for values in inserts]
+        row_ids = {}
+        with self.stats.phase("insert"):
+            with self.connection.cursor(pymysql.cursors.Cursor) as cursor:
+                for start in range(0, len(stream_ids), self.batch_size):
+                    chunk = stream_ids[start:start + self.batch_size]
+                    cursor.execute("SELECT id, stream_id FROM streams WHERE stream_id IN ({}) ORDER BY id ASC".format(
+                        ", ".join(["%s"] * len(chunk))), chunk)
+                    for row_id, stream_id in cursor.fetchall():
+                        row_ids.setdefault(int(stream_id), []).append(row_id)
+        return row_ids
+
+    def apply(self, inserts, updates):
+        self._write(_INSERT_SQL, inserts, "insert")
+        self._write(_UPDATE_SQL, updates, "update")
+        self.stats.counts["inserted"] += len(inserts)
+        self.stats.counts["changed"] += len(updates)
+        # Later batches in the same run must see what was just written.
+        inserted_ids = self._inserted_ids(inserts) if inserts else {}
+        for values in inserts:
+            self._remember(values, inserted_ids.get(int(values[_STREAM_ID]), []))
+        for row in updates:
+            self._remember(row[1:])
+
+    def _remember(self, values, row_ids=None):
+        stream_id = int(values[_STREAM_ID])
+        if row_ids is None:
+            row_ids = self.existing[stream_id][0] if stream_id in self.existing else []
+        self.existing[stream_id] = (row_ids, record_hash(values), values[_CATEGORY_ID])
+
+    def finish(self):
+        """Count synced streams that disappeared upstream (they are kept locally)."""
+        self.stats.counts["missing_upstream"] = sum(
+            1 for stream_id, (_, _, category_id) in self.existing.items()
+            if stream_id not in self.seen and category_id not in self.allowed_category_ids)
+        logger.info("Stream sync: %s", self.stats.summary())
+        return self.stats
+
+    def run(self, items) -> SyncStats:
+        self.load()
+        inserts, updates = self.diff(items)
+        self.apply(inserts, updates)
+        return self.finish()
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.stats.counts["inserted"] or self.stats.counts["changed"])
@@ -1,73 +1,147 @@
 import os
+import sys
 import pymysql
-import requests
 import logging
 import time
-from tools import Tools
 
-tool = Tools()
-
-# Configure logging to write to both file and stdout
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-
-# Create a file handler to write logs to a file
-file_handler = logging.FileHandler('app.log')
-file_handler.setLevel(logging.INFO)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-# Create a stream handler to write logs to stdout
-stream_handler = logging.StreamHandler()
-stream_handler.setLevel(logging.INFO)
+from http_client import HTTP_CONNECT_TIMEOUT, get_client
+from sync.tools import ALLOWED_CATEGORY_IDS, Tools
+from scheduler import SyncLock
 
-# Create a formatter for both handlers
-formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-file_handler.setFormatter(formatter)
-stream_handler.setFormatter(formatter)
+tool = Tools()
 
-# Add the handlers to the root logger
-logging.getLogger().addHandler(file_handler)
-logging.getLogger().addHandler(stream_handler)
+# Allow slow reads from the panel
+SYNC_TIMEOUT = (HTTP_CONNECT_TIMEOUT, float(os.getenv("SYNC_READ_TIMEOUT", "60")))
+
+def configure_logging():
+    # Configure logging to write to both file and stdout
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    # Create a file handler to write logs to a file
+    file_handler = logging.FileHandler('app.log')
+    file_handler.setLevel(logging.INFO)
+
+    # Create a stream handler to write logs to stdout
+    stream_handler = logging.StreamHandler()
+    stream_handler.setLevel(logging.INFO)
+
+    # Create a formatter for both handlers
+    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+    file_handler.setFormatter(formatter)
+    stream_handler.setFormatter(formatter)
+
+    # Add the handlers to the root logger
+    logging.getLogger().addHandler(file_handler)
+    logging.getLogger().addHandler(stream_handler)
+
+# Panel the categories are pulled from
+SYNC_PANEL_URL = os.getenv("SYNC_PANEL_URL", "http://iptvsub1-elite.com").rstrip("/")
+
+SYNC_NAME = "live_categories"
+# Re-apply the payload even when its fingerprint matches the last run
+SYNC_FORCE = os.getenv("SYNC_FORCE", "false").strip().lower() in {"1", "true", "t", "yes", "y", "on"}
+
+# Ids of the upstream categories that remove_categories_by_name left out on purpose
+def filtered_category_ids(data, cleaned):
+    kept = {int(category['category_id']) for category in cleaned}
+    return {int(category['category_id']) for category in data} - kept
+
+# Apply a fetched category list on an open connection; returns the counts.
+# filtered_ids are upstream categories left out on purpose: they are not "missing upstream".
+def sync_categories(connection, data, filtered_ids=()):
+    counts = {"skipped": 0, "inserted": 0, "changed": 0, "unchanged": 0, "missing_upstream": 0}
+
+    # Skip the whole run when the upstream payload is identical to the last one applied
+    fingerprint = tool.payload_fingerprint(data)
+    if not SYNC_FORCE and tool.get_sync_fingerprint(connection, SYNC_NAME) == fingerprint:
+        counts["skipped"] = 1
+        return counts
+
+    with connection.cursor(pymysql.cursors.DictCursor) as cursor:
+        # Get the current max cat_order to increment from there
+        cursor.execute("SELECT MAX(cat_order) as max_order FROM stream_categories")
+        result = cursor.fetchone()
+        cont = result['max_order'] if result and result['max_order'] is not None else 0
+
+        # Load every existing category once instead of one SELECT per category
+        cursor.execute("SELECT id, category_name FROM stream_categories")
+        existing = {row['id']: row['category_name'] for row in cursor.fetchall()}
+        upstream_ids = set(filtered_ids)
+
+        for category in data:
+            category_id = int(category['category_id'])
+            category_name = category['category_name']
+            parent_id = category['parent_id']
+            upstream_ids.add(category_id)
+
+            if category_id in existing:
+                # Update if name is different
+                if existing[category_id] != category_name:
+                    cursor.execute("UPDATE stream_categories SET category_name = %s WHERE id = %s", (category_name, category_id))
+                    existing[category_id] = category_name
+                    counts["changed"] += 1
+                    logging.info(f"Category updated: {category_name}, Category ID: {category_id}")
+                else:
+                    counts["unchanged"] += 1
+            else:
+                # Insert new category
+                cont += 1
+                cursor.execute("INSERT INTO stream_categories (id, category_name, parent_id, cat_order) VALUES (%s, %s, %s, %s)", (category_id, category_name, parent_id, cont))
+                existing[category_id] = category_name
+                counts["inserted"] += 1
+                logging.info(f"Category saved: {category_name}, Category ID: {category_id}")
+
+        # Synced categories that disappeared upstream (kept locally; curated ones don't count)
+        counts["missing_upstream"] = sum(1 for category_id in existing
+                                if category_id not in upstream_ids and category_id not in ALLOWED_CATEGORY_IDS)
+        connection.commit()
+    if counts["inserted"] or counts["changed"]:
+        tool.bump_catalog_version(connection)
+    tool.save_sync_fingerprint(connection, SYNC_NAME, fingerprint, len(data))
+    return counts
 
 # Function to save data to the stream_categories table
-def save_to_database(data, db_host, db_user, db_password, db_name):
+def save_to_database(data, db_host, db_user, db_password, db_name, filtered_ids=()):
+    connection = None
     try:
         connection = pymysql.connect(host=db_host,
                                      user=db_user,
                                      password=db_password,
                                      database=db_name,
                                      cursorclass=pymysql.cursors.DictCursor)
- 
-        with connection.cursor() as cursor:
-            # Get the current max cat_order to increment from there
-            cursor.execute("SELECT MAX(cat_order) as max_order FROM stream_categories")
-            result = cursor.fetchone()
-            cont = result['max_order'] if result and result['max_order'] is not None else 0
- 
-            for category in data:
-                category_id = int(category['category_id'])
-                category_name = category['category_name']
-                parent_id = category['parent_id']
- 
-                cursor.execute("SELECT id, category_name FROM stream_categories WHERE id = %s", (category_id,))
-                existing_category = cursor.fetchone()
- 
-                if existing_category:
-                    # Update if name is different
-                    if existing_category['category_name'] != category_name:
-                        cursor.execute("UPDATE stream_categories SET category_name = %s WHERE id = %s", (category_name, category_id))
-                        logging.info(f"Category updated: {category_name}, Category ID: {category_id}")
-                else:
-                    # Insert new category
-                    cont += 1
-                    cursor.execute("INSERT INTO stream_categories (id, category_name, parent_id, cat_order) VALUES (%s, %s, %s, %s)", (category_id, category_name, parent_id, cont))
-                    logging.info(f"Category saved: {category_name}, Category ID: {category_id}")
-            connection.commit()
+        return sync_categories(connection, data, filtered_ids)
     except pymysql.Error as e:
         logging.error("Error with database operation: %s", e)
+        return None
     finally:
         if connection:
             connection.close()
 
+# Fetch the category list from the panel; None on HTTP errors
+def fetch_categories(username, password):
+    url = '{}/player_api.php?username={}&password={}&action=get_live_categories'.format(SYNC_PANEL_URL, username, password)
+    headers = {
+        'User-Agent': 'curl/7.88.1'
+    }
+    response = get_client().get(url, headers=headers, timeout=SYNC_TIMEOUT)
+    if response.status_code != 200:
+        logging.error("Failed to fetch JSON data. Status code: %s", response.status_code)
+        return None
+    return response.json()
+
+# Entry point of the in-process scheduler (scheduler.py): fetch and apply on the given connection.
+def run(connection, username, password):
+    data = fetch_categories(username, password)
+    if data is None:
+        raise RuntimeError("get_live_categories could not be fetched")
+    cleaned = tool.remove_categories_by_name(data)
+    return sync_categories(connection, cleaned, filtered_category_ids(data, cleaned))
+
 if __name__ == '__main__':
+    configure_logging()
+
     # Get MySQL database connection details from environment variables
     DB_HOST = os.getenv("MYSQL_HOST")
     DB_USER = os.getenv("MYSQL_USER")
@@ -81,25 +155,25 @@ if __name__ == '__main__':
 
     start_time = time.time()
 
-    # Fetch JSON data from the provided URL
-    url = f'http://iptvsub1-elite.com/player_api.php?username={USER_NAME}&password={PASSWORD}&action=get_live_categories'
-    headers = {
-        'User-Agent': 'curl/7.88.1'
-    }
-    response = requests.get(url, headers=headers)
+    # Never overlap with another run (cron or the API's scheduler)
+    with SyncLock() as acquired:
+        if not acquired:
+            logging.info("Another sync is running; skipping this run.")
+            sys.exit(0)
 
-    if response.status_code == 200:
-        json_data = response.json()
+        json_data = fetch_categories(USER_NAME, PASSWORD)
 
-        # Remove categories with specified name
-        cleaned_data = tool.remove_categories_by_name(json_data)
+        if json_data is not None:
+            # Remove categories with specified name
+            cleaned_data = tool.remove_categories_by_name(json_data)
 
-        # Save cleaned data to database
-        save_to_database(cleaned_data, DB_HOST, DB_USER, DB_PASSWORD, DB_NAME)
+            # Save cleaned data to database
+            counts = save_to_database(cleaned_data, DB_HOST, DB_USER, DB_PASSWORD, DB_NAME,
+                                      filtered_category_ids(json_data, cleaned_data))
 
-        logging.info("Data processed and saved successfully.")
-    else:
-        logging.error("Failed to fetch JSON data. Status code: %s", response.status_code)
+            if counts is not None:
+                logging.info("Sync stats: %s", ", ".join(f"{k}={v}" for k, v in counts.items()))
+                logging.info("Data processed and saved successfully.")
 
     end_time = time.time()
     execution_time = end_time - start_time
@@ -1,85 +1,92 @@
-import re
 import pymysql
 import requests
 import os
+import sys
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from http_client import HTTP_CONNECT_TIMEOUT, get_client
+from sync.tools import ALLOWED_CATEGORY_IDS, Tools
+from sync.stream_sync import FALLBACK_CATEGORY_ID, StreamSyncEngine
+from sync.normalize import normalize_name
+from scheduler import SyncLock
+
+tool = Tools()
+
+# Apply a fetched stream list on an open connection; returns the SyncStats (None if the payload is unchanged)
+def sync_streams(connection, data, allowed_category_ids=ALLOWED_CATEGORY_IDS):
+    # Si el payload es idéntico al último aplicado no hay nada que hacer. Streams of
+    # categories that don't exist yet go to the fallback category, so the local
+    # categories and the curated ones are part of the fingerprint too.
+    context = {
+        "category_ids": tool.local_category_ids(connection),
+        "allowed_category_ids": sorted(allowed_category_ids),
+        "fallback_category_id": FALLBACK_CATEGORY_ID,
+    }
+    fingerprint = tool.payload_fingerprint(data, context)
+    if not SYNC_FORCE and tool.get_sync_fingerprint(connection, SYNC_NAME) == fingerprint:
+        print("Sync stats ==> skipped=1 (upstream payload unchanged, {} streams)".format(len(data)))
+        return None
+
+    # Carga el estado actual una sola vez, calcula el diff y escribe por lotes
+    engine = StreamSyncEngine(connection, allowed_category_ids, normalize_name, batch_size=SYNC_BATCH_SIZE)
+    stats = engine.run(data)
+    print("Sync stats ==> skipped=0, {}".format(stats.summary()))
+    if engine.changed:
+        tool.bump_catalog_version(connection)
+    tool.save_sync_fingerprint(connection, SYNC_NAME, fingerprint, len(data))
+    return stats
 
-# Text patterns to remove from name
-patterns_to_remove = [
-    r'OL\| US LATIN ',
-    r'LA: ',
-    r'MX\| ',
-    r'MXC: ',
-    r'LATINO \| ',
-    r'US\| \(LATIN\) ',
-    r'LATIN ',
-    r'LATIN  ',
-    r'CLARO\| ',
-    r'ARG\| ',
-    r'PE\| ',
-    r'US\| ',
-    r'UY\| ',
-    r'\| '
-]
-
-# Function to remove text patterns from a name
-def remove_patterns(name):
-    for pattern in patterns_to_remove:
-        name = re.sub(pattern, '', name)
-    return name.strip()
-
-# Function to connect to the database and save data
+# Function to connect to the database and save data; returns the SyncStats (None if skipped or failed)
 def save_to_database(data, allowed_category_ids, db_host, db_user, db_password, db_name):
+    connection = None
     try:
         connection = pymysql.connect(host=db_host,
                                      user=db_user,
                                      password=db_password,
-                                     database=db_name,
-                                     cursorclass=pymysql.cursors.DictCursor)
-
-        with connection.cursor() as cursor:
-            for item in data:
-                new_name = remove_patterns(item['name'])
-                cursor.execute("SELECT * FROM streams WHERE stream_id=%s", (item['stream_id'],))
-                existing_item = cursor.fetchone()
-                cursor.execute("SELECT * FROM stream_categories WHERE id=%s", (item['category_id'],))
-                existing_category = cursor.fetchone()
-                
-                if existing_category is None:
-                    category = 1153
-                else:
-                    category = item['category_id']
-
-                if existing_item:
-                    # If the name already exists and the category_id is not in the allowed list, update it.
-                    if existing_item['category_id'] not in allowed_category_ids:
-                        
-                        cursor.execute("UPDATE streams SET added=%s, category_id=%s, custom_sid=%s, direct_source=%s, epg_channel_id=%s, is_adult=%s, num=%s, stream_icon=%s, name=%s, stream_type=%s, tv_archive=%s, tv_archive_duration=%s WHERE stream_id=%s",
-                                       (item['added'], category, item['custom_sid'], item['direct_source'], item['epg_channel_id'], item['is_adult'], item['num'], item['stream_icon'], item['name'], item['stream_type'], item['tv_archive'], item['tv_archive_duration'], item['stream_id']))
-                        print(f"Data ==> Stream ID: {item['stream_id']}, Name: {item['name']}")
-                else:
-                    cursor.execute("INSERT INTO streams (name, added, category_id, custom_sid, direct_source, epg_channel_id, is_adult, num, stream_icon, stream_id, stream_type, tv_archive, tv_archive_duration) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)",
-                                   (new_name, item['added'], category, item['custom_sid'], item['direct_source'], item['epg_channel_id'], item['is_adult'], item['num'], item['stream_icon'], item['stream_id'], item['stream_type'], item['tv_archive'], item['tv_archive_duration']))
-            connection.commit()
+                                     database=db_name)
+        return sync_streams(connection, data, allowed_category_ids)
     except pymysql.Error as e:
-        print(item)
         print("Error connecting to database:", e)
+        return None
     finally:
         if connection:
             connection.close()
 
+# The full stream list is large; allow slow reads from the panel
+SYNC_TIMEOUT = (HTTP_CONNECT_TIMEOUT, float(os.getenv("SYNC_READ_TIMEOUT", "60")))
+# Rows per multi-row statement / transaction
+SYNC_BATCH_SIZE = int(os.getenv("SYNC_BATCH_SIZE", "1000"))
+
 # Define the allowed category IDs for updating
-allowed_category_ids = {1,2,3,4,5,6,7,8,9,10,11,12,13,14,15,16,17,18,19,20,21,22,23,24,25,26,27,28,29,30,31,33}
+allowed_category_ids = ALLOWED_CATEGORY_IDS
+
+# Panel the streams are pulled from
+SYNC_PANEL_URL = os.getenv("SYNC_PANEL_URL", "http://iptvsub1-elite.com").rstrip("/")
+
+# "full" fetches the whole list in one request; "category" fetches it per category, in parallel
+SYNC_STREAMS_MODE = os.getenv("SYNC_STREAMS_MODE", "full").strip().lower()
+# Category mode: parallel requests, fetched payloads held at most (waiting to be applied), HTTP retries per category
+SYNC_FETCH_WORKERS = max(1, int(os.getenv("SYNC_FETCH_WORKERS", "4")))
+SYNC_FETCH_WINDOW = max(1, int(os.getenv("SYNC_FETCH_WINDOW", str(2 * SYNC_FETCH_WORKERS))))
+SYNC_CATEGORY_RETRIES = int(os.getenv("SYNC_CATEGORY_RETRIES", "2"))
+
+SYNC_NAME = "live_streams"
+# Re-apply the payload even when its fingerprint matches the last run
+SYNC_FORCE = os.getenv("SYNC_FORCE", "false").strip().lower() in {"1", "true", "t", "yes", "y", "on"}
 
 # Function to fetch JSON data from external server
 def fetch_json_data(username, password):
     headers = {
         'User-Agent': 'curl/7.88.1'  # Replace with your specific version if needed
     }
-    url = 'http://iptvsub1-elite.com/player_api.php?username={}&password={}&action=get_live_streams'.format(username, password)
+    url = '{}/player_api.php?username={}&password={}&action=get_live_streams'.format(SYNC_PANEL_URL, username, password)
 
     # Make HTTP GET request
-    response = requests.get(url, headers=headers)
+    response = get_client().get(url, headers=headers, timeout=SYNC_TIMEOUT)
 
     # Check if request was successful (status code 200)
     if response.status_code == 200:
@@ -89,30 +96,151 @@ def fetch_json_data(username, password):
         print(f"Failed to fetch JSON data. Status code: {response.status_code}")
         return None
 
-# Get MySQL database connection details from environment variables
-DB_HOST = os.getenv("MYSQL_HOST")
-DB_USER = os.getenv("MYSQL_USER")
-DB_PASSWORD = os.getenv("MYSQL_PASSWORD")
-DB_NAME = os.getenv("MYSQL_DATABASE")
-
-USER_NAME = os.getenv("USERNAME")
-PASSWORD = os.getenv("PASSWORD")
-
-print(USER_NAME, '*******')
-
-start_time = time.time()
-
-# Fetch JSON data
-json_data = fetch_json_data(USER_NAME, PASSWORD)
-
-# Save to database
-save_to_database(json_data, allowed_category_ids, DB_HOST, DB_USER, DB_PASSWORD, DB_NAME)
-
-end_time = time.time()
-execution_time = end_time - start_time
-
-minutes = int(execution_time // 60)
-seconds = int(execution_time % 60)
+def _fetch(username, password, retries=None, **params):
+    headers = {
+        'User-Agent': 'curl/7.88.1'
+    }
+    query = {'username': username, 'password': password}
+    query.update(params)
+    return get_client().get(SYNC_PANEL_URL + '/player_api.php', params=query, headers=headers, timeout=SYNC_TIMEOUT,
+                            retries=retries)
+
+# Upstream category list (all of it: streams of categories we don't carry still go to the fallback category)
+def fetch_live_categories(username, password):
+    response = _fetch(username, password, action='get_live_categories')
+    if response.status_code != 200:
+        print(f"Failed to fetch categories. Status code: {response.status_code}")
+        return None
+    return response.json()
 
-print("Data saved to database.")
-print("Execution time: {} minutes and {} seconds".format(minutes, seconds))
+# One category's streams; the client retries it on its own so one bad category doesn't fail the run
+def fetch_category_streams(username, password, category_id):
+    try:
+        response = _fetch(username, password, retries=SYNC_CATEGORY_RETRIES,
+                          action='get_live_streams', category_id=category_id)
+        if response.status_code != 200:
+            raise RuntimeError(f"category {category_id}: HTTP {response.status_code}")
+        data = response.json()
+    except (requests.RequestException, ValueError) as e:
+        raise RuntimeError(f"category {category_id}: {e}")
+    if not isinstance(data, list):
+        raise RuntimeError(f"category {category_id}: unexpected body")
+    return data
+
+def sync_streams_by_category(connection, username, password, allowed_category_ids=ALLOWED_CATEGORY_IDS):
+    """Fetch get_live_streams per category in parallel and apply each category as it arrives.
+
+    At most SYNC_FETCH_WINDOW payloads are in memory (in flight or waiting for
+    the database), and categories are applied in the panel's order, so a stream
+    listed in two categories ends up like in the full list. The unchanged-payload
+    fingerprint skip only applies to the full mode, and this mode clears it so the
+    next full run always applies. Returns the SyncStats.
+    """
+    categories = fetch_live_categories(username, password)
+    if categories is None:
+        raise RuntimeError("get_live_categories could not be fetched")
+    category_ids = [category['category_id'] for category in categories]
+
+    # This mode writes streams without a full-payload fingerprint, so the one of the last
+    # full run no longer describes the table. Cleared before writing, so a run that
+    # stops halfway can't leave it behind either.
+    tool.clear_sync_fingerprint(connection, SYNC_NAME)
+    engine = StreamSyncEngine(connection, allowed_category_ids, normalize_name, batch_size=SYNC_BATCH_SIZE)
+    engine.load()
+    failed = []
+    pending = deque()
+    remaining = iter(category_ids)
+    with ThreadPoolExecutor(SYNC_FETCH_WORKERS, thread_name_prefix="stream-fetch") as pool:
+        def submit_next():
+            for category_id in remaining:
+                pending.append((category_id, pool.submit(fetch_category_streams, username, password, category_id)))
+                return
+
+        for _ in range(SYNC_FETCH_WINDOW):
+            submit_next()
+        while pending:
+            category_id, future = pending.popleft()
+            with engine.stats.phase("fetch_wait"):
+                try:
+                    rows = future.result()
+                except RuntimeError as e:
+                    print("Skipping", e)
+                    failed.append(category_id)
+                    rows = None
+            # Fetch the next category while this one is written
+            submit_next()
+            if rows:
+                inserts, updates = engine.diff(rows)
+                rows = None
+                engine.apply(inserts, updates)
+
+    if category_ids and len(failed) == len(category_ids):
+        raise RuntimeError("no category could be fetched")
+    # Streams of failed categories are counted as missing upstream; they are kept like any other.
+    stats = engine.finish()
+    stats.counts["categories"] = len(category_ids)
+    stats.counts["failed_categories"] = len(failed)
+    print("Sync stats ==> mode=category, {}".format(stats.summary()))
+    if failed:
+        print("Categories not fetched:", ", ".join(str(category_id) for category_id in failed))
+    if engine.changed:
+        tool.bump_catalog_version(connection)
+    return stats
+
+# Entry point of the in-process scheduler (scheduler.py): fetch and apply on the given connection.
+# Errors are raised instead of printed, so the run is recorded as failed.
+def run(connection, username, password):
+    if SYNC_STREAMS_MODE == "category":
+        return dict(sync_streams_by_category(connection, username, password).counts, skipped=0)
+    data = fetch_json_data(username, password)
+    if data is None:
+        raise RuntimeError("get_live_streams could not be fetched")
+    stats = sync_streams(connection, data)
+    if stats is None:
+        return {"skipped": 1, "fetched": len(data)}
+    return dict(stats.counts, skipped=0)
+
+if __name__ == '__main__':
+    # Get MySQL database connection details from environment variables
+    DB_HOST = os.getenv("MYSQL_HOST")
+    DB_USER = os.getenv("MYSQL_USER")
+    DB_PASSWORD = os.getenv("MYSQL_PASSWORD")
+    DB_NAME = os.getenv("MYSQL_DATABASE")
+
+    USER_NAME = os.getenv("USERNAME")
+    PASSWORD = os.getenv("PASSWORD")
+
+    print(USER_NAME, '*******')
+
+    start_time = time.time()
+
+    # Never overlap with another run (cron or the API's scheduler)
+    with SyncLock() as acquired:
+        if not acquired:
+            print("Another sync is running; skipping this run.")
+            sys.exit(0)
+
+        if SYNC_STREAMS_MODE == "category":
+            connection = pymysql.connect(host=DB_HOST, user=DB_USER, password=DB_PASSWORD, database=DB_NAME)
+            try:
+                sync_streams_by_category(connection, USER_NAME, PASSWORD, allowed_category_ids)
+            except (pymysql.Error, RuntimeError) as e:
+                print("Stream sync failed:", e)
+            finally:
+                connection.close()
+        else:
+            # Fetch JSON data
+            json_data = fetch_json_data(USER_NAME, PASSWORD)
+
+            # Save to database
+            if json_data is not None:
+                save_to_database(json_data, allowed_category_ids, DB_HOST, DB_USER, DB_PASSWORD, DB_NAME)
+
+    end_time = time.time()
+    execution_time = end_time - start_time
+
+    minutes = int(execution_time // 60)
+    seconds = int(execution_time % 60)
+
+    print("Data saved to database.")
+    print("Execution time: {} minutes and {} seconds".format(minutes, seconds))
@@ -0,0 +1,75 @@
+import os
+import sys
+import time
+import logging
+
+import pymysql
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from http_client import HTTP_CONNECT_TIMEOUT, get_client
+from epg import EPG_GUIDE_PATH, filter_guide
+
+# The upstream guide is large; allow slow reads from the panel
+SYNC_TIMEOUT = (HTTP_CONNECT_TIMEOUT, float(os.getenv("SYNC_READ_TIMEOUT", "60")))
+# Full upstream XMLTV URL (or a local file path); defaults to the panel's xmltv.php
+EPG_SOURCE_URL = os.getenv("EPG_SOURCE_URL")
+SYNC_PANEL_URL = os.getenv("SYNC_PANEL_URL", "http://iptvsub1-elite.com").rstrip("/")
+
+
+def load_channel_ids(db_host, db_user, db_password, db_name):
+    # Only the channels we actually carry end up in the guide
+    connection = pymysql.connect(host=db_host, user=db_user, password=db_password, database=db_name)
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT DISTINCT epg_channel_id FROM streams"
+                           " WHERE epg_channel_id IS NOT NULL AND epg_channel_id <> ''")
+            return {row[0] for row in cursor.fetchall()}
+    finally:
+        connection.close()
+
+
+def build_guide(source, channel_ids, dest_path):
+    if not source.startswith(("http://", "https://")):
+        return filter_guide(source, dest_path, channel_ids)
+    headers = {
+        'User-Agent': 'curl/7.88.1'
+    }
+    response = get_client().get(source, headers=headers, timeout=SYNC_TIMEOUT, stream=True)
+    try:
+        response.raise_for_status()
+        # Parse while downloading; gzip transfer encoding is undone by urllib3
+        response.raw.decode_content = True
+        return filter_guide(response.raw, dest_path, channel_ids)
+    finally:
+        response.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    DB_HOST = os.getenv("MYSQL_HOST")
+    DB_USER = os.getenv("MYSQL_USER")
+    DB_PASSWORD = os.getenv("MYSQL_PASSWORD")
+    DB_NAME = os.getenv("MYSQL_DATABASE")
+
+    USER_NAME = os.getenv("USERNAME")
+    PASSWORD = os.getenv("PASSWORD")
+
+    start_time = time.time()
+
+    source = EPG_SOURCE_URL or '{}/xmltv.php?username={}&password={}'.format(SYNC_PANEL_URL, USER_NAME, PASSWORD)
+    dest_path = os.path.join(ROOT_DIR, EPG_GUIDE_PATH)
+
+    channel_ids = load_channel_ids(DB_HOST, DB_USER, DB_PASSWORD, DB_NAME)
+    logging.info("EPG channels carried: %d", len(channel_ids))
+    if not channel_ids:
+        logging.error("No epg_channel_id in streams; keeping the current guide.")
+        sys.exit(1)
+
+    stats = build_guide(source, channel_ids, dest_path)
+    logging.info("EPG stats: %s", ", ".join(f"{k}={v}" for k, v in stats.items()))
+
+    execution_time = time.time() - start_time
+    logging.info("Execution time: {} minutes and {} seconds".format(int(execution_time // 60), int(execution_time % 60)))
@@ -1,3 +1,14 @@
+import json
+import hashlib
+
+import pymysql
+
+# Categories curated locally; streams placed in them are never overwritten by the sync.
+ALLOWED_CATEGORY_IDS = frozenset({1,2,3,4,5,6,7,8,9,10,11,12,13,14,15,16,17,18,19,20,21,22,23,24,25,26,27,28,29,30,31,33})
+
+# Bump when the sync logic changes, so the next run re-applies unchanged payloads.
+SYNC_FINGERPRINT_VERSION = 1
+
 class Tools:
     def remove_categories_by_name(self, categories_from_server):
         categories_to_remove = [
@@ -33,4 +44,73 @@ class Tools:
             if existing_item:
                 merged_dict.remove(existing_item)
             merged_dict.append(item)
-        return merged_dict
\ No newline at end of file
+        return merged_dict
+
+    def bump_catalog_version(self, connection):
+        # Invalidate the API's catalog cache; call after the sync has committed its changes.
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "CREATE TABLE IF NOT EXISTS catalog_version ("
+                " id TINYINT NOT NULL PRIMARY KEY,"
+                " version BIGINT NOT NULL DEFAULT 0,"
+                " updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP"
+                ")"
+            )
+            cursor.execute(
+                "INSERT INTO catalog_version (id, version) VALUES (1, 1)"
+                " ON DUPLICATE KEY UPDATE version = version + 1, updated_at = CURRENT_TIMESTAMP"
+            )
+        connection.commit()
+
+    def payload_fingerprint(self, data, context=None):
+        # Content hash of an upstream payload plus the local state that shapes its result
+        # (``context``); when neither changed there is nothing to sync.
+        digest = hashlib.sha256(str(SYNC_FINGERPRINT_VERSION).encode("ascii"))
+        digest.update(json.dumps(data, sort_keys=True, separators=(",", ":")).encode("utf-8"))
+        if context is not None:
+            digest.update(b"\0")
+            digest.update(json.dumps(context, sort_keys=True, separators=(",", ":")).encode("utf-8"))
+        return digest.hexdigest()
+
+    def local_category_ids(self, connection):
+        with connection.cursor(pymysql.cursors.Cursor) as cursor:
+            cursor.execute("SELECT id FROM stream_categories")
+            return sorted(row[0] for row in cursor.fetchall())
+
+    def _ensure_sync_state(self, cursor):
+        cursor.execute(
+            "CREATE TABLE IF NOT EXISTS sync_state ("
+            " name VARCHAR(64) NOT NULL PRIMARY KEY,"
+            " fingerprint CHAR(64) NOT NULL,"
+            " record_count INT NOT NULL DEFAULT 0,"
+            " updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP"
+            ")"
+        )
+
+    def get_sync_fingerprint(self, connection, name):
+        with connection.cursor() as cursor:
+            self._ensure_sync_state(cursor)
+            cursor.execute("SELECT fingerprint FROM sync_state WHERE name = %s", (name,))
+            row = cursor.fetchone()
+        connection.commit()
+        if not row:
+            return None
+        return row["fingerprint"] if isinstance(row, dict) else row[0]
+
+    def save_sync_fingerprint(self, connection, name, fingerprint, record_count):
+        # Call only after the payload has been fully applied and committed.
+        with connection.cursor() as cursor:
+            self._ensure_sync_state(cursor)
+            cursor.execute(
+                "INSERT INTO sync_state (name, fingerprint, record_count) VALUES (%s, %s, %s)"
+                " ON DUPLICATE KEY UPDATE fingerprint = VALUES(fingerprint), record_count = VALUES(record_count)",
+                (name, fingerprint, record_count),
+            )
+        connection.commit()
+
+    def clear_sync_fingerprint(self, connection, name):
+        # The table is about to change outside the fingerprinted payload: the next run must apply.
+        with connection.cursor() as cursor:
+            self._ensure_sync_state(cursor)
+            cursor.execute("DELETE FROM sync_state WHERE name = %s", (name,))
+        connection.commit()
@@ -0,0 +1,43 @@
+import os
+import sys
+import base64
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hls import HlsCache
+
+URL = "http://panel.example:8080/live/line_user/line_pass/12/segment-1.ts"
+
+
+def _name(link):
+    return link.rsplit("/", 1)[-1]
+
+
+class HlsLinkTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = HlsCache(None, secret="secret", username="line_user", password="line_pass", enabled=True)
+
+    def test_round_trip(self):
+        self.assertEqual(self.cache.resolve("12", _name(self.cache.link("12", URL))), (URL, "ts"))
+
+    def test_panel_line_is_not_readable(self):
+        payload = _name(self.cache.link("12", URL)).split(".")[0]
+        decoded = base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4))
+        self.assertNotIn(b"line_user", decoded)
+        self.assertNotIn(b"line_pass", decoded)
+
+    def test_rejects_other_stream_and_tampering(self):
+        payload, expires, ext = _name(self.cache.link("12", URL)).split(".")
+        self.assertEqual(self.cache.resolve("13", f"{payload}.{expires}.{ext}"), (None, None))
+        self.assertEqual(self.cache.resolve("12", f"{payload}.{int(expires) + 60}.{ext}"), (None, None))
+        flipped = ("B" if payload[0] == "A" else "A") + payload[1:]
+        self.assertEqual(self.cache.resolve("12", f"{flipped}.{expires}.{ext}"), (None, None))
+
+    def test_rejects_expired(self):
+        self.cache.link_ttl = -1
+        self.assertEqual(self.cache.resolve("12", _name(self.cache.link("12", URL))), (None, None))
+
+
+if __name__ == "__main__":
+    unittest.main()
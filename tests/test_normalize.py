@@ -0,0 +1,46 @@
+import os
+import re
+import sys
+import json
+import random
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sync.normalize import PATTERNS_TO_REMOVE, normalize_name
+
+
+def legacy_normalize(name):
+    # The original per-pattern loop the sync used before sync/normalize.py.
+    for pattern in PATTERNS_TO_REMOVE:
+        name = re.sub(pattern, '', name)
+    return name.strip()
+
+
+# Prefix fragments that panels combine in channel names.
+TOKENS = ["OL|", "US", "LATIN", "ARG|", "CLARO|", "MX|", "LA:", "MXC:", "LATINO", "|", "(LATIN)",
+          "PE|", "UY|", "US|", "HD", "S", "ESPN", "", " ", "  "]
+
+
+class NormalizeNameTest(unittest.TestCase):
+    def test_known_cases(self):
+        self.assertEqual(normalize_name("|CLARO|  MX| "), "")
+        self.assertEqual(normalize_name("|OL| US LATIN ARG|  S"), "S")
+        self.assertEqual(normalize_name("LA: ESPN HD"), "ESPN HD")
+
+    def test_matches_legacy_loop(self):
+        rng = random.Random(1234)
+        for _ in range(50000):
+            name = "".join(rng.choice(TOKENS) + rng.choice(("", " ", "  ")) for _ in range(rng.randint(1, 8)))
+            self.assertEqual(normalize_name(name), legacy_normalize(name), repr(name))
+
+    def test_seed_names(self):
+        path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "seed", "data.json")
+        with open(path) as f:
+            names = [entry["name"] for entry in json.load(f)]
+        for name in names:
+            self.assertEqual(normalize_name(name), legacy_normalize(name), repr(name))
+
+
+if __name__ == "__main__":
+    unittest.main()
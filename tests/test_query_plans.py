@@ -0,0 +1,93 @@
+"""Query plans of the API's hot statements on a migrated schema (needs MariaDB).
+
+    MYSQL_HOST=127.0.0.1 MYSQL_USER=root MYSQL_PASSWORD=... MYSQL_TEST_DATABASE=xtream_test \\
+        python -m pytest tests/test_query_plans.py
+
+The database named by MYSQL_TEST_DATABASE is wiped; its name must contain "test".
+Skipped when the variable is not set.
+"""
+import os
+import re
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import pymysql
+
+import migrate
+
+MYSQL_TEST_DATABASE = os.environ.get("MYSQL_TEST_DATABASE")
+_TABLES = ("user_server_info", "streams", "users", "stream_categories", "server_dns",
+           "catalog_version", "sync_state", "schema_migrations")
+
+
+def _schema_statements():
+    with open(os.path.join(ROOT, "docker", "mysql", "init.sql")) as f:
+        statements = migrate.split_statements(f.read())
+    return [s for s in statements if not re.match(r"^(CREATE DATABASE|USE)\b", s, re.I)]
+
+
+def _show_create(cursor):
+    tables = {}
+    for table in _TABLES:
+        if table == "schema_migrations":
+            continue
+        cursor.execute("SHOW CREATE TABLE " + table)
+        # AUTO_INCREMENT counters are data, not schema.
+        tables[table] = re.sub(r" AUTO_INCREMENT=\d+", "", cursor.fetchone()[1])
+    return tables
+
+
+@unittest.skipUnless(MYSQL_TEST_DATABASE, "MYSQL_TEST_DATABASE is not set")
+class QueryPlanTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        if "test" not in MYSQL_TEST_DATABASE:
+            raise unittest.SkipTest(f"refusing to wipe {MYSQL_TEST_DATABASE!r}; use a *test* database")
+        cls.connection = pymysql.connect(host=os.environ.get("MYSQL_HOST"), user=os.environ.get("MYSQL_USER"),
+                                         password=os.environ.get("MYSQL_PASSWORD"),
+                                         database=MYSQL_TEST_DATABASE, autocommit=True)
+        with cls.connection.cursor() as cursor:
+            cursor.execute("SET FOREIGN_KEY_CHECKS = 0")
+            cursor.execute("DROP TABLE IF EXISTS " + ", ".join(_TABLES))
+            for statement in _schema_statements():
+                cursor.execute(statement)
+            cursor.execute("SET FOREIGN_KEY_CHECKS = 1")
+            cls.fresh_schema = _show_create(cursor)
+            # Re-run every migration on top of the fresh schema, as on an upgraded database.
+            cursor.execute("DELETE FROM schema_migrations")
+        migrate.migrate_up(cls.connection)
+        with cls.connection.cursor() as cursor:
+            cls.migrated_schema = _show_create(cursor)
+            # Enough rows that a full scan is never the cheaper plan.
+            cursor.executemany("INSERT INTO users (username, password) VALUES (%s, %s)",
+                               [(f"user{i}", f"pass{i}") for i in range(5000)])
+            cursor.execute("SELECT id FROM stream_categories")
+            category_ids = [row[0] for row in cursor.fetchall()]
+            cursor.executemany("INSERT INTO streams (name, stream_id, category_id) VALUES (%s, %s, %s)",
+                               [(None if i % 500 == 0 else f"Channel {i}", i, category_ids[i % len(category_ids)])
+                                for i in range(1, 20001)])
+            cursor.execute("ANALYZE TABLE users, streams, stream_categories")
+            cursor.fetchall()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.connection.close()
+
+    def test_init_sql_matches_migrated_schema(self):
+        # A fresh docker database must not differ from one brought up to date with migrate.py.
+        self.assertEqual(self.fresh_schema, self.migrated_schema)
+
+    def test_hot_queries_use_their_indexes(self):
+        for description, table, key, row in migrate.explain_hot_queries(self.connection):
+            with self.subTest(description):
+                self.assertIsNotNone(row, f"{table} missing from the plan")
+                self.assertEqual(row["key"], key)
+                self.assertNotEqual(row["type"], "ALL")
+                self.assertFalse(migrate.uses_filesort(row), row["Extra"])
+
+
+if __name__ == "__main__":
+    unittest.main()
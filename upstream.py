@@ -0,0 +1,203 @@
+import os
+import time
+import random
+import logging
+import threading
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+# Seconds between health probes of every upstream panel.
+UPSTREAM_PROBE_INTERVAL = float(os.environ.get("UPSTREAM_PROBE_INTERVAL", "15"))
+UPSTREAM_PROBE_TIMEOUT = float(os.environ.get("UPSTREAM_PROBE_TIMEOUT", "3"))
+# Seconds between reloads of the server_dns table.
+UPSTREAM_RELOAD_INTERVAL = float(os.environ.get("UPSTREAM_RELOAD_INTERVAL", "60"))
+# Consecutive failures (probes or real requests) before a host is ejected.
+UPSTREAM_EJECT_AFTER = int(os.environ.get("UPSTREAM_EJECT_AFTER", "3"))
+UPSTREAM_FALLBACK_URL = os.environ.get("UPSTREAM_FALLBACK_URL", "http://m3u.star4k.me")
+
+
+class NoUpstreamError(requests.exceptions.ConnectionError):
+    """``server_dns`` has no hosts and ``UPSTREAM_FALLBACK_URL`` is empty."""
+
+
+# Weight of the newest sample in the latency moving average.
+_EWMA_ALPHA = 0.3
+# Latency assumed for hosts that haven't been measured yet.
+_UNKNOWN_LATENCY = 1.0
+# Floor so one very fast probe can't starve every other host.
+_MIN_LATENCY = 0.01
+
+
+class UpstreamHost:
+    __slots__ = ("url", "healthy", "latency", "failures", "last_probe", "last_error")
+
+    def __init__(self, url):
+        self.url = url
+        self.healthy = True
+        self.latency = None
+        self.failures = 0
+        self.last_probe = None
+        self.last_error = None
+
+    def weight(self) -> float:
+        latency = self.latency if self.latency is not None else _UNKNOWN_LATENCY
+        return 1.0 / max(latency, _MIN_LATENCY)
+
+
+class UpstreamPool:
+    """All panels from ``server_dns``, probed in the background and picked by latency.
+
+    Selection is weighted by ``1 / latency`` among healthy hosts. A host is
+    ejected after ``eject_after`` consecutive failures and re-added on its next
+    successful probe. The host list is reloaded from the database periodically.
+    """
+
+    def __init__(self, url_loader, http, probe_interval=UPSTREAM_PROBE_INTERVAL,
+                 probe_timeout=UPSTREAM_PROBE_TIMEOUT, reload_interval=UPSTREAM_RELOAD_INTERVAL,
+                 eject_after=UPSTREAM_EJECT_AFTER, fallback_url=UPSTREAM_FALLBACK_URL):
+        self.url_loader = url_loader
+        self.http = http
+        self.probe_interval = probe_interval
+        self.probe_timeout = probe_timeout
+        self.reload_interval = reload_interval
+        self.eject_after = max(1, eject_after)
+        self.fallback_url = fallback_url
+
+        self._lock = threading.Lock()
+        self._hosts: dict[str, UpstreamHost] = {}
+        self._thread = None
+        self._thread_pid = None
+        self._stop = threading.Event()
+        self._last_reload = 0.0
+        self.reload()
+
+    def reload(self):
+        """Sync the host list with ``server_dns``; keeps the health of hosts that remain."""
+        try:
+            urls = [u.rstrip("/") for u in self.url_loader() if u]
+        except Exception:
+            logger.exception("Could not load upstream hosts")
+            return
+        with self._lock:
+            self._last_reload = time.monotonic()
+            if not urls:
+                return
+            current = set(self._hosts)
+            for url in urls:
+                if url not in self._hosts:
+                    self._hosts[url] = UpstreamHost(url)
+            for url in current - set(urls):
+                del self._hosts[url]
+        if set(urls) != current:
+            logger.info("Upstream hosts: %s", ", ".join(urls))
+
+    def _ensure_prober(self):
+        # Threads don't survive fork, so each worker process starts its own prober.
+        if self.probe_interval <= 0:
+            return
+        if self._thread is not None and self._thread_pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread_pid == os.getpid():
+                return
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self._run, name="upstream-prober", daemon=True)
+            self._thread_pid = os.getpid()
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            if time.monotonic() - self._last_reload >= self.reload_interval:
+                self.reload()
+            self.probe_all()
+            self._stop.wait(self.probe_interval)
+
+    def stop(self):
+        self._stop.set()
+
+    def probe_all(self):
+        with self._lock:
+            hosts = list(self._hosts.values())
+        for host in hosts:
+            self.probe(host)
+
+    def probe(self, host: UpstreamHost):
+        # Any HTTP answer from player_api.php means the panel is up; 5xx counts as down.
+        start = time.monotonic()
+        try:
+            response = self.http.get(host.url + "/player_api.php",
+                                     timeout=(self.probe_timeout, self.probe_timeout), retries=0)
+            response.close()
+            if response.status_code >= 500:
+                raise IOError(f"HTTP {response.status_code}")
+        except Exception as e:
+            self.report_failure(host.url, e, probe=True)
+        else:
+            self.report_success(host.url, time.monotonic() - start, probe=True)
+
+    def report_success(self, url, elapsed=None, probe=False):
+        with self._lock:
+            host = self._hosts.get(url)
+            if host is None:
+                return
+            if elapsed is not None:
+                host.latency = elapsed if host.latency is None else (
+                    _EWMA_ALPHA * elapsed + (1 - _EWMA_ALPHA) * host.latency)
+            if probe:
+                host.last_probe = time.time()
+            host.failures = 0
+            if not host.healthy:
+                host.healthy = True
+                logger.info("Upstream %s recovered", url)
+
+    def report_failure(self, url, error=None, probe=False):
+        with self._lock:
+            host = self._hosts.get(url)
+            if host is None:
+                return
+            if probe:
+                host.last_probe = time.time()
+            host.failures += 1
+            host.last_error = repr(error) if error is not None else None
+            if host.healthy and host.failures >= self.eject_after:
+                host.healthy = False
+                logger.warning("Upstream %s ejected after %d failures: %s", url, host.failures, host.last_error)
+
+    def pick(self, exclude=()):
+        """Return a base URL, favouring the fastest healthy hosts.
+
+        ``UPSTREAM_FALLBACK_URL`` is only used while ``server_dns`` has no hosts
+        (:class:`NoUpstreamError` if it is empty too); once every host is in
+        ``exclude`` this returns None, so a retry never sends credentials to a
+        host outside the table.
+        """
+        self._ensure_prober()
+        with self._lock:
+            if not self._hosts:
+                if not self.fallback_url:
+                    raise NoUpstreamError("server_dns has no hosts and UPSTREAM_FALLBACK_URL is empty")
+                return self.fallback_url if self.fallback_url not in exclude else None
+            candidates = [h for h in self._hosts.values() if h.healthy and h.url not in exclude]
+            if not candidates:
+                # Everything is ejected: try the host with the fewest failures.
+                candidates = sorted((h for h in self._hosts.values() if h.url not in exclude),
+                                    key=lambda h: h.failures)[:1]
+            if not candidates:
+                return None
+            weights = [h.weight() for h in candidates]
+        return random.choices(candidates, weights=weights, k=1)[0].url
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                url: {
+                    "healthy": host.healthy,
+                    "latency_seconds": round(host.latency, 6) if host.latency is not None else None,
+                    "failures": host.failures,
+                    "last_probe": host.last_probe,
+                    "last_error": host.last_error,
+                }
+                for url, host in self._hosts.items()
+            }
@@ -0,0 +1,213 @@
+import os
+import gzip
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import SingleFlight
+from responses import gzip_bytes
+
+logger = logging.getLogger(__name__)
+
+
+def _env_bool(name: str, default: bool = False) -> bool:
+    raw = os.environ.get(name)
+    if raw is None:
+        return default
+    return str(raw).strip().lower() in {"1", "true", "t", "yes", "y", "on"}
+
+
+# Serve the VOD/series player_api actions from a local cache instead of redirecting to the panel.
+VOD_CACHE_ENABLED = _env_bool("VOD_CACHE_ENABLED", False)
+# Panel line the cached responses are fetched with (defaults to the sync scripts' line).
+VOD_USERNAME = os.environ.get("VOD_USERNAME") or os.environ.get("USERNAME") or ""
+VOD_PASSWORD = os.environ.get("VOD_PASSWORD") or os.environ.get("PASSWORD") or ""
+# Compressed bytes kept per worker.
+VOD_CACHE_MAX_BYTES = int(os.environ.get("VOD_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+# Seconds past its TTL an entry is still served while it is refreshed in the background.
+VOD_CACHE_MAX_STALE = float(os.environ.get("VOD_CACHE_MAX_STALE", "86400"))
+VOD_REFRESH_WORKERS = int(os.environ.get("VOD_REFRESH_WORKERS", "2"))
+
+# action -> request parameter that is part of the key (the *_info actions require it).
+VOD_ACTIONS = {
+    "get_vod_categories": None,
+    "get_vod_streams": "category_id",
+    "get_vod_info": "vod_id",
+    "get_series_categories": None,
+    "get_series": "category_id",
+    "get_series_info": "series_id",
+}
+_DEFAULT_TTLS = {
+    "get_vod_categories": 3600,
+    "get_vod_streams": 3600,
+    "get_vod_info": 86400,
+    "get_series_categories": 3600,
+    "get_series": 3600,
+    "get_series_info": 21600,
+}
+# Per-action TTL in seconds, e.g. VOD_CACHE_TTL_GET_VOD_STREAMS=1800
+VOD_CACHE_TTLS = {action: float(os.environ.get("VOD_CACHE_TTL_" + action.upper(), ttl))
+                  for action, ttl in _DEFAULT_TTLS.items()}
+
+
+class VodUpstreamError(Exception):
+    pass
+
+
+class VodEntry:
+    """A cached response, kept only gzip-compressed."""
+
+    __slots__ = ("gzip_body", "size", "etag", "last_modified", "fetched_at")
+
+    def __init__(self, body: bytes):
+        self.gzip_body = gzip_bytes(body)
+        self.size = len(body)
+        self.etag = "vod-" + hashlib.sha1(body).hexdigest()[:16]
+        self.last_modified = int(time.time())
+        self.fetched_at = time.monotonic()
+
+    def body(self) -> bytes:
+        return gzip.decompress(self.gzip_body)
+
+    def gzipped(self) -> bytes:
+        return self.gzip_body
+
+
+class VodCache:
+    """VOD and series catalog responses, fetched once with one line and shared by every client.
+
+    ``fetch(action, params)`` returns the upstream body bytes. Entries expire
+    after their action's TTL; an expired entry is still served for up to
+    ``max_stale`` seconds while a background thread refreshes it, and also when
+    the panel fails. Concurrent misses share one fetch. Size is bounded by the
+    compressed bytes held, least recently used first.
+    """
+
+    def __init__(self, fetch, ttls=VOD_CACHE_TTLS, max_bytes=VOD_CACHE_MAX_BYTES, max_stale=VOD_CACHE_MAX_STALE,
+                 refresh_workers=VOD_REFRESH_WORKERS, enabled=VOD_CACHE_ENABLED):
+        self.fetch = fetch
+        self.ttls = ttls
+        self.max_bytes = max_bytes
+        self.max_stale = max_stale
+        self.refresh_workers = max(1, refresh_workers)
+        self.enabled = enabled
+        self._entries: "OrderedDict[tuple, VodEntry]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._flight = SingleFlight()
+        self._refreshing = set()
+        self._executor = None
+        self._executor_pid = None
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.errors = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key_for(action, args):
+        """Cache key for a request, or None if it can't be served from the cache."""
+        if action not in VOD_ACTIONS:
+            return None
+        name = VOD_ACTIONS[action]
+        if name is None:
+            return (action,)
+        value = args.get(name) or ""
+        if not value and action.endswith("_info"):
+            return None
+        return action, value
+
+    def get(self, key) -> VodEntry:
+        ttl = self.ttls.get(key[0], 0)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is not None:
+            age = time.monotonic() - entry.fetched_at
+            if age < ttl:
+                self.hits += 1
+                return entry
+            if age < ttl + self.max_stale:
+                self.stale_hits += 1
+                self._refresh_later(key)
+                return entry
+        self.misses += 1
+        try:
+            return self._flight.do(key, lambda: self._load(key))
+        except Exception:
+            if entry is None:
+                raise
+            # Very old, but better than nothing while the panel is failing.
+            logger.warning("VOD refresh of %s failed; serving the stored copy", key[0], exc_info=True)
+            return entry
+
+    def _load(self, key):
+        params = {VOD_ACTIONS[key[0]]: key[1]} if len(key) > 1 and key[1] else {}
+        body = self.fetch(key[0], params)
+        entry = VodEntry(body)
+        self._store(key, entry)
+        return entry
+
+    def _store(self, key, entry):
+        size = len(entry.gzip_body)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old.gzip_body)
+            self._entries[key] = entry
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted.gzip_body)
+                self.evictions += 1
+
+    def _pool(self):
+        # Threads don't survive fork, so each worker process gets its own pool.
+        if self._executor_pid != os.getpid():
+            self._executor = ThreadPoolExecutor(self.refresh_workers, thread_name_prefix="vod-refresh")
+            self._executor_pid = os.getpid()
+            self._refreshing = set()
+        return self._executor
+
+    def _refresh_later(self, key):
+        with self._lock:
+            pool = self._pool()
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+            self.refreshes += 1
+
+        def run():
+            try:
+                self._flight.do(key, lambda: self._load(key))
+            except Exception:
+                self.errors += 1
+                logger.warning("Background VOD refresh of %s failed", key[0], exc_info=True)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        pool.submit(run)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "refreshes": self.refreshes,
+                "errors": self.errors,
+                "evictions": self.evictions,
+            }